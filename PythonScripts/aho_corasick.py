@@ -0,0 +1,148 @@
+"""
+Automate d'Aho-Corasick, pour trouver toutes les occurrences de toutes les clés d'un dictionnaire de NER dans un texte en un seul passage sur le texte,
+au lieu de tester chaque clé une par une.
+
+Auteur: Nathan Cerisara
+"""
+
+
+#
+class AhoCorasickAutomaton:
+    """
+    Automate de recherche de plusieurs motifs à la fois.
+    Les motifs sont identifiés par leur indice dans la liste donnée à la création.
+    """
+
+    def __init__(self, patterns: list[str]) -> None:
+        """
+        Compile l'automate pour la liste de motifs donnée.
+
+        Args:
+            patterns (list[str]): Les motifs à rechercher (les motifs vides sont ignorés)
+        """
+
+        #
+        self.patterns: list[str] = patterns
+
+        # Transitions de chaque état, état 0 = racine
+        self.transitions: list[dict[str, int]] = [{}]
+        # Lien d'échec de chaque état (plus long suffixe propre qui est aussi un préfixe d'un motif)
+        self.fail: list[int] = [0]
+        # Motifs reconnus en arrivant dans chaque état (y compris ceux des états suivis par les liens d'échec)
+        self.outputs: list[list[int]] = [[]]
+
+        # Construction du trie
+        for pattern_id, pattern in enumerate(patterns):
+            #
+            if len(pattern) == 0:
+                continue
+            #
+            state: int = 0
+            for c in pattern:
+                if not c in self.transitions[state]:
+                    self.transitions.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.transitions[state][c] = len(self.transitions) - 1
+                state = self.transitions[state][c]
+            #
+            self.outputs[state].append(pattern_id)
+
+        # Liens d'échec, par un parcours en largeur
+        queue: list[int] = list(self.transitions[0].values())
+        i: int = 0
+        while i < len(queue):
+            #
+            state = queue[i]
+            i += 1
+            #
+            for c, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                #
+                f: int = self.fail[state]
+                while f != 0 and not c in self.transitions[f]:
+                    f = self.fail[f]
+                self.fail[next_state] = self.transitions[f][c] if c in self.transitions[f] and self.transitions[f][c] != next_state else 0
+                #
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    #
+    def find_all(self, txt: str) -> list[tuple[int, int]]:
+        """
+        Trouve toutes les occurrences (même chevauchantes) des motifs dans le texte.
+
+        Args:
+            txt (str): Le texte
+
+        Returns:
+            list[tuple[int, int]]: Liste de (position de fin de l'occurrence (exclue), indice du motif), dans l'ordre des positions de fin
+        """
+
+        #
+        occurrences: list[tuple[int, int]] = []
+        state: int = 0
+        #
+        for pos, c in enumerate(txt):
+            #
+            while state != 0 and not c in self.transitions[state]:
+                state = self.fail[state]
+            state = self.transitions[state].get(c, 0)
+            #
+            for pattern_id in self.outputs[state]:
+                occurrences.append( (pos + 1, pattern_id) )
+        #
+        return occurrences
+
+    #
+    def find_patterns(self, txt: str) -> set[int]:
+        """
+        Renvoie les indices des motifs présents au moins une fois dans le texte.
+
+        Args:
+            txt (str): Le texte
+
+        Returns:
+            set[int]: Indices des motifs présents
+        """
+
+        #
+        return set(pattern_id for _, pattern_id in self.find_all(txt))
+
+    #
+    def replace(self, txt: str, replacements: list[str]) -> str:
+        """
+        Remplace les occurrences des motifs dans le texte, en un seul passage :
+        parmi les occurrences qui se chevauchent, on garde la plus à gauche, puis la plus longue.
+
+        Args:
+            txt (str): Le texte
+            replacements (list[str]): Texte de remplacement de chaque motif
+
+        Returns:
+            str: Le texte avec les remplacements
+        """
+
+        #
+        occurrences: list[tuple[int, int]] = self.find_all(txt)
+        if len(occurrences) == 0:
+            return txt
+
+        # (début, -longueur, motif), pour trier par position de début puis par longueur décroissante
+        matches: list[tuple[int, int, int]] = sorted((end - len(self.patterns[pattern_id]), -len(self.patterns[pattern_id]), pattern_id) for end, pattern_id in occurrences)
+
+        #
+        parts: list[str] = []
+        cursor: int = 0
+        for start, neg_length, pattern_id in matches:
+            #
+            if start < cursor:
+                continue
+            #
+            parts.append(txt[cursor:start])
+            parts.append(replacements[pattern_id])
+            cursor = start - neg_length
+        #
+        parts.append(txt[cursor:])
+
+        #
+        return "".join(parts)
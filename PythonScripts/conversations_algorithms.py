@@ -10,17 +10,68 @@ from typing import Optional, Any, cast
 
 import os
 import json
+import numpy as np
 from torch import Tensor
 
 from message import Message, MessagePart
 from search_engine import SearchEngine
+from windowed_distances import WindowedDistancesMatrix
 from config import Config
-from lib import ConfigError, Date, avg, median
+from lib import ConfigError, Date
 
 from profiling import profiling_task_start, profiling_last_task_ends
 
 
+# Nombre d'itérations maximal par défaut de l'algorithme de clustering par fusion
+DEFAULT_FUSION_MAX_ITERATIONS: int = 100
 
+# Statistiques possibles pour la distance d'un message à une conversation (calculée sur les distances du message à chaque message de la conversation)
+CONVERSATION_DISTANCE_STATISTICS: set[str] = {"avg", "min", "max", "median"}
+
+
+#
+def conversations_distances(msg_dists: np.ndarray, msgs_conversations: np.ndarray, nb_conversations: int, statistic: str) -> np.ndarray:
+    """
+    Calcule la distance d'un message à chaque conversation, à partir de ses distances aux messages déjà répartis.
+    Les sommes par conversation sont le produit des distances par la matrice d'appartenance aux conversations (calculé avec `np.bincount`),
+    et seule la statistique demandée est calculée.
+
+    Args:
+        msg_dists (np.ndarray): Distances du message à chaque message déjà réparti (ou seulement à ceux de sa fenêtre). De dimension (m,).
+        msgs_conversations (np.ndarray): Conversation de chaque message déjà réparti. De dimension (m,).
+        nb_conversations (int): Nombre de conversations
+        statistic (str): Statistique à calculer (voir `CONVERSATION_DISTANCE_STATISTICS`)
+
+    Returns:
+        np.ndarray: Distance du message à chaque conversation (infinie pour une conversation dont aucun message n'est donné). De dimension (nb_conversations,).
+    """
+
+    #
+    counts: np.ndarray = np.bincount(msgs_conversations, minlength=nb_conversations)
+    res: np.ndarray
+
+    #
+    if statistic == "avg":
+        sums: np.ndarray = np.bincount(msgs_conversations, weights=msg_dists, minlength=nb_conversations)
+        res = sums / np.maximum(counts, 1)
+    #
+    elif statistic == "min":
+        res = np.full(nb_conversations, np.inf)
+        np.minimum.at(res, msgs_conversations, msg_dists)
+    #
+    elif statistic == "max":
+        res = np.full(nb_conversations, -np.inf)
+        np.maximum.at(res, msgs_conversations, msg_dists)
+    # Médiane : on trie les distances par conversation puis par valeur, chaque conversation occupe alors un bloc contigu
+    else:
+        order: np.ndarray = np.lexsort((msg_dists, msgs_conversations))
+        starts: np.ndarray = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        res = msg_dists[order][np.minimum(starts + counts // 2, len(msg_dists) - 1)]
+
+    # Les conversations sans message donné ne peuvent pas être choisies
+    res[counts == 0] = np.inf
+    #
+    return res
 
 
 @dataclass
@@ -36,7 +87,10 @@ class ResultConversationCut:
     nb_conversations: int
 
     # For all algorithms that uses a distance between messages matrix. (Dimension [n, n] )
-    distances_matrix: Optional[Tensor] = None
+    distances_matrix: Optional[Tensor | WindowedDistancesMatrix] = None
+
+    # Pour les algorithmes itératifs, nombre de messages qui ont changé de conversation à chaque itération
+    moves_per_iteration: Optional[list[int]] = None
 
 
 #
@@ -50,6 +104,34 @@ class ConversationsAlgorithm:
         self.config: Config = config
         #
 
+        # Pour les algorithmes qui utilisent une matrice des distances : seules les distances entre messages proches (en nombre de messages et/ou en temps) sont calculées, 0 pour ne pas limiter
+        self.window_size: int = 0
+        if "window_size" in algo_config:
+            self.window_size = int(algo_config["window_size"])
+        #
+        self.window_seconds: float = 0
+        if "window_seconds" in algo_config:
+            self.window_seconds = float(algo_config["window_seconds"])
+
+    #
+    def get_messages_distances(self, search_engine: SearchEngine, lst_messages: list[Message], ner_dicts: list[str] = []) -> Tensor | WindowedDistancesMatrix:
+        """
+        Calcule la matrice des distances entre les messages : dense, ou creuse si une fenêtre est configurée.
+
+        Args:
+            search_engine (SearchEngine): Moteur de recherche qui calcule les distances
+            lst_messages (list[Message]): Les messages, rangés par date
+
+        Returns:
+            Tensor | WindowedDistancesMatrix: La matrice des distances. De dimensions (n, n).
+        """
+
+        #
+        if self.window_size > 0 or self.window_seconds > 0:
+            return search_engine.get_windowed_distances_from_messages_main(lst_messages, ner_dicts, self.window_size, self.window_seconds)
+        #
+        return search_engine.get_distances_matrix_from_messages_main(lst_messages, ner_dicts)
+
     #
     def cut(self, msgs: dict[str, Message]) -> ResultConversationCut:
         """
@@ -154,8 +236,10 @@ class ClusteringFusion_ConversationAlgorithm(ConversationsAlgorithm):
         # On va charger le moteur de recherche
         self.search_engine: SearchEngine = SearchEngine(self.search_engine_config_dict, self.config)
 
-        # Nombre d'itérations maximal
-        self.max_iterations: int = 20
+        # Nombre d'itérations maximal, par sécurité (l'algorithme s'arrête dès qu'il a convergé)
+        self.max_iterations: int = DEFAULT_FUSION_MAX_ITERATIONS
+        if "max_iterations" in algo_config:
+            self.max_iterations = int(algo_config["max_iterations"])
 
     #
     def cut(self, msgs: dict[str, Message], ner_dicts: list[str] = []) -> ResultConversationCut:
@@ -177,7 +261,7 @@ class ClusteringFusion_ConversationAlgorithm(ConversationsAlgorithm):
         # Permet de passer entre l'index de la liste lst_messages à id_msg
         conv_lst_msgs_id: list[str] = []
         # Va contenir le numéro de conversation associé à chaque message à tout moment de l'algorithme
-        msgs_conversations: list[int] = []
+        msgs_conversations: np.ndarray = np.arange(len(msgs), dtype=np.int64)
         # Va contenir la liste des messages pour chacunes des conversations
         conversations_msgs: dict[int, list[int]] = {}
         #
@@ -186,87 +270,49 @@ class ClusteringFusion_ConversationAlgorithm(ConversationsAlgorithm):
         id_msg: str
         msg: Message
         for (id_msg, msg) in msgs.items():
-            conversations_msgs[len(msgs_conversations)] = [len(msgs_conversations)]
-            msgs_conversations.append(len(msgs_conversations))
+            conversations_msgs[len(lst_messages)] = [len(lst_messages)]
             lst_messages.append(msg)
             conv_lst_msgs_id.append(id_msg)
 
-        # On va calculer la matrice des distances
-        distances_matrix: Tensor = self.search_engine.get_distances_matrix_from_messages_main(lst_messages, ner_dicts)
+        # On va calculer la matrice des distances (creuse si une fenêtre est configurée)
+        distances_matrix: Tensor | WindowedDistancesMatrix = self.get_messages_distances(self.search_engine, lst_messages, ner_dicts)
+        # Les statistiques sont calculées en float64, pour que les arrondis (et donc les égalités) ne dépendent pas de l'ordre des mises à jour
+        distances_np: Optional[np.ndarray] = None if isinstance(distances_matrix, WindowedDistancesMatrix) else distances_matrix.numpy().astype(np.float64)
 
         # On va appliquer l'algorithme de clustering suivant:
         # à chaque itération:
-        # on va calculer les distance moyenne, médiane, minimales et maximales de chaque messages aux messages des autres conversation,
-        # ainsi que la sienne s'il est dans une conversation avec au moins X messages.
-        #   -> On va bouger le message vers la conversation de distance moyenne minimale
+        # on va calculer les distance moyenne, minimales et maximales de chaque messages aux messages des autres conversation,
+        # ainsi que la sienne s'il est dans une conversation avec au moins 2 messages.
+        #   -> On va bouger le message vers la conversation de distance (moyenne + min + max) / 3 minimale
         id_conv: int
-        msg_idx: int
         id_iteration: int = 0
         changes: bool = True
+        # Nombre de déplacements à chaque itération
+        moves_per_iteration: list[int] = []
+        # Répartitions déjà rencontrées, pour s'arrêter si l'algorithme oscille entre plusieurs répartitions
+        seen_assignments: set[bytes] = set()
 
         while changes and id_iteration < self.max_iterations:
 
             # On incrémente le compteur d'itérations
             id_iteration += 1
 
-            #
-            changes = False
-
             # On parcours donc tous les messages à chaque itération
-            for msg_idx in range(len(lst_messages))[::-1]:
+            nb_moves: int
+            if distances_np is not None:
+                nb_moves = self.dense_iteration(distances_np, msgs_conversations, conversations_msgs)
+            else:
+                nb_moves = self.windowed_iteration(cast(WindowedDistancesMatrix, distances_matrix), msgs_conversations, conversations_msgs)
 
-                #
-                id_min_conv: int = -1
-                conversations_dists: dict[int, dict[str, float]] = {}
-
-                # On va donc parcourir toutes les conversations
-                for id_conv in conversations_msgs.keys():
-
-                    # On évite les situations bloquantes, car si un message est tout seul dans une conversation, il ne voudra jamais en sortir car la distance moyenne à la conversation sera toujours 0
-                    if id_conv == msgs_conversations[msg_idx] and len(conversations_msgs[id_conv]) == 1:
-                        continue
-
-                    # On évite les listes vides aussi, ca pose problème
-                    if len(conversations_msgs[id_conv]) == 0:
-                        continue
-
-                    # On initialise la distance
-                    dists: list[float] = []
-
-                    # On va donc parcourir les messages de la conversation et ajouter leurs distance à la liste temporaire des distances
-                    for msg2_idx in conversations_msgs[id_conv]:
-                        dists.append(distances_matrix[msg_idx, msg2_idx])
-
-                    # On récupère ces valeurs
-                    conversations_dists[id_conv] = {
-                        "avg": avg(dists),
-                        "min": min(dists),
-                        "max": max(dists),
-                        "median": median(dists)
-                    }
-
-                    conversations_dists[id_conv]["modif_avg"] = float(conversations_dists[id_conv]["avg"] + conversations_dists[id_conv]["min"] + conversations_dists[id_conv]["max"]) / 3.0
-
-                    # On va traquer la conversation avec la moyenne minimale
-                    if (id_min_conv == -1 or conversations_dists[id_min_conv]["modif_avg"] > conversations_dists[id_conv]["modif_avg"]) and conversations_dists[id_conv]["modif_avg"] <= self.treshold_conversation_distance:
-                    # if (id_min_conv == -1 or conversations_dists[id_min_conv]["avg"] > conversations_dists[id_conv]["avg"]) and conversations_dists[id_conv]["avg"] <= self.treshold_conversation_distance:
-                    # if (id_min_conv == -1 or conversations_dists[id_min_conv]["min"] > conversations_dists[id_conv]["min"]) and conversations_dists[id_conv]["min"] <= self.treshold_conversation_distance:
-                        id_min_conv = id_conv
-
-                # On regarde s'il y a un changement de conversation
-                if id_min_conv != -1 and id_min_conv != msgs_conversations[msg_idx]:
-
-                    # Changement !
-                    changes = True
-                    id_conv_src: int = msgs_conversations[msg_idx]
-                    id_conv_dst: int = id_min_conv
-
-                    msgs_conversations[msg_idx] = id_conv_dst
-                    conversations_msgs[id_conv_src].remove(msg_idx)
-                    conversations_msgs[id_conv_dst].append(msg_idx)
-                    #
-                    if len(conversations_msgs[id_conv_src]) == 0:
-                        del conversations_msgs[id_conv_src]
+            #
+            changes = nb_moves > 0
+            moves_per_iteration.append(nb_moves)
+
+            # Si on retombe sur une répartition déjà vue, l'algorithme ne convergera plus
+            assignment: bytes = msgs_conversations.tobytes()
+            if assignment in seen_assignments:
+                break
+            seen_assignments.add(assignment)
 
         # On va récupérer la liste des conversations finales
         #
@@ -282,7 +328,189 @@ class ClusteringFusion_ConversationAlgorithm(ConversationsAlgorithm):
                 msgs_colors[ conv_lst_msgs_id[id_msg] ] = id_conv
 
         # On renvoie le résultat
-        return ResultConversationCut(conversations, msgs_colors, nb_conversations, distances_matrix)
+        return ResultConversationCut(conversations, msgs_colors, nb_conversations, distances_matrix, moves_per_iteration)
+
+    #
+    def move_message(self, msg_idx: int, id_conv_dst: int, msgs_conversations: np.ndarray, conversations_msgs: dict[int, list[int]]) -> None:
+        """
+        Déplace un message dans une autre conversation (la conversation qu'il quitte est supprimée si elle devient vide).
+
+        Args:
+            msg_idx (int): Indice du message
+            id_conv_dst (int): Conversation de destination
+            msgs_conversations (np.ndarray): Conversation de chaque message
+            conversations_msgs (dict[int, list[int]]): Messages de chaque conversation
+        """
+
+        #
+        id_conv_src: int = int(msgs_conversations[msg_idx])
+        #
+        msgs_conversations[msg_idx] = id_conv_dst
+        conversations_msgs[id_conv_src].remove(msg_idx)
+        conversations_msgs[id_conv_dst].append(msg_idx)
+        #
+        if len(conversations_msgs[id_conv_src]) == 0:
+            del conversations_msgs[id_conv_src]
+
+    #
+    def dense_iteration(self, distances_np: np.ndarray, msgs_conversations: np.ndarray, conversations_msgs: dict[int, list[int]]) -> int:
+        """
+        Une itération de l'algorithme avec la matrice des distances complète : chaque message, du dernier au premier, va dans la conversation la plus proche.
+        Les statistiques de tous les messages sont calculées d'un coup au début de l'itération (une colonne par conversation),
+        puis seules les colonnes des deux conversations concernées sont mises à jour à chaque déplacement, les messages sont donc toujours traités dans le même ordre.
+
+        Args:
+            distances_np (np.ndarray): Matrice des distances entre les messages. De dimensions (n, n).
+            msgs_conversations (np.ndarray): Conversation de chaque message
+            conversations_msgs (dict[int, list[int]]): Messages de chaque conversation
+
+        Returns:
+            int: Nombre de messages qui ont changé de conversation
+        """
+
+        #
+        n: int = len(msgs_conversations)
+        nb_moves: int = 0
+
+        # Les conversations restantes, dans l'ordre de leurs ids, chacune a sa colonne
+        convs_ids: list[int] = list(conversations_msgs.keys())
+        convs_columns: dict[int, int] = {id_conv: col for col, id_conv in enumerate(convs_ids)}
+        #
+        convs_sizes: np.ndarray = np.array([len(conversations_msgs[id_conv]) for id_conv in convs_ids], dtype=np.float64)
+        convs_sums: np.ndarray = np.empty((n, len(convs_ids)), dtype=np.float64, order="F")
+        convs_mins: np.ndarray = np.empty((n, len(convs_ids)), dtype=np.float64, order="F")
+        convs_maxs: np.ndarray = np.empty((n, len(convs_ids)), dtype=np.float64, order="F")
+        #
+        col: int
+        id_conv: int
+        for col, id_conv in enumerate(convs_ids):
+            self.update_conversation_column(distances_np, conversations_msgs[id_conv], col, convs_sums, convs_mins, convs_maxs)
+
+        #
+        msg_idx: int
+        for msg_idx in range(n)[::-1]:
+
+            #
+            id_conv_src: int = int(msgs_conversations[msg_idx])
+            col_src: int = convs_columns[id_conv_src]
+
+            # Distances du message à toutes les conversations (une conversation vide a un minimum infini)
+            conversations_dists: np.ndarray = (convs_sums[msg_idx] / np.maximum(convs_sizes, 1) + convs_mins[msg_idx] + convs_maxs[msg_idx]) / 3.0
+
+            # On évite les situations bloquantes, car si un message est tout seul dans une conversation, il ne voudra jamais en sortir car la distance moyenne à la conversation sera toujours 0
+            if convs_sizes[col_src] == 1:
+                conversations_dists[col_src] = np.inf
+
+            # On va traquer la conversation avec la moyenne minimale (la première en cas d'égalité)
+            col_dst: int = int(np.argmin(conversations_dists))
+
+            # On regarde s'il y a un changement de conversation
+            if conversations_dists[col_dst] <= self.treshold_conversation_distance and col_dst != col_src:
+
+                # Changement !
+                nb_moves += 1
+                self.move_message(msg_idx, convs_ids[col_dst], msgs_conversations, conversations_msgs)
+
+                # On met à jour les colonnes des deux conversations
+                convs_sizes[col_src] -= 1
+                convs_sizes[col_dst] += 1
+                #
+                convs_sums[:, col_dst] += distances_np[:, msg_idx]
+                np.minimum(convs_mins[:, col_dst], distances_np[:, msg_idx], out=convs_mins[:, col_dst])
+                np.maximum(convs_maxs[:, col_dst], distances_np[:, msg_idx], out=convs_maxs[:, col_dst])
+                #
+                self.update_conversation_column(distances_np, conversations_msgs.get(id_conv_src, []), col_src, convs_sums, convs_mins, convs_maxs)
+
+        #
+        return nb_moves
+
+    #
+    def windowed_iteration(self, distances: WindowedDistancesMatrix, msgs_conversations: np.ndarray, conversations_msgs: dict[int, list[int]]) -> int:
+        """
+        Une itération de l'algorithme avec la matrice creuse des distances : chaque message, du dernier au premier, va dans la conversation la plus proche,
+        les statistiques d'une conversation étant calculées sur ses messages qui sont dans la fenêtre du message.
+
+        Args:
+            distances (WindowedDistancesMatrix): Matrice creuse des distances entre les messages. De dimensions (n, n).
+            msgs_conversations (np.ndarray): Conversation de chaque message
+            conversations_msgs (dict[int, list[int]]): Messages de chaque conversation
+
+        Returns:
+            int: Nombre de messages qui ont changé de conversation
+        """
+
+        #
+        nb_moves: int = 0
+
+        #
+        msg_idx: int
+        for msg_idx in range(distances.n)[::-1]:
+
+            #
+            id_conv_src: int = int(msgs_conversations[msg_idx])
+
+            # Conversations des messages de la fenêtre, renumérotées dans l'ordre de leurs ids
+            window_cols: np.ndarray
+            window_dists: np.ndarray
+            window_cols, window_dists = distances.row(msg_idx)
+            window_convs: np.ndarray
+            window_labels: np.ndarray
+            window_convs, window_labels = np.unique(msgs_conversations[window_cols], return_inverse=True)
+
+            # Statistiques des distances du message à chaque conversation de la fenêtre
+            counts: np.ndarray = np.bincount(window_labels, minlength=len(window_convs))
+            sums: np.ndarray = np.bincount(window_labels, weights=window_dists, minlength=len(window_convs))
+            mins: np.ndarray = np.full(len(window_convs), np.inf)
+            np.minimum.at(mins, window_labels, window_dists)
+            maxs: np.ndarray = np.full(len(window_convs), -np.inf)
+            np.maximum.at(maxs, window_labels, window_dists)
+            #
+            conversations_dists: np.ndarray = (sums / counts + mins + maxs) / 3.0
+
+            # On évite les situations bloquantes, comme avec la matrice complète
+            if len(conversations_msgs[id_conv_src]) == 1:
+                conversations_dists[window_convs == id_conv_src] = np.inf
+
+            # On va traquer la conversation avec la moyenne minimale (la première en cas d'égalité)
+            k_dst: int = int(np.argmin(conversations_dists))
+            id_conv_dst: int = int(window_convs[k_dst])
+
+            # On regarde s'il y a un changement de conversation
+            if conversations_dists[k_dst] <= self.treshold_conversation_distance and id_conv_dst != id_conv_src:
+
+                # Changement !
+                nb_moves += 1
+                self.move_message(msg_idx, id_conv_dst, msgs_conversations, conversations_msgs)
+
+        #
+        return nb_moves
+
+    #
+    def update_conversation_column(self, distances_np: np.ndarray, conv_msgs: list[int], col: int, convs_sums: np.ndarray, convs_mins: np.ndarray, convs_maxs: np.ndarray) -> None:
+        """
+        Recalcule la somme, le minimum et le maximum des distances de tous les messages aux messages d'une conversation.
+
+        Args:
+            distances_np (np.ndarray): Matrice des distances entre les messages. De dimensions (n, n).
+            conv_msgs (list[int]): Messages de la conversation
+            col (int): Colonne de la conversation
+            convs_sums (np.ndarray): Sommes des distances de chaque message à chaque conversation. De dimensions (n, c).
+            convs_mins (np.ndarray): Distances minimales de chaque message à chaque conversation. De dimensions (n, c).
+            convs_maxs (np.ndarray): Distances maximales de chaque message à chaque conversation. De dimensions (n, c).
+        """
+
+        # Une conversation vide ne doit jamais être choisie
+        if len(conv_msgs) == 0:
+            convs_sums[:, col] = 0
+            convs_mins[:, col] = np.inf
+            convs_maxs[:, col] = np.inf
+            return
+
+        #
+        conv_dists: np.ndarray = distances_np[:, conv_msgs]
+        convs_sums[:, col] = conv_dists.sum(axis=1)
+        convs_mins[:, col] = conv_dists.min(axis=1)
+        convs_maxs[:, col] = conv_dists.max(axis=1)
 
 
 #
@@ -301,6 +529,14 @@ class ClusteringSeq_ConversationAlgorithm(ConversationsAlgorithm):
         self.search_engine_config_dict: str = algo_config["search_engine_config_dict"]
         self.treshold_conversation_distance: float = float(algo_config["treshold_conversation_distance"])
 
+        # Statistique utilisée pour la distance d'un message à une conversation
+        self.conversation_distance_statistic: str = "avg"
+        if "conversation_distance_statistic" in algo_config:
+            self.conversation_distance_statistic = algo_config["conversation_distance_statistic"]
+        #
+        if not self.conversation_distance_statistic in CONVERSATION_DISTANCE_STATISTICS:
+            raise ConfigError(f"Unknown conversation distance statistic \"{self.conversation_distance_statistic}\", expected one of {CONVERSATION_DISTANCE_STATISTICS} !")
+
         # On va charger le moteur de recherche
         self.search_engine: SearchEngine = SearchEngine(self.search_engine_config_dict, self.config)
 
@@ -324,8 +560,8 @@ class ClusteringSeq_ConversationAlgorithm(ConversationsAlgorithm):
         # Permet de passer entre l'index de la liste lst_messages à id_msg
         conv_lst_msgs_id: list[str] = []
         # Va contenir le numéro de conversation associé à chaque message à tout moment de l'algorithme
-        msgs_conversations: list[int] = [-1] * len(msgs)
-        # Va contenir la liste des messages pour chacunes des conversations
+        msgs_conversations: np.ndarray = np.full(len(msgs), -1, dtype=np.int64)
+        # Va contenir la liste des messages pour chacunes des conversations (numérotées dans leur ordre de création)
         conversations_msgs: dict[int, list[int]] = {}
         #
 
@@ -336,57 +572,53 @@ class ClusteringSeq_ConversationAlgorithm(ConversationsAlgorithm):
             lst_messages.append(msg)
             conv_lst_msgs_id.append(id_msg)
 
-        # On va calculer la matrice des distances
-        distances_matrix: Tensor = self.search_engine.get_distances_matrix_from_messages_main(lst_messages, ner_dicts)
+        # On va calculer la matrice des distances (creuse si une fenêtre est configurée)
+        distances_matrix: Tensor | WindowedDistancesMatrix = self.get_messages_distances(self.search_engine, lst_messages, ner_dicts)
+        distances_np: Optional[np.ndarray] = None if isinstance(distances_matrix, WindowedDistancesMatrix) else distances_matrix.numpy()
 
         # On va appliquer l'algorithme de clustering suivant:
-        # à chaque itération:
-        # on va calculer les distance moyenne, médiane, minimales et maximales de chaque messages aux messages des autres conversation,
-        # ainsi que la sienne s'il est dans une conversation avec au moins X messages.
-        #   -> On va bouger le message vers la conversation de distance moyenne minimale
+        # pour chaque message, dans l'ordre:
+        # on va calculer la distance (moyenne par défaut, ou la statistique demandée) du message aux messages de chaque conversation déjà existante.
+        #   -> On va mettre le message dans la conversation de distance minimale si elle est assez proche, sinon dans une nouvelle conversation
         id_conv: int
         msg_idx: int
+        nb_convs: int = 0
 
         # On parcours donc une seule fois tous les messages
         for msg_idx in range(len(lst_messages)):
 
             # On va chercher la conversation déjà existante qui se rapproche le plus de ce message
-            id_min_conv: int = -1
-            conversations_dists: dict[int, dict[str, float]] = {}
-
-            # On va donc parcourir toutes les conversations
-            for id_conv in conversations_msgs.keys():
+            id_conv_dst: int = -1
 
-                # On évite les listes vides aussi, ca pose problème
-                if len(conversations_msgs[id_conv]) == 0:
-                    continue
-
-                # On initialise la distance
-                dists: list[float] = []
-
-                # On va donc parcourir les messages de la conversation et ajouter leurs distance à la liste temporaire des distances
-                for msg2_idx in conversations_msgs[id_conv]:
-                    dists.append(distances_matrix[msg_idx, msg2_idx])
-
-                # On récupère ces valeurs
-                conversations_dists[id_conv] = {
-                    "avg": avg(dists),
-                    "min": min(dists),
-                    "max": max(dists),
-                    "median": median(dists)
-                }
-
-                # On va traquer la conversation avec la moyenne minimale
-                if (id_min_conv == -1 or conversations_dists[id_min_conv]["avg"] > conversations_dists[id_conv]["avg"]) and conversations_dists[id_conv]["avg"] <= self.treshold_conversation_distance:
-                # if (id_min_conv == -1 or conversations_dists[id_min_conv]["min"] > conversations_dists[id_conv]["min"]) and conversations_dists[id_conv]["min"] <= self.treshold_conversation_distance:
-                    id_min_conv = id_conv
+            #
+            if distances_np is not None and msg_idx > 0:
+                # Distances à toutes les conversations d'un coup (les messages précédents sont tous déjà dans une conversation)
+                conversations_dists: np.ndarray = conversations_distances(distances_np[msg_idx, :msg_idx].astype(np.float64), msgs_conversations[:msg_idx], nb_convs, self.conversation_distance_statistic)
+                # La première conversation de distance minimale, comme avant
+                id_min_conv: int = int(np.argmin(conversations_dists))
+                if conversations_dists[id_min_conv] <= self.treshold_conversation_distance:
+                    id_conv_dst = id_min_conv
+            #
+            elif isinstance(distances_matrix, WindowedDistancesMatrix) and distances_matrix.starts[msg_idx] < msg_idx:
+                # Seuls les messages précédents qui sont dans la fenêtre du message comptent
+                window_start: int = int(distances_matrix.starts[msg_idx])
+                window_dists: np.ndarray = distances_matrix.row(msg_idx)[1][:msg_idx - window_start].astype(np.float64)
+                # Conversations de ces messages, renumérotées dans l'ordre de leurs ids
+                window_convs: np.ndarray
+                window_labels: np.ndarray
+                window_convs, window_labels = np.unique(msgs_conversations[window_start:msg_idx], return_inverse=True)
+                #
+                window_convs_dists: np.ndarray = conversations_distances(window_dists, window_labels, len(window_convs), self.conversation_distance_statistic)
+                k_min_conv: int = int(np.argmin(window_convs_dists))
+                if window_convs_dists[k_min_conv] <= self.treshold_conversation_distance:
+                    id_conv_dst = int(window_convs[k_min_conv])
 
             # On regarde si l'on doit créer une nouvelle conversation
-            id_conv_dst: int = id_min_conv
-            if id_min_conv == -1:
+            if id_conv_dst == -1:
                 # On crée une conversation
-                id_conv_dst = len(conversations_msgs)
+                id_conv_dst = nb_convs
                 conversations_msgs[id_conv_dst] = []
+                nb_convs += 1
 
             # On rajoute le message à la conversation
             msgs_conversations[msg_idx] = id_conv_dst
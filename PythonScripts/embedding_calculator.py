@@ -4,10 +4,13 @@ _summary
 Auteur: Nathan Cerisara
 """
 
-from typing import Optional
+from typing import Optional, cast
 
 import os
+from threading import Lock
+
 import torch
+import torch.nn.functional as F
 from transformers import AutoModel, AutoTokenizer
 from optimum.onnxruntime import ORTModelForFeatureExtraction, QuantizationConfig
 from optimum.onnxruntime import ORTOptimizer, ORTQuantizer
@@ -16,7 +19,8 @@ from optimum.onnxruntime.configuration import OptimizationConfig, AutoQuantizati
 from config import Config
 from lib import HFAutoModelError
 from lib import escapeCharacters
-from lib_embedding import MessageEmbedding
+from lib_embedding import MessageEmbedding, batch_average_pool, DISTANCES_NEEDING_TOKENS_STATES
+from models_registry import RegistryEntry, get_models_registry
 
 from profiling import profiling_task_start, profiling_last_task_ends
 
@@ -48,9 +52,24 @@ class EmbeddingCalculator():
         if self.use_cuda:
             self.device = "cuda"
         #
+        self.model_mutex: Lock = Lock()
+        #
         self.model_optimisations: str = ""
         if "model_optimisations" in config:
             self.model_optimisations = config["model_optimisations"]
+        #
+        # Embeddings compacts : on ne garde que le vecteur moyen normalisé de chaque message,
+        #   sauf si la fonction de distance a besoin des états de chaque token
+        self.compact_embeddings: bool = True
+        if "compact_embeddings" in config:
+            self.compact_embeddings = int(config["compact_embeddings"]) == 1
+        if "distance_function" in config and config["distance_function"] in DISTANCES_NEEDING_TOKENS_STATES:
+            self.compact_embeddings = False
+        #
+        # Padding dynamique : on ne complète les séquences que jusqu'à la plus longue du batch, et pas jusqu'à 512 tokens
+        self.dynamic_padding: bool = True
+        if "dynamic_padding" in config:
+            self.dynamic_padding = int(config["dynamic_padding"]) == 1
 
         # Profiling 2 - start
         # profiling_task_start(f"emb_get_model_[{escapeCharacters(config['model_name'])}]")
@@ -81,8 +100,25 @@ class EmbeddingCalculator():
 
     #
     def get_model(self) -> None:
+        """
+        Récupère le modèle et le tokeniseur depuis le registre de modèles du processus, qui ne les charge qu'une seule fois
+        pour tous les calculateurs utilisant le même modèle, avec les mêmes optimisations, sur le même appareil.
+        """
+
+        #
+        entry: RegistryEntry = get_models_registry().acquire_for(self, ("embedding_model", self.model_name, self.model_optimisations, self.device), self.load_model)
+        #
+        self.model, self.tokenizer = entry.obj
+        # Le modèle est partagé, il ne doit être utilisé que par un seul thread à la fois
+        self.model_mutex = entry.mutex
+
+    #
+    def load_model(self) -> tuple[AutoModel | ORTModelForFeatureExtraction, AutoTokenizer]:
         """
         Charge un modèle téléchargé ou le télécharge au besoin.
+
+        Returns:
+            tuple[AutoModel | ORTModelForFeatureExtraction, AutoTokenizer]: Le modèle et son tokeniseur
         """
 
         if self.model_optimisations == "optimum":
@@ -110,6 +146,9 @@ class EmbeddingCalculator():
             # # Improve models
             # self.model.to_bettertransformer()
 
+        #
+        return (self.model, self.tokenizer)
+
     #
     def load_downloaded_model(self, pre_optimum: bool = True, verbose=True) -> None:
         """
@@ -257,12 +296,17 @@ class EmbeddingCalculator():
             # profiling_task_start(f"embedding_tokenization_|_{self.model_name}_|_{escapeCharacters(messages[0])}")
 
             # On tokenize les messages
-            inputs = self.tokenizer(messages,
-                                    max_length=512,
-                                    truncation=True,
-                                    padding='max_length',
-                                    return_tensors="pt",
-                                    return_attention_mask=True)
+            #   (le tokeniseur et le modèle sont partagés entre les calculateurs, ils ne doivent être utilisés que par un seul thread à la fois)
+            self.model_mutex.acquire()
+            try:
+                inputs = self.tokenizer(messages,
+                                        max_length=512,
+                                        truncation=True,
+                                        padding='longest' if self.dynamic_padding else 'max_length',
+                                        return_tensors="pt",
+                                        return_attention_mask=True)
+            finally:
+                self.model_mutex.release()
 
             # Profiling 1 - end
             # profiling_last_task_ends()
@@ -271,7 +315,11 @@ class EmbeddingCalculator():
             # profiling_task_start(f"embedding_model_|_{self.model_name}_|_{escapeCharacters(messages[0])}")
 
             # On utilise le modèle sur le texte tokenisé
-            outputs = self.model(**inputs)
+            self.model_mutex.acquire()
+            try:
+                outputs = self.model(**inputs)
+            finally:
+                self.model_mutex.release()
 
             # Profiling 1 - end
             # profiling_last_task_ends()
@@ -283,6 +331,24 @@ class EmbeddingCalculator():
             #   celle que l'on utilise comme embedding
             last_hidden_state: torch.Tensor = outputs.last_hidden_state
 
+            # Mode compact : on fait la moyenne et la normalisation une seule fois pour tout le batch
+            if self.compact_embeddings:
+                #
+                sentence_embeddings: torch.Tensor = F.normalize(batch_average_pool(last_hidden_state, inputs["attention_mask"]), p=2, dim=1).cpu()
+                #
+                embeddings += [
+                                MessageEmbedding(
+                                    txt=messages[i],
+                                    tokens=None,
+                                    attention_mask=None,
+                                    last_hidden_state=None,
+                                    sentence_embedding=sentence_embeddings[i]
+                                )
+                                for i in range(len(messages))
+                            ]
+                #
+                return embeddings
+
             # On convertit les vecteurs pytorch en vecteurs numpy qui retournent sur le CPU
             embeddings += [
                             MessageEmbedding(
@@ -320,3 +386,46 @@ class EmbeddingCalculator():
 
         return self.get_messages_embeddings(pre_processed_messages)
 
+    #
+    def get_embeddings_by_length_buckets(self, messages: list[str], batch_size: int) -> list[MessageEmbedding]:
+        """
+        Calcule les embeddings d'une liste de messages par batchs de messages de longueurs proches.
+        Avec le padding dynamique, chaque batch n'est complété que jusqu'à son plus long message, on trie donc les messages par longueur
+        pour que les messages courts ne soient pas complétés jusqu'à la longueur d'un long message.
+        Les résultats sont renvoyés dans l'ordre initial des messages.
+
+        Args:
+            messages (list[str]): Liste des messages
+            batch_size (int): Taille maximale des batchs
+
+        Returns:
+            list[MessageEmbedding]: Liste des embeddings de chaque message, dans l'ordre de la liste donnée
+        """
+
+        #
+        embeddings: list[Optional[MessageEmbedding]] = [None] * len(messages)
+
+        # Indices des messages triés par longueur (le nombre de caractères est une bonne approximation du nombre de tokens)
+        sorted_ids: list[int] = sorted(range(len(messages)), key=lambda i: len(messages[i]))
+
+        #
+        batch_size = max(1, batch_size)
+        #
+        for i in range(0, len(sorted_ids), batch_size):
+            #
+            batch_ids: list[int] = sorted_ids[i:i+batch_size]
+
+            # Profiling 1 - start
+            # profiling_task_start(f"calculate_embeddings_bucket_[{self.model_name}]_|_{len(batch_ids)}_|_{escapeCharacters(messages[batch_ids[0]])}")
+
+            batch_embeddings: list[MessageEmbedding] = self.get_embeddings([messages[j] for j in batch_ids])
+
+            # Profiling 1 - end
+            # profiling_last_task_ends()
+
+            # On replace les résultats à leur place initiale
+            for j, me in zip(batch_ids, batch_embeddings):
+                embeddings[j] = me
+
+        #
+        return cast(list[MessageEmbedding], embeddings)
@@ -0,0 +1,199 @@
+"""
+Service de calcul d'embeddings partagé entre tous les threads pour un même modèle.
+Les threads (recherches, imports de bulles, ...) soumettent des textes et récupèrent des `Future`,
+et un thread de fond regroupe les demandes pendant quelques millisecondes (ou jusqu'à une taille de batch maximale)
+pour ne faire qu'un seul passage dans le modèle pour toutes les demandes simultanées.
+Les demandes interactives (recherches) passent avant les demandes de fond (imports de bulles),
+une recherche n'attend donc jamais plus d'un batch derrière un gros import.
+
+Auteur: Nathan Cerisara
+"""
+
+from typing import Optional
+
+import time
+from itertools import count
+from queue import PriorityQueue, Empty
+from threading import Thread
+from concurrent.futures import Future
+
+from embedding_calculator import EmbeddingCalculator
+from lib_embedding import MessageEmbedding
+
+from profiling import profiling_task_start, profiling_last_task_ends
+
+
+# Valeurs par défaut pour le regroupement des demandes
+DEFAULT_MAX_WAIT_MS: float = 5.0
+DEFAULT_MAX_BATCH_SIZE: int = 32
+
+# Priorités des demandes (la plus petite est traitée en premier)
+PRIORITY_INTERACTIVE: int = 0
+PRIORITY_BULK: int = 1
+
+# Priorité de la demande d'arrêt, traitée après toutes les autres demandes déjà soumises
+PRIORITY_STOP: int = 2
+
+
+#
+class EmbeddingService:
+    """
+    Service de micro-batching pour un EmbeddingCalculator.
+    Un seul thread de fond appelle le modèle, ce qui fait aussi que le modèle n'est jamais utilisé par deux threads en même temps.
+    """
+
+    def __init__(self, embedding_calculator: EmbeddingCalculator, max_wait_ms: float = DEFAULT_MAX_WAIT_MS, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE) -> None:
+        """
+        Crée le service et lance son thread de fond.
+
+        Args:
+            embedding_calculator (EmbeddingCalculator): Le calculateur d'embeddings à utiliser
+            max_wait_ms (float, optional): Temps maximum d'attente de nouvelles demandes après la première demande d'un batch, en millisecondes. Defaults to DEFAULT_MAX_WAIT_MS.
+            max_batch_size (int, optional): Nombre maximum de textes dans un batch. Defaults to DEFAULT_MAX_BATCH_SIZE.
+        """
+
+        #
+        self.embedding_calculator: EmbeddingCalculator = embedding_calculator
+        self.max_wait: float = max_wait_ms / 1000.0
+        self.max_batch_size: int = max(1, max_batch_size)
+
+        # File des demandes en attente : (priorité, ordre d'arrivée, (texte, future)), avec None au lieu de (texte, future) pour arrêter le thread
+        self.requests_queue: PriorityQueue[tuple[int, int, Optional[tuple[str, Future]]]] = PriorityQueue()
+        self.requests_counter: count = count()
+
+        # Statistiques, pour savoir si le regroupement est efficace
+        self.nb_batches_calculated: int = 0
+        self.nb_texts_calculated: int = 0
+
+        #
+        self.worker: Thread = Thread(target=self.worker_loop, daemon=True)
+        self.worker.start()
+
+    #
+    def submit(self, texts: list[str], priority: int = PRIORITY_INTERACTIVE) -> list[Future]:
+        """
+        Soumet des textes au service.
+
+        Args:
+            texts (list[str]): Textes dont on veut les embeddings
+            priority (int, optional): Priorité des demandes, `PRIORITY_BULK` pour les gros calculs de fond. Defaults to PRIORITY_INTERACTIVE.
+
+        Returns:
+            list[Future]: Une Future par texte, dans l'ordre, dont le résultat sera le MessageEmbedding du texte
+        """
+
+        #
+        futures: list[Future] = []
+        #
+        for txt in texts:
+            future: Future = Future()
+            self.requests_queue.put((priority, next(self.requests_counter), (txt, future)))
+            futures.append(future)
+        #
+        return futures
+
+    #
+    def get_embeddings(self, texts: list[str], priority: int = PRIORITY_INTERACTIVE) -> list[MessageEmbedding]:
+        """
+        Version bloquante de `submit` : soumet les textes et attend leurs embeddings.
+
+        Args:
+            texts (list[str]): Textes dont on veut les embeddings
+            priority (int, optional): Priorité des demandes. Defaults to PRIORITY_INTERACTIVE.
+
+        Returns:
+            list[MessageEmbedding]: Les embeddings, dans l'ordre des textes
+        """
+
+        #
+        return [future.result() for future in self.submit(texts, priority)]
+
+    #
+    def collect_batch(self, first_request: tuple[str, Future]) -> tuple[list[tuple[str, Future]], bool]:
+        """
+        Regroupe les demandes qui arrivent jusqu'à la fin de la fenêtre de temps, ou jusqu'à la taille maximale du batch, les plus prioritaires d'abord.
+
+        Args:
+            first_request (tuple[str, Future]): La première demande du batch
+
+        Returns:
+            tuple[list[tuple[str, Future]], bool]: Les demandes du batch, et si le service doit s'arrêter ensuite
+        """
+
+        #
+        batch: list[tuple[str, Future]] = [first_request]
+        deadline: float = time.time() + self.max_wait
+
+        #
+        while len(batch) < self.max_batch_size:
+            #
+            remaining: float = deadline - time.time()
+            if remaining <= 0:
+                break
+            #
+            try:
+                request: Optional[tuple[str, Future]] = self.requests_queue.get(timeout=remaining)[2]
+            except Empty:
+                break
+            #
+            if request is None:
+                return (batch, True)
+            #
+            batch.append(request)
+
+        #
+        return (batch, False)
+
+    #
+    def worker_loop(self) -> None:
+        """
+        Boucle du thread de fond : attend une demande, regroupe les suivantes, calcule le batch et résout les futures.
+        """
+
+        #
+        stop: bool = False
+        #
+        while not stop:
+            #
+            first_request: Optional[tuple[str, Future]] = self.requests_queue.get()[2]
+            if first_request is None:
+                break
+            #
+            batch: list[tuple[str, Future]]
+            batch, stop = self.collect_batch(first_request)
+
+            # Un même texte demandé plusieurs fois n'est calculé qu'une seule fois
+            texts: list[str] = list(dict.fromkeys(txt for txt, _ in batch))
+
+            # Profiling 1 - start
+            # profiling_task_start(f"embedding_service_batch_[{self.embedding_calculator.model_name}]_|_{len(texts)}")
+
+            #
+            try:
+                embeddings: list[MessageEmbedding] = self.embedding_calculator.get_embeddings_by_length_buckets(texts, self.max_batch_size)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            # Profiling 1 - end
+            # profiling_last_task_ends()
+
+            #
+            self.nb_batches_calculated += 1
+            self.nb_texts_calculated += len(texts)
+
+            #
+            results: dict[str, MessageEmbedding] = dict(zip(texts, embeddings))
+            for txt, future in batch:
+                future.set_result(results[txt])
+
+    #
+    def stop(self) -> None:
+        """
+        Arrête le thread de fond, une fois que toutes les demandes déjà soumises ont été traitées.
+        """
+
+        #
+        self.requests_queue.put((PRIORITY_STOP, next(self.requests_counter), None))
+        self.worker.join()
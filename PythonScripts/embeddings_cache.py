@@ -8,135 +8,334 @@ from typing import Optional
 
 import os
 import json
-import pickle
+import hashlib
+from threading import Lock
+
+import numpy as np
+import torch
 
 from config import Config
-from lib_embedding import MessageEmbedding, load_message_embedding_from_dict
-from lib import escapeCharacters
+from lib_embedding import MessageEmbedding
 
 from profiling import profiling_task_start, profiling_last_task_ends
 
 
+# Format d'une entrée de l'index : (hash du texte, première ligne dans la matrice, nombre de lignes, type d'entrée)
+INDEX_DTYPE: np.dtype = np.dtype([
+    ("key", "<u8"),
+    ("start", "<i8"),
+    ("nb_rows", "<i4"),
+    ("flags", "<i4")
+])
+
+# Types d'entrées possibles dans l'index
+ENTRY_TOKENS_STATES: int = 0
+ENTRY_SENTENCE_EMBEDDING: int = 1
+
+# Types de stockage des vecteurs acceptés
+ACCEPTED_DTYPES: list[str] = ["float32", "float16"]
+
+# Noms des fichiers du store pour un modèle
+STORE_DATA_FILE: str = "vectors.bin"
+STORE_INDEX_FILE: str = "index.bin"
+STORE_META_FILE: str = "meta.json"
+
+# Nombre d'entrées en attente dans l'index avant de les écrire sur le disque
+INDEX_FLUSH_EVERY: int = 256
+
+
 #
-class EmbeddingCache:
+def hash_txt_key(txt_key: str) -> int:
     """
-    Ce fichier contient une classe et des fonctions pour faire du cache d'embeddings, ce qui permet de calculer une seule fois un embedding, et d'ensuite l'enregistrer sur le disque, et ensuite, on le recharge au lieu de le recalculer.
-    La méthode utilisée ici est de stocker chaque embedding dans un fichier à part dans un sous-dossier à part pour chaque modèle d'embedding différent.
+    Calcule un hash stable sur 64 bits du texte d'un message, qui sert de clé dans l'index du store.
+
+    Args:
+        txt_key (str): le texte du message de l'embedding
+
+    Returns:
+        int: Le hash du texte
     """
 
-    def __init__(self, embedding_model_name: str, conf: Config) -> None:
-        # La configuration globale du projet
-        self.conf: Config = conf
+    #
+    return int.from_bytes(hashlib.blake2b(txt_key.encode("utf-8"), digest_size=8).digest(), "little")
 
-        # Le nom du modèle d'embedding utilisé
-        self.embedding_model_name: str = embedding_model_name
 
-        # On prépare ici le chemin où seront enregistrés les embeddings
-        self.base_dir_path: str = f"{self.conf.cache_dir_embeddings}/{self.embedding_model_name}/"
+#
+class EmbeddingSegmentStore:
+    """
+    Store de vecteurs en ajout seul : toutes les lignes de vecteurs sont concaténées dans un unique fichier binaire (lu avec np.memmap),
+    et un petit index binaire associe à chaque hash de texte la plage de lignes correspondante.
+    Les lectures renvoient des vues sur le fichier mappé en mémoire, sans copie.
+    """
+
+    def __init__(self, base_dir_path: str, dtype: str = "float32") -> None:
+        """
+        Ouvre (ou crée) le store présent dans le dossier donné.
+
+        Args:
+            base_dir_path (str): Dossier où sont enregistrés les fichiers du store
+            dtype (str, optional): Type des vecteurs stockés pour un nouveau store ("float32" ou "float16"). Defaults to "float32".
+
+        Raises:
+            UserWarning: Si le type demandé n'est pas accepté
+        """
 
-        # Pour savoir s'il y a des modifications que l'on n'a pas enregistrées
-        self.unsaved_changes: bool = False
+        #
+        self.base_dir_path: str = base_dir_path
+        self.data_path: str = f"{base_dir_path}{STORE_DATA_FILE}"
+        self.index_path: str = f"{base_dir_path}{STORE_INDEX_FILE}"
+        self.meta_path: str = f"{base_dir_path}{STORE_META_FILE}"
 
         # On crée le dossier où l'on va enregistrer les embeddings s'il n'existe pas encore
         if not os.path.exists(self.base_dir_path):
             os.makedirs(self.base_dir_path)
 
-        # Un buffer pour ne pas lire/écrire sur le disque à chaque fois
-        self.buffer: dict[str, MessageEmbedding] = {}
-        self.max_buffer_size: int = 20
+        # Dimension des vecteurs, connue au premier ajout si le store est nouveau
+        self.dim: int = 0
+        self.dtype: str = dtype
+
+        # Si le store existe déjà, son type et sa dimension font foi
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta: dict = json.load(f)
+            self.dim = meta["dim"]
+            self.dtype = meta["dtype"]
+
+        #
+        if self.dtype not in ACCEPTED_DTYPES:
+            raise UserWarning(f"Error: unknown embedding store dtype : {self.dtype}")
+
+        # Taille d'une ligne en octets
+        self.row_nbytes: int = self.dim * np.dtype(self.dtype).itemsize
+
+        # L'index en mémoire : hash du texte -> (première ligne, nombre de lignes, type d'entrée)
+        self.index: dict[int, tuple[int, int, int]] = {}
+
+        # Nombre de lignes réellement présentes dans le fichier de données
+        self.nb_rows: int = 0
+
+        # Entrées ajoutées mais pas encore écrites dans le fichier d'index
+        self.pending_index: list[tuple[int, int, int, int]] = []
+
+        # Vue mappée sur le fichier de données, et son nombre de lignes
+        self.mmap: Optional[np.memmap] = None
+        self.mmap_nb_rows: int = 0
+
+        # Fichier ouvert en ajout pour les nouvelles lignes
+        self.data_file = None
+
+        # Pour pouvoir être utilisé par plusieurs threads
+        self.mutex: Lock = Lock()
+
         #
+        self.load_index()
 
     #
-    def get_path_key(self, txt_key: str) -> str:
+    def load_index(self) -> None:
+        """
+        Charge l'index depuis le disque, en ignorant les entrées incomplètes (écriture interrompue).
         """
-        Fonction pour convertir le texte du message de l'embedding vers un chemin précis.
 
-        Args:
-            txt_key (str): le texte du message de l'embedding
+        #
+        if self.row_nbytes > 0 and os.path.exists(self.data_path):
+            self.nb_rows = os.path.getsize(self.data_path) // self.row_nbytes
 
-        Returns:
-            str: Le chemin pour l'embedding sauvegardé pour ce message de l'embedding
+        #
+        if not os.path.exists(self.index_path):
+            return
+
+        # On ignore un éventuel enregistrement partiel à la fin du fichier
+        nb_records: int = os.path.getsize(self.index_path) // INDEX_DTYPE.itemsize
+        records: np.ndarray = np.fromfile(self.index_path, dtype=INDEX_DTYPE, count=nb_records)
+
+        #
+        for key, start, nb_rows, flags in records.tolist():
+            # Les données de cette entrée n'ont pas été entièrement écrites
+            if start + nb_rows > self.nb_rows:
+                continue
+            #
+            self.index[key] = (start, nb_rows, flags)
+
+    #
+    def remap(self) -> None:
+        """
+        Met à jour la vue mappée en mémoire pour qu'elle couvre toutes les lignes écrites.
         """
 
-        file_base_name: str = f"{self.base_dir_path}{txt_key}"
         #
-        if len(file_base_name) > 260:
-            file_base_name = file_base_name[:260]
+        if self.data_file is not None:
+            self.data_file.flush()
         #
-        return f"{file_base_name}.pk"
+        if self.nb_rows == 0:
+            return
+        # Mode "c" (copy-on-write) : les vues sont modifiables sans jamais écrire dans le fichier
+        self.mmap = np.memmap(self.data_path, dtype=self.dtype, mode="c", shape=(self.nb_rows, self.dim))
+        self.mmap_nb_rows = self.nb_rows
 
     #
-    def save_txt_key_from_buffer(self, txt_key: str) -> None:
+    def has(self, txt_key: str) -> bool:
         """
-        Enregistre sur le disque l'embedding d'un message qui est dans le buffer
+        Renvoie Vrai si une entrée existe pour ce texte.
 
         Args:
             txt_key (str): le texte du message de l'embedding
 
-        Raises:
-            SystemError: renvoie une erreur si le message à enregistrer n'est pas dans le buffer
+        Returns:
+            bool: Vrai si une entrée existe pour ce texte, Faux sinon
         """
 
         #
-        if not txt_key in self.buffer:
-            raise SystemError(f"Error, key \"{txt_key}\" is not in buffer")
-        #
-        with open(self.get_path_key(txt_key), "wb") as f:
-            pickle.dump(self.buffer[txt_key], f, protocol=pickle.HIGHEST_PROTOCOL)
+        return hash_txt_key(txt_key) in self.index
 
     #
-    def save_txt_key_directly(self, txt_key: str, msg_emb: MessageEmbedding) -> None:
+    def get(self, txt_key: str) -> Optional[tuple[np.ndarray, int]]:
         """
-        Sauvegarde directement un message et son embedding sur le disque.
+        Récupère les lignes associées à ce texte, sous forme de vue sur le fichier mappé (pas de copie).
 
         Args:
             txt_key (str): le texte du message de l'embedding
-            msg_emb (MessageEmbedding): l'embedding du message
+
+        Returns:
+            Optional[tuple[np.ndarray, int]]: La matrice (nb_rows, dim) et le type d'entrée, ou None si absent
         """
 
         #
-        with open(self.get_path_key(txt_key), "wb") as f:
-            pickle.dump(msg_emb, f, protocol=pickle.HIGHEST_PROTOCOL)
+        entry: Optional[tuple[int, int, int]] = self.index.get(hash_txt_key(txt_key))
+        #
+        if entry is None:
+            return None
+        #
+        start, nb_rows, flags = entry
         #
-        print(f"Cache set : {self.get_path_key(txt_key)}")
+        if start + nb_rows > self.mmap_nb_rows:
+            self.mutex.acquire()
+            try:
+                if start + nb_rows > self.mmap_nb_rows:
+                    self.remap()
+            finally:
+                self.mutex.release()
         #
+        return (self.mmap[start:start+nb_rows], flags)
 
     #
-    def add_to_buffer(self, txt_key: str, msg_emb: MessageEmbedding) -> None:
+    def append(self, txt_key: str, rows: np.ndarray, flags: int = ENTRY_TOKENS_STATES) -> None:
         """
-        Ajoute un message et son embedding dans le buffer.
+        Ajoute les lignes associées à un texte à la fin du store.
 
         Args:
             txt_key (str): le texte du message de l'embedding
-            msg_emb (MessageEmbedding): L'embedding du message
+            rows (np.ndarray): Matrice de dimension (nb_rows, dim)
+            flags (int, optional): Type d'entrée. Defaults to ENTRY_TOKENS_STATES.
+
+        Raises:
+            UserWarning: Si la dimension des lignes ne correspond pas à celle du store
         """
 
         #
-        if len(self.buffer) >= self.max_buffer_size:
-            self.save()
+        key: int = hash_txt_key(txt_key)
         #
-        self.buffer = {}
-        #
-        self.buffer[txt_key] = msg_emb
+        if rows.ndim == 1:
+            rows = rows[None, :]
+
         #
-        self.unsaved_changes = True
+        self.mutex.acquire()
+        try:
+            #
+            if key in self.index:
+                return
+
+            # Premier ajout dans un nouveau store, on fixe la dimension
+            if self.dim == 0:
+                self.dim = rows.shape[1]
+                self.row_nbytes = self.dim * np.dtype(self.dtype).itemsize
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim, "dtype": self.dtype}, f)
+            #
+            if rows.shape[1] != self.dim:
+                raise UserWarning(f"Error: embedding dimension {rows.shape[1]} doesn't match the store dimension {self.dim}")
+
+            #
+            if self.data_file is None:
+                self.data_file = open(self.data_path, "ab")
+            #
+            self.data_file.write(np.ascontiguousarray(rows, dtype=self.dtype).tobytes())
+            #
+            start: int = self.nb_rows
+            self.nb_rows += rows.shape[0]
+            #
+            self.index[key] = (start, rows.shape[0], flags)
+            self.pending_index.append((key, start, rows.shape[0], flags))
+
+            #
+            if len(self.pending_index) >= INDEX_FLUSH_EVERY:
+                self.flush()
+        finally:
+            self.mutex.release()
 
     #
-    def save(self) -> None:
+    def flush(self) -> None:
         """
-        Sauvegarde toutes les modifications du caches qui n'ont pas encore été sauvegardées.
+        Écrit sur le disque les données et les entrées d'index en attente.
+        Les données sont toujours écrites avant l'index, pour qu'une entrée d'index pointe toujours vers des données complètes.
         """
 
-        # On ne sauvegarde pas s'il n'y a rien à sauvegarder
-        if not self.unsaved_changes:
+        #
+        if self.data_file is not None:
+            self.data_file.flush()
+            os.fsync(self.data_file.fileno())
+        #
+        if len(self.pending_index) == 0:
             return
+        #
+        with open(self.index_path, "ab") as f:
+            f.write(np.array(self.pending_index, dtype=INDEX_DTYPE).tobytes())
+        #
+        self.pending_index = []
+
+    #
+    def save(self) -> None:
+        """
+        Sauvegarde toutes les modifications du store qui n'ont pas encore été sauvegardées.
+        """
 
         #
-        for txt_key in self.buffer:
-            self.save_txt_key_from_buffer(txt_key)
+        self.mutex.acquire()
+        try:
+            self.flush()
+        finally:
+            self.mutex.release()
+
+
+#
+class EmbeddingCache:
+    """
+    Ce fichier contient une classe et des fonctions pour faire du cache d'embeddings, ce qui permet de calculer une seule fois un embedding, et d'ensuite l'enregistrer sur le disque, et ensuite, on le recharge au lieu de le recalculer.
+    La méthode utilisée ici est de stocker tous les embeddings d'un modèle dans un unique store de vecteurs (voir EmbeddingSegmentStore), un sous-dossier par modèle d'embedding différent.
+    Pour un embedding compact, seul le vecteur moyen normalisé est stocké (une seule ligne).
+    Sinon, seuls les états des tokens présents dans le masque d'attention sont stockés, le padding n'est jamais écrit sur le disque.
+    """
+
+    def __init__(self, embedding_model_name: str, conf: Config, dtype: str = "float32") -> None:
+        # La configuration globale du projet
+        self.conf: Config = conf
+
+        # Le nom du modèle d'embedding utilisé
+        self.embedding_model_name: str = embedding_model_name
+
+        # On prépare ici le chemin où seront enregistrés les embeddings
+        self.base_dir_path: str = f"{self.conf.cache_dir_embeddings}/{self.embedding_model_name}/"
+
+        # Le store de vecteurs de ce modèle
+        self.store: EmbeddingSegmentStore = EmbeddingSegmentStore(self.base_dir_path, dtype)
+
+    #
+    def save(self) -> None:
+        """
+        Sauvegarde toutes les modifications du caches qui n'ont pas encore été sauvegardées.
+        """
 
         #
-        self.unsaved_changes = False
+        self.store.save()
 
     #
     def has(self, txt_key: str) -> bool:
@@ -151,14 +350,13 @@ class EmbeddingCache:
         """
 
         #
-        txt_key = escapeCharacters(txt_key)
-        #
-        return os.path.exists(self.get_path_key(txt_key))
+        return self.store.has(txt_key)
 
     #
     def get(self, txt_key: str) -> Optional[MessageEmbedding]:
         """
         Récupère s'il existe l'embedding pré-calculé pour le message qui lui est associé.
+        Le tenseur renvoyé partage sa mémoire avec le fichier mappé (pas de copie pour un store en float32).
 
         Args:
             txt_key (str): le texte du message de l'embedding
@@ -168,23 +366,31 @@ class EmbeddingCache:
         """
 
         #
-        txt_key = escapeCharacters(txt_key)
+        res: Optional[tuple[np.ndarray, int]] = self.store.get(txt_key)
         #
-        if not self.has(txt_key):
+        if res is None:
             return None
         #
-        try:
-            #
-            with open(self.get_path_key(txt_key), "rb") as f:
-                msg_embedding: MessageEmbedding = pickle.load(f)
-            return msg_embedding
+        rows: torch.Tensor = torch.from_numpy(res[0])
+        # Les calculs de distance se font en float32
+        if rows.dtype != torch.float32:
+            rows = rows.float()
         #
-        except Exception as e:
-            #
-            os.remove(self.get_path_key(txt_key))
-            #
-            print(f"Error JSON embedding loading: {txt_key}")
-            return None
+        if res[1] == ENTRY_SENTENCE_EMBEDDING:
+            return MessageEmbedding(
+                txt=txt_key,
+                tokens=None,
+                attention_mask=None,
+                last_hidden_state=None,
+                sentence_embedding=rows[0]
+            )
+        #
+        return MessageEmbedding(
+            txt=txt_key,
+            tokens=torch.zeros((0,), dtype=torch.int64),
+            attention_mask=torch.ones((rows.shape[0],), dtype=torch.int64),
+            last_hidden_state=rows
+        )
 
     #
     def set(self, txt_key: str, message_embedding: MessageEmbedding) -> None:
@@ -196,12 +402,17 @@ class EmbeddingCache:
             message_embedding (MessageEmbedding): L'embedding calculé
         """
 
-        #
-        txt_key = escapeCharacters(txt_key)
-        #
-        self.save_txt_key_directly(txt_key, message_embedding)
-        #
-        # self.add_to_buffer(txt_key, message_embedding)
-        #
-        # self.unsaved_changes = True
+        # Embedding compact, on ne stocke que le vecteur moyen normalisé
+        if message_embedding.last_hidden_state is None or message_embedding.attention_mask is None:
+            #
+            if message_embedding.sentence_embedding is None:
+                raise UserWarning(f"Error: empty message embedding for `{txt_key}`")
+            #
+            self.store.append(txt_key, message_embedding.sentence_embedding.detach().cpu().float().numpy(), ENTRY_SENTENCE_EMBEDDING)
+            return
 
+        # On ne garde que les tokens présents dans le masque d'attention
+        mask: torch.Tensor = message_embedding.attention_mask.bool()
+        rows: torch.Tensor = message_embedding.last_hidden_state[mask] if mask.shape[0] == message_embedding.last_hidden_state.shape[0] else message_embedding.last_hidden_state
+        #
+        self.store.append(txt_key, rows.detach().cpu().float().numpy())
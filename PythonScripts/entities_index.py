@@ -0,0 +1,204 @@
+"""
+Index inversé des entités nommées (entité -> lignes des textes qui la contiennent, avec le nombre d'occurrences),
+pour calculer le score d'entités en commun (`calc_common_entities`) uniquement avec les textes qui ont au moins une entité égale ou contenue/contenante,
+au lieu de comparer tous les couples de textes.
+
+Auteur: Nathan Cerisara
+"""
+
+from bisect import bisect_left
+from threading import Lock
+
+
+# Entités ignorées dans les scores
+BAD_ENTITIES: set[str] = set(["", " ", "\n"])
+
+# Score d'un couple d'entités égales, et d'un couple d'entités dont l'une contient l'autre (mêmes valeurs que `calc_common_entities`)
+SCORE_EQUAL_ENTITIES: float = 0.1
+SCORE_CONTAINED_ENTITIES: float = 0.08
+
+
+#
+def count_entities(entities: list[tuple[int, str, str]]) -> dict[str, int]:
+    """
+    Compte le nombre d'occurrences de chaque texte d'entité (les entités de `BAD_ENTITIES` sont ignorées).
+
+    Args:
+        entities (list[tuple[int, str, str]]): Les entités (position, texte, type)
+
+    Returns:
+        dict[str, int]: Nombre d'occurrences de chaque texte d'entité
+    """
+
+    #
+    counts: dict[str, int] = {}
+    for entity in entities:
+        if entity[1] in BAD_ENTITIES:
+            continue
+        counts[entity[1]] = counts.get(entity[1], 0) + 1
+    #
+    return counts
+
+
+#
+class EntitiesIndex:
+    """
+    Index inversé des entités : chaque texte indexé a une ligne, et chaque entité a la liste des lignes des textes qui la contiennent.
+    Les suffixes de toutes les entités sont gardés triés, pour trouver rapidement les entités qui contiennent une entité donnée.
+    """
+
+    def __init__(self) -> None:
+        """
+        Crée un index vide.
+        """
+
+        # Clé de chaque ligne, et ligne de chaque clé
+        self.keys: list[str] = []
+        self.keys_rows: dict[str, int] = {}
+
+        # Id de chaque texte d'entité, et pour chaque entité, la liste des (ligne, nombre d'occurrences)
+        self.entities_ids: dict[str, int] = {}
+        self.entities_texts: list[str] = []
+        self.postings: list[list[tuple[int, int]]] = []
+
+        # (suffixe, id de l'entité) de toutes les entités, triés, et ceux des nouvelles entités pas encore triés
+        self.suffixes: list[tuple[str, int]] = []
+        self.pending_suffixes: list[tuple[str, int]] = []
+
+        # Les textes peuvent être ajoutés pendant une recherche
+        self.mutex: Lock = Lock()
+
+    #
+    def has(self, key: str) -> bool:
+        """
+        Indique si cette clé est indexée.
+
+        Args:
+            key (str): La clé
+
+        Returns:
+            bool: Si la clé est indexée
+        """
+
+        #
+        return key in self.keys_rows
+
+    #
+    def get_row(self, key: str) -> int:
+        """
+        Renvoie la ligne d'une clé indexée.
+
+        Args:
+            key (str): La clé
+
+        Returns:
+            int: La ligne de la clé
+        """
+
+        #
+        return self.keys_rows[key]
+
+    #
+    def add(self, keys: list[str], entities_lst: list[list[tuple[int, str, str]]]) -> None:
+        """
+        Ajoute des textes (et leurs entités) à l'index (les clés déjà indexées sont ignorées).
+
+        Args:
+            keys (list[str]): Clés des textes
+            entities_lst (list[list[tuple[int, str, str]]]): Entités de chaque texte, dans le même ordre
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            for key, entities in zip(keys, entities_lst):
+                #
+                if key in self.keys_rows:
+                    continue
+                #
+                row: int = len(self.keys)
+                self.keys.append(key)
+                self.keys_rows[key] = row
+                #
+                for entity_txt, count in count_entities(entities).items():
+                    #
+                    if not entity_txt in self.entities_ids:
+                        entity_id: int = len(self.entities_texts)
+                        self.entities_ids[entity_txt] = entity_id
+                        self.entities_texts.append(entity_txt)
+                        self.postings.append([])
+                        self.pending_suffixes += [(entity_txt[i:], entity_id) for i in range(len(entity_txt))]
+                    #
+                    self.postings[self.entities_ids[entity_txt]].append( (row, count) )
+        finally:
+            self.mutex.release()
+
+    #
+    def get_related_entities(self, entity_txt: str) -> dict[int, float]:
+        """
+        Renvoie les entités de l'index égales à une entité, ou qui la contiennent, ou qui sont contenues dedans, avec le score d'un couple. Le mutex doit être pris.
+
+        Args:
+            entity_txt (str): Texte de l'entité
+
+        Returns:
+            dict[int, float]: Score de chaque id d'entité liée
+        """
+
+        #
+        related: dict[int, float] = {}
+
+        # Entités contenues dans celle-ci : ce sont des sous-chaînes de l'entité
+        for i in range(len(entity_txt)):
+            for j in range(i + 1, len(entity_txt) + 1):
+                if entity_txt[i:j] in self.entities_ids:
+                    related[self.entities_ids[entity_txt[i:j]]] = SCORE_CONTAINED_ENTITIES
+
+        # Entités qui contiennent celle-ci : l'un de leurs suffixes commence par l'entité
+        k: int = bisect_left(self.suffixes, (entity_txt,))
+        while k < len(self.suffixes) and self.suffixes[k][0].startswith(entity_txt):
+            related[self.suffixes[k][1]] = SCORE_CONTAINED_ENTITIES
+            k += 1
+
+        # Entité égale
+        if entity_txt in self.entities_ids:
+            related[self.entities_ids[entity_txt]] = SCORE_EQUAL_ENTITIES
+
+        #
+        return related
+
+    #
+    def score(self, entities: list[tuple[int, str, str]]) -> dict[int, float]:
+        """
+        Calcule le score d'entités en commun (comme `calc_common_entities`) entre des entités et chaque texte indexé qui en a au moins une liée,
+        en ne parcourant que les listes des entités liées.
+
+        Args:
+            entities (list[tuple[int, str, str]]): Les entités (position, texte, type)
+
+        Returns:
+            dict[int, float]: Score de chaque ligne qui a au moins une entité liée (les autres ont un score de 0)
+        """
+
+        #
+        scores: dict[int, float] = {}
+
+        #
+        self.mutex.acquire()
+        try:
+            # On trie les suffixes des nouvelles entités avec les autres
+            if len(self.pending_suffixes) > 0:
+                self.suffixes += self.pending_suffixes
+                self.suffixes.sort()
+                self.pending_suffixes = []
+
+            #
+            for entity_txt, count in count_entities(entities).items():
+                for entity_id, pair_score in self.get_related_entities(entity_txt).items():
+                    for row, count2 in self.postings[entity_id]:
+                        scores[row] = scores.get(row, 0.0) + count * count2 * pair_score
+        finally:
+            self.mutex.release()
+
+        #
+        return scores
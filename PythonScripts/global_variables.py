@@ -10,14 +10,21 @@ from typing import cast, Optional
 import os
 import json
 from threading import Lock
+from collections import OrderedDict
 
 from embeddings_cache import EmbeddingCache
 from language_translation import LanguageTranslation
-from embedding_calculator import MessageEmbedding
+from embedding_calculator import MessageEmbedding, EmbeddingCalculator
+from embedding_service import EmbeddingService, DEFAULT_MAX_WAIT_MS, DEFAULT_MAX_BATCH_SIZE
+from aho_corasick import AhoCorasickAutomaton
+from levenshtein_engine import LevenshteinEngine
 
 
 GLOBAL_VARIABLE_NAME: str = "global_variables"
 
+# Nombre de vecteurs de NER gardés en mémoire, par ensemble de dictionnaires de NER
+NER_VECTORS_LRU_CAPACITY: int = 1 << 16
+
 
 #
 class GlobalVariables:
@@ -32,15 +39,36 @@ class GlobalVariables:
         #
         self.NER_dicts: dict[str, dict[str, str]] = {}
 
+        # Date de modification du fichier de chaque dictionnaire de NER chargé, pour le recharger s'il a changé
+        self.NER_dicts_mtimes: dict[str, float] = {}
+
+        # Automates (et textes de remplacement) compilés pour chaque dictionnaire de NER
+        self.NER_automatons: dict[str, tuple[AhoCorasickAutomaton, list[str]]] = {}
+
+        # Bases des vecteurs de NER (et leurs automates) pour chaque ensemble de dictionnaires de NER
+        self.NER_bases: dict[tuple[str, ...], tuple[list[str], AhoCorasickAutomaton]] = {}
+
+        # Vecteurs bag of entity de NER (sous forme de bits) les plus récemment utilisés, par ensemble de dictionnaires de NER puis par texte
+        self.NER_vectors: dict[tuple[str, ...], OrderedDict[str, int]] = {}
+
         #
         self.mutex_NER_dicts: Lock = Lock()
 
+        # Moteur de distances de Levenshtein (et son cache), partagé entre toutes les recherches
+        self.levenshtein_engine: LevenshteinEngine = LevenshteinEngine()
+
         #
         self.embedding_caches: dict[str, EmbeddingCache] = {}
 
         #
         self.mutex_embedding_caches: Lock = Lock()
 
+        # Services de calcul d'embeddings partagés, un par modèle (et type d'embedding calculé)
+        self.embedding_services: dict[str, EmbeddingService] = {}
+
+        #
+        self.mutex_embedding_services: Lock = Lock()
+
         #
         self.language_translations: dict[str, LanguageTranslation] = {}
 
@@ -50,23 +78,162 @@ class GlobalVariables:
     #
     def get_NER_dict(self, NER_dict_name: str) -> dict[str, str]:
 
-        # Test si il est déjà chargé
-        if NER_dict_name in self.NER_dicts:
-            return self.NER_dicts[NER_dict_name]
-
-        # Sinon, il faut le charger
-
         # On vérifie que le fichier existe
         file_path: str = f"{self.config.ner_dicts_dir}{NER_dict_name}.json"
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"Erreur: le fichier {file_path} n'existe pas!")
 
-        # On charge le fichier
-        with open(file_path, "r", encoding="utf-8") as f:
-            self.NER_dicts[NER_dict_name] = json.load(f)
+        # Test si il est déjà chargé, et si le fichier n'a pas changé depuis
+        #   (la date est lue avec `get`, car un autre thread peut être en train de charger le dictionnaire)
+        mtime: float = os.path.getmtime(file_path)
+        if NER_dict_name in self.NER_dicts and self.NER_dicts_mtimes.get(NER_dict_name) == mtime:
+            return self.NER_dicts[NER_dict_name]
 
-        # On renvoie le NER dict
-        return self.NER_dicts[NER_dict_name]
+        # Sinon, il faut le charger
+        self.mutex_NER_dicts.acquire()
+        try:
+            # Un autre thread a pu le charger pendant qu'on attendait le mutex
+            if NER_dict_name in self.NER_dicts and self.NER_dicts_mtimes.get(NER_dict_name) == mtime:
+                return self.NER_dicts[NER_dict_name]
+
+            #
+            ner_dict: dict[str, str]
+            with open(file_path, "r", encoding="utf-8") as f:
+                ner_dict = json.load(f)
+            self.NER_dicts[NER_dict_name] = ner_dict
+            self.NER_dicts_mtimes[NER_dict_name] = mtime
+
+            # Les automates compilés avec l'ancienne version ne sont plus valides
+            if NER_dict_name in self.NER_automatons:
+                del self.NER_automatons[NER_dict_name]
+            for ner_dicts in [k for k in self.NER_bases if NER_dict_name in k]:
+                del self.NER_bases[ner_dicts]
+            for ner_dicts in [k for k in self.NER_vectors if NER_dict_name in k]:
+                del self.NER_vectors[ner_dicts]
+
+            # On renvoie le NER dict
+            return ner_dict
+        finally:
+            self.mutex_NER_dicts.release()
+
+    #
+    def get_NER_automaton(self, NER_dict_name: str) -> tuple[AhoCorasickAutomaton, list[str]]:
+        """
+        Renvoie l'automate des clés d'un dictionnaire de NER, et le texte de remplacement de chaque clé, pour faire tous les remplacements d'un texte en un seul passage.
+
+        Args:
+            NER_dict_name (str): Nom du dictionnaire de NER
+
+        Returns:
+            tuple[AhoCorasickAutomaton, list[str]]: L'automate, et les textes de remplacement dans l'ordre des motifs de l'automate
+        """
+
+        # Recharge le dictionnaire (et invalide son automate) si son fichier a changé
+        ner_dict: dict[str, str] = self.get_NER_dict(NER_dict_name)
+        #
+        self.mutex_NER_dicts.acquire()
+        try:
+            if not NER_dict_name in self.NER_automatons:
+                keys: list[str] = list(ner_dict.keys())
+                self.NER_automatons[NER_dict_name] = (AhoCorasickAutomaton(keys), [ner_dict[k] for k in keys])
+            #
+            return self.NER_automatons[NER_dict_name]
+        finally:
+            self.mutex_NER_dicts.release()
+
+    #
+    def get_NER_base(self, ner_dicts: list[str]) -> tuple[list[str], AhoCorasickAutomaton]:
+        """
+        Renvoie la base des vecteurs bag of entity de NER pour un ensemble de dictionnaires (toutes leurs clés, triées), et l'automate de ces clés.
+
+        Args:
+            ner_dicts (list[str]): Noms des dictionnaires de NER
+
+        Returns:
+            tuple[list[str], AhoCorasickAutomaton]: La base, et l'automate dont les motifs sont les éléments de la base
+        """
+
+        # Recharge les dictionnaires (et invalide les bases) si leurs fichiers ont changé
+        keys: set[str] = set()
+        for ner_dict_name in ner_dicts:
+            keys.update(self.get_NER_dict(ner_dict_name).keys())
+        #
+        key: tuple[str, ...] = tuple(ner_dicts)
+        self.mutex_NER_dicts.acquire()
+        try:
+            if not key in self.NER_bases:
+                # Pour s'assurer de toujours avoir le même ordre
+                ner_base: list[str] = sorted(keys)
+                self.NER_bases[key] = (ner_base, AhoCorasickAutomaton(ner_base))
+            #
+            return self.NER_bases[key]
+        finally:
+            self.mutex_NER_dicts.release()
+
+    #
+    def get_NER_vectors(self, ner_dicts: list[str], txts: list[str]) -> list[int]:
+        """
+        Renvoie les vecteurs bag of entity de NER de textes, sous forme de bits (le bit i vaut 1 si le i-ème élément de la base est dans le texte).
+        Les vecteurs les plus récemment utilisés sont gardés en mémoire (LRU de `NER_VECTORS_LRU_CAPACITY` textes par ensemble de dictionnaires).
+
+        Args:
+            ner_dicts (list[str]): Noms des dictionnaires de NER
+            txts (list[str]): Les textes
+
+        Returns:
+            list[int]: Le vecteur de chaque texte, dans l'ordre
+        """
+
+        #
+        ner_automaton: AhoCorasickAutomaton
+        _, ner_automaton = self.get_NER_base(ner_dicts)
+        #
+        key: tuple[str, ...] = tuple(ner_dicts)
+        vectors: list[Optional[int]] = [None] * len(txts)
+
+        # On récupère les vecteurs déjà calculés
+        self.mutex_NER_dicts.acquire()
+        try:
+            if key in self.NER_vectors:
+                vectors_cache: OrderedDict[str, int] = self.NER_vectors[key]
+                for i, txt in enumerate(txts):
+                    if txt in vectors_cache:
+                        vectors_cache.move_to_end(txt)
+                        vectors[i] = vectors_cache[txt]
+        finally:
+            self.mutex_NER_dicts.release()
+
+        # On calcule les autres sans bloquer le mutex (une seule fois par texte)
+        new_vectors: dict[str, int] = {}
+        for i, txt in enumerate(txts):
+            if vectors[i] is None:
+                if not txt in new_vectors:
+                    new_vectors[txt] = sum(1 << j for j in ner_automaton.find_patterns(txt))
+                vectors[i] = new_vectors[txt]
+
+        # Et on les garde en mémoire, sauf si les dictionnaires ont été rechargés entre temps
+        if len(new_vectors) > 0:
+            self.mutex_NER_dicts.acquire()
+            try:
+                if key in self.NER_bases and self.NER_bases[key][1] is ner_automaton:
+                    if not key in self.NER_vectors:
+                        self.NER_vectors[key] = OrderedDict()
+                    vectors_cache = self.NER_vectors[key]
+                    for txt, vector in new_vectors.items():
+                        vectors_cache[txt] = vector
+                        vectors_cache.move_to_end(txt)
+                    while len(vectors_cache) > NER_VECTORS_LRU_CAPACITY:
+                        vectors_cache.popitem(last=False)
+            finally:
+                self.mutex_NER_dicts.release()
+
+        #
+        return cast(list[int], vectors)
+
+    #
+    def get_levenshtein_engine(self) -> LevenshteinEngine:
+        #
+        return self.levenshtein_engine
 
     #
     def get_NER_dict_keys(self, NER_dict_name: str) -> list[str]:
@@ -74,36 +241,65 @@ class GlobalVariables:
         return list(self.get_NER_dict(NER_dict_name).keys())
 
     #
-    def get_embedding_cache(self, model_name: str, txt_key: str) -> Optional[MessageEmbedding]:
+    def get_model_embedding_cache(self, model_name: str) -> EmbeddingCache:
         #
         if not model_name in self.embedding_caches:
-            return None
+            self.mutex_embedding_caches.acquire()
+            try:
+                if not model_name in self.embedding_caches:
+                    self.embedding_caches[model_name] = EmbeddingCache(model_name, self.config)
+            finally:
+                self.mutex_embedding_caches.release()
+        #
+        return self.embedding_caches[model_name]
+
+    #
+    def get_embedding_cache(self, model_name: str, txt_key: str) -> Optional[MessageEmbedding]:
         #
-        return self.embedding_caches[model_name].get(txt_key)
+        return self.get_model_embedding_cache(model_name).get(txt_key)
 
     #
     def set_embedding_cache(self, model_name: str, txt_key: str, message_embedding: MessageEmbedding) -> None:
         #
-        if not model_name in self.embedding_caches:
-            self.mutex_embedding_caches.acquire()
+        self.get_model_embedding_cache(model_name).set(txt_key, message_embedding)
+
+    #
+    def get_embedding_service(self, embedding_calculator: EmbeddingCalculator, max_wait_ms: float = DEFAULT_MAX_WAIT_MS, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE) -> EmbeddingService:
+        # Deux calculateurs qui calculent les embeddings de la même façon, avec les mêmes paramètres de regroupement, partagent le même service
+        service_key: str = f"{embedding_calculator.model_name}|{embedding_calculator.model_optimisations}|{embedding_calculator.device}|{int(embedding_calculator.compact_embeddings)}|{int(embedding_calculator.dynamic_padding)}|{float(max_wait_ms)}|{int(max_batch_size)}"
+        #
+        if not service_key in self.embedding_services:
+            self.mutex_embedding_services.acquire()
             try:
-                self.embedding_caches[model_name] = EmbeddingCache(model_name, self.config)
+                if not service_key in self.embedding_services:
+                    self.embedding_services[service_key] = EmbeddingService(embedding_calculator, max_wait_ms, max_batch_size)
             finally:
-                self.mutex_embedding_caches.release()
+                self.mutex_embedding_services.release()
         #
-        self.embedding_caches[model_name].set(txt_key, message_embedding)
+        return self.embedding_services[service_key]
 
     #
-    def translate(self, txt_to_translate: str, dest_lang: str = "en") -> str:
+    def get_language_translation(self, dest_lang: str = "en") -> LanguageTranslation:
         #
         if not dest_lang in self.language_translations:
             self.mutex_language_translations.acquire()
             try:
-                self.language_translations[dest_lang] = LanguageTranslation("easyNMT", self.config, dest_lang)
+                if not dest_lang in self.language_translations:
+                    self.language_translations[dest_lang] = LanguageTranslation("easyNMT", self.config, dest_lang)
             finally:
                 self.mutex_language_translations.release()
         #
-        return self.language_translations[dest_lang].translate(txt_to_translate)
+        return self.language_translations[dest_lang]
+
+    #
+    def translate(self, txt_to_translate: str, dest_lang: str = "en") -> str:
+        #
+        return self.get_language_translation(dest_lang).translate(txt_to_translate)
+
+    #
+    def translate_many(self, txts_to_translate: list[str], dest_lang: str = "en") -> list[str]:
+        #
+        return self.get_language_translation(dest_lang).translate_many(txts_to_translate)
 
     #
     def save(self):
@@ -149,5 +345,8 @@ def free_global_variables() -> None:
         #
         globals()[GLOBAL_VARIABLE_NAME].save()
         #
+        for service in globals()[GLOBAL_VARIABLE_NAME].embedding_services.values():
+            service.stop()
+        #
         del globals()[GLOBAL_VARIABLE_NAME]
 
@@ -0,0 +1,288 @@
+"""
+Index inversé des mots des messages d'une instance Rainbow (mot -> liste des textes qui le contiennent, avec le nombre d'occurrences),
+pour que la recherche syntaxique ne regarde que les messages qui ont au moins un mot en commun avec la recherche.
+Les statistiques de BM25 (nombre de documents, longueur moyenne, fréquences des mots) ne sont calculées que sur les documents de l'index,
+un par message de l'instance Rainbow : les autres textes indexés (parties de messages, ...) ne changent pas les scores des recherches suivantes.
+
+Auteur: Nathan Cerisara
+"""
+
+import math
+from threading import Lock
+
+
+# Paramètres classiques de BM25
+BM25_K1: float = 1.2
+BM25_B: float = 0.75
+
+
+#
+def tokenize(txt: str) -> list[str]:
+    """
+    Découpe un texte en mots, sans tenir compte de la casse (même découpage que `find_common_words`).
+
+    Args:
+        txt (str): Le texte
+
+    Returns:
+        list[str]: Les mots du texte
+    """
+
+    #
+    return txt.strip().lower().split()
+
+
+#
+class InvertedIndex:
+    """
+    Index inversé : chaque texte indexé a une ligne, et chaque mot a la liste des lignes des textes qui le contiennent, avec le nombre d'occurrences du mot.
+    """
+
+    def __init__(self, txts: list[str] = []) -> None:
+        """
+        Crée l'index, avec les textes donnés.
+
+        Args:
+            txts (list[str], optional): Textes à indexer. Defaults to [].
+        """
+
+        # Texte de chaque ligne, et ligne de chaque texte
+        self.keys: list[str] = []
+        self.keys_rows: dict[str, int] = {}
+
+        # Listes des lignes (et des nombres d'occurrences) de chaque mot
+        self.postings_rows: dict[str, list[int]] = {}
+        self.postings_tfs: dict[str, list[int]] = {}
+
+        # Nombre de mots de chaque ligne
+        self.docs_lengths: list[int] = []
+
+        # Documents des statistiques de BM25 (id du message -> ligne de son texte), leur nombre total de mots, et le nombre de documents qui contiennent chaque mot
+        self.docs_rows: dict[str, int] = {}
+        self.docs_total_length: int = 0
+        self.docs_frequencies: dict[str, int] = {}
+
+        # Les textes peuvent être ajoutés pendant une recherche
+        self.mutex: Lock = Lock()
+
+        #
+        self.add(txts)
+
+    #
+    def has(self, txt: str) -> bool:
+        """
+        Indique si ce texte est indexé.
+
+        Args:
+            txt (str): Le texte
+
+        Returns:
+            bool: Si le texte est indexé
+        """
+
+        #
+        return txt in self.keys_rows
+
+    #
+    def add_text(self, txt: str) -> int:
+        """
+        Ajoute un texte à l'index s'il n'y est pas encore. Le mutex doit être pris.
+
+        Args:
+            txt (str): Le texte
+
+        Returns:
+            int: La ligne du texte
+        """
+
+        #
+        if txt in self.keys_rows:
+            return self.keys_rows[txt]
+        #
+        row: int = len(self.keys)
+        self.keys.append(txt)
+        self.keys_rows[txt] = row
+
+        # Nombre d'occurrences de chaque mot du texte
+        tokens: list[str] = tokenize(txt)
+        tfs: dict[str, int] = {}
+        for token in tokens:
+            tfs[token] = tfs.get(token, 0) + 1
+
+        #
+        for token, tf in tfs.items():
+            if not token in self.postings_rows:
+                self.postings_rows[token] = []
+                self.postings_tfs[token] = []
+            self.postings_rows[token].append(row)
+            self.postings_tfs[token].append(tf)
+
+        #
+        self.docs_lengths.append(len(tokens))
+        #
+        return row
+
+    #
+    def add(self, txts: list[str]) -> None:
+        """
+        Ajoute des textes à l'index (les textes déjà indexés sont ignorés), sans les compter dans les statistiques de BM25.
+
+        Args:
+            txts (list[str]): Les textes à ajouter
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            for txt in txts:
+                self.add_text(txt)
+        finally:
+            self.mutex.release()
+
+    #
+    def remove_document_statistics(self, doc_id: str) -> None:
+        """
+        Retire un document des statistiques de BM25 (son texte reste indexé). Le mutex doit être pris.
+
+        Args:
+            doc_id (str): Id du document
+        """
+
+        #
+        if not doc_id in self.docs_rows:
+            return
+        #
+        row: int = self.docs_rows.pop(doc_id)
+        self.docs_total_length -= self.docs_lengths[row]
+        for token in set(tokenize(self.keys[row])):
+            self.docs_frequencies[token] -= 1
+            if self.docs_frequencies[token] == 0:
+                del self.docs_frequencies[token]
+
+    #
+    def add_documents(self, docs: list[tuple[str, str]]) -> None:
+        """
+        Ajoute (ou remplace) des documents comptés dans les statistiques de BM25, un par message de l'instance Rainbow.
+
+        Args:
+            docs (list[tuple[str, str]]): Les documents (id du message, texte)
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            for doc_id, txt in docs:
+                #
+                row: int = self.add_text(txt)
+                #
+                if self.docs_rows.get(doc_id) == row:
+                    continue
+                #
+                self.remove_document_statistics(doc_id)
+                #
+                self.docs_rows[doc_id] = row
+                self.docs_total_length += self.docs_lengths[row]
+                for token in set(tokenize(txt)):
+                    self.docs_frequencies[token] = self.docs_frequencies.get(token, 0) + 1
+        finally:
+            self.mutex.release()
+
+    #
+    def remove_document(self, doc_id: str) -> None:
+        """
+        Retire un document des statistiques de BM25 (par exemple quand son message a été remplacé).
+
+        Args:
+            doc_id (str): Id du document
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            self.remove_document_statistics(doc_id)
+        finally:
+            self.mutex.release()
+
+    #
+    def get_missing_documents(self, docs_ids: list[str]) -> list[str]:
+        """
+        Renvoie les ids des documents qui ne sont pas encore dans les statistiques de BM25.
+
+        Args:
+            docs_ids (list[str]): Les ids des documents
+
+        Returns:
+            list[str]: Ceux qui ne sont pas dans les statistiques, dans l'ordre
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            return [doc_id for doc_id in docs_ids if not doc_id in self.docs_rows]
+        finally:
+            self.mutex.release()
+
+    #
+    def get_row(self, txt: str) -> int:
+        """
+        Renvoie la ligne d'un texte indexé.
+
+        Args:
+            txt (str): Le texte
+
+        Returns:
+            int: La ligne du texte
+        """
+
+        #
+        return self.keys_rows[txt]
+
+    #
+    def score(self, query: str, bm25: bool = False) -> dict[int, float]:
+        """
+        Calcule le score des textes qui ont au moins un mot en commun avec la recherche, en ne parcourant que les listes des mots de la recherche.
+
+        Args:
+            query (str): Texte de la recherche
+            bm25 (bool, optional): Si vrai, score BM25 (avec les statistiques des documents de l'index), sinon nombre de mots différents de la recherche présents dans le texte. Defaults to False.
+
+        Returns:
+            dict[int, float]: Score de chaque ligne qui a au moins un mot en commun avec la recherche (les autres ont un score de 0)
+        """
+
+        #
+        scores: dict[int, float] = {}
+
+        #
+        self.mutex.acquire()
+        try:
+            #
+            nb_docs: int = len(self.docs_rows)
+            avg_length: float = self.docs_total_length / nb_docs if nb_docs > 0 else 0.0
+
+            #
+            for token in set(tokenize(query)):
+                #
+                if not token in self.postings_rows:
+                    continue
+                #
+                rows: list[int] = self.postings_rows[token]
+                tfs: list[int] = self.postings_tfs[token]
+
+                #
+                if not bm25:
+                    for row in rows:
+                        scores[row] = scores.get(row, 0.0) + 1.0
+                    continue
+
+                #
+                doc_frequency: int = min(self.docs_frequencies.get(token, 0), nb_docs)
+                idf: float = math.log(1.0 + (nb_docs - doc_frequency + 0.5) / (doc_frequency + 0.5))
+                for row, tf in zip(rows, tfs):
+                    norm: float = BM25_K1 * (1.0 - BM25_B + BM25_B * self.docs_lengths[row] / avg_length) if avg_length > 0 else BM25_K1
+                    scores[row] = scores.get(row, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+        finally:
+            self.mutex.release()
+
+        #
+        return scores
@@ -0,0 +1,299 @@
+"""
+Dictionnaire clé (texte) -> valeur (json) persistant dans un fichier en ajout seul (une ligne `[clé, valeur]` par entrée),
+commun aux caches sur le disque (corpus pré-traités, résultats de NER, traductions).
+Tous les textes connus ont la position de leur ligne dans le fichier, seules les valeurs les plus récemment utilisées sont gardées en mémoire (LRU).
+Chaque écriture est synchronisée sur le disque, et une écriture interrompue ne peut perdre que les dernières entrées ajoutées.
+
+Auteur: Nathan Cerisara
+"""
+
+from typing import Optional, Any, Callable
+
+import os
+import json
+from collections import OrderedDict
+from threading import Lock
+
+
+# Nombre de valeurs gardées en mémoire
+DEFAULT_LRU_CAPACITY: int = 1 << 16
+
+# Le fichier est compacté quand il a au moins autant de lignes inutiles (remplacées ou incomplètes), et plus de lignes inutiles que de lignes utiles
+COMPACTION_MIN_DEAD_LINES: int = 1024
+
+# Nom du fichier, à côté du fichier des entrées, qui décrit à quoi elles correspondent
+META_FILE: str = "meta.json"
+
+
+#
+class JsonlStore:
+    """
+    Dictionnaire texte -> valeur, persistant dans un fichier en ajout seul.
+    """
+
+    def __init__(self,
+                 file_path: str,
+                 lru_capacity: int = DEFAULT_LRU_CAPACITY,
+                 flush_threshold: int = 1,
+                 decode_value: Optional[Callable[[Any], Any]] = None,
+                 meta: Optional[dict] = None
+                ) -> None:
+        """
+        Crée le dictionnaire, et charge l'index de ses entrées depuis le disque.
+
+        Args:
+            file_path (str): Fichier des entrées
+            lru_capacity (int, optional): Nombre de valeurs gardées en mémoire. Defaults to DEFAULT_LRU_CAPACITY.
+            flush_threshold (int, optional): Nombre de nouvelles entrées à partir duquel elles sont écrites sur le disque sans attendre une sauvegarde. Defaults to 1.
+            decode_value (Optional[Callable[[Any], Any]], optional): Conversion d'une valeur lue dans le fichier (ex: listes json -> tuples). Defaults to None.
+            meta (Optional[dict], optional): Description des entrées, écrite dans `META_FILE` à la première écriture. Defaults to None.
+        """
+
+        #
+        self.file_path: str = file_path
+        self.flush_threshold: int = max(1, flush_threshold)
+        self.decode_value: Optional[Callable[[Any], Any]] = decode_value
+        self.meta: Optional[dict] = meta
+
+        # Position (en octets) de la dernière ligne de chaque clé dans le fichier
+        self.offsets: dict[str, int] = {}
+
+        # Nombre de lignes du fichier qui ne servent plus (remplacées par une ligne suivante, ou incomplètes)
+        self.nb_dead_lines: int = 0
+
+        # Valeurs les plus récemment utilisées
+        self.lru_capacity: int = lru_capacity
+        self.lru: OrderedDict[str, Any] = OrderedDict()
+
+        # Nouvelles entrées pas encore écrites dans le fichier
+        self.pending: dict[str, Any] = {}
+
+        # Si la dernière ligne du fichier n'est pas terminée, il faut revenir à la ligne avant d'ajouter des entrées
+        self.needs_newline: bool = False
+
+        # Plusieurs recherches et imports peuvent utiliser le dictionnaire en même temps
+        self.mutex: Lock = Lock()
+
+        #
+        self.load()
+
+    #
+    def load(self) -> None:
+        """
+        Charge l'index des entrées sauvegardées (seulement les positions des lignes, les valeurs sont lues à la demande).
+        """
+
+        #
+        if not os.path.exists(self.file_path):
+            return
+
+        #
+        with open(self.file_path, "rb") as f:
+            #
+            offset: int = 0
+            for line in f:
+                #
+                self.needs_newline = not line.endswith(b"\n")
+                # Une ligne incomplète (écriture interrompue) est ignorée
+                try:
+                    key, _ = json.loads(line)
+                    if key in self.offsets:
+                        self.nb_dead_lines += 1
+                    self.offsets[key] = offset
+                except ValueError:
+                    self.nb_dead_lines += 1
+                #
+                offset += len(line)
+
+    #
+    def set_lru(self, key: str, value: Any) -> None:
+        """
+        Garde une valeur en mémoire, en oubliant la moins récemment utilisée si besoin. Le mutex doit être pris.
+
+        Args:
+            key (str): La clé
+            value (Any): Sa valeur
+        """
+
+        #
+        self.lru[key] = value
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.lru_capacity:
+            self.lru.popitem(last=False)
+
+    #
+    def has(self, key: str) -> bool:
+        """
+        Indique si cette clé est connue.
+
+        Args:
+            key (str): La clé
+
+        Returns:
+            bool: Si la clé est connue
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            return key in self.lru or key in self.pending or key in self.offsets
+        finally:
+            self.mutex.release()
+
+    #
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Renvoie la valeur d'une clé, si elle est connue.
+
+        Args:
+            key (str): La clé
+
+        Returns:
+            Optional[Any]: La valeur, ou None si la clé n'est pas connue
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            #
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                return self.lru[key]
+            #
+            if key in self.pending:
+                return self.pending[key]
+            #
+            if not key in self.offsets:
+                return None
+
+            # On relit la ligne de cette clé dans le fichier
+            with open(self.file_path, "rb") as f:
+                f.seek(self.offsets[key])
+                value: Any = json.loads(f.readline())[1]
+            #
+            if self.decode_value is not None:
+                value = self.decode_value(value)
+            #
+            self.set_lru(key, value)
+            return value
+        finally:
+            self.mutex.release()
+
+    #
+    def add(self, items: list[tuple[str, Any]], overwrite: bool = False) -> None:
+        """
+        Ajoute des entrées, elles sont écrites dans le fichier dès qu'il y en a `flush_threshold` en attente (ou à la prochaine sauvegarde).
+
+        Args:
+            items (list[tuple[str, Any]]): Les entrées (clé, valeur)
+            overwrite (bool, optional): Si les clés déjà connues sont remplacées, sinon elles sont ignorées. Defaults to False.
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            for key, value in items:
+                #
+                if not overwrite and (key in self.pending or key in self.offsets):
+                    continue
+                #
+                self.pending[key] = value
+                self.set_lru(key, value)
+            #
+            if len(self.pending) >= self.flush_threshold:
+                self.flush()
+        finally:
+            self.mutex.release()
+
+    #
+    def flush(self) -> None:
+        """
+        Écrit les nouvelles entrées à la fin du fichier. Le mutex doit être pris.
+        """
+
+        #
+        if len(self.pending) == 0:
+            return
+
+        #
+        dir_path: str = os.path.dirname(self.file_path)
+        if dir_path != "" and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        #
+        if self.meta is not None and not os.path.exists(os.path.join(dir_path, META_FILE)):
+            with open(os.path.join(dir_path, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(self.meta, f)
+
+        #
+        with open(self.file_path, "ab") as f:
+            #
+            if self.needs_newline:
+                f.write(b"\n")
+                self.needs_newline = False
+            #
+            offset: int = f.tell()
+            for key, value in self.pending.items():
+                #
+                line: bytes = (json.dumps([key, value], ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                #
+                if key in self.offsets:
+                    self.nb_dead_lines += 1
+                self.offsets[key] = offset
+                offset += len(line)
+            #
+            f.flush()
+            os.fsync(f.fileno())
+
+        #
+        self.pending = {}
+
+    #
+    def compact(self) -> None:
+        """
+        Réécrit le fichier avec une seule ligne par clé, dans un fichier temporaire qui remplace l'ancien une fois complet. Le mutex doit être pris.
+        """
+
+        #
+        new_offsets: dict[str, int] = {}
+        #
+        with open(self.file_path, "rb") as f_old, open(f"{self.file_path}.tmp", "wb") as f_new:
+            #
+            offset: int = 0
+            for key, old_offset in self.offsets.items():
+                #
+                f_old.seek(old_offset)
+                line: bytes = f_old.readline()
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                #
+                f_new.write(line)
+                new_offsets[key] = offset
+                offset += len(line)
+            #
+            f_new.flush()
+            os.fsync(f_new.fileno())
+
+        #
+        os.replace(f"{self.file_path}.tmp", self.file_path)
+        #
+        self.offsets = new_offsets
+        self.nb_dead_lines = 0
+        self.needs_newline = False
+
+    #
+    def save(self) -> None:
+        """
+        Écrit les nouvelles entrées sur le disque, et compacte le fichier s'il a trop de lignes inutiles.
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            #
+            self.flush()
+            #
+            if self.nb_dead_lines >= COMPACTION_MIN_DEAD_LINES and self.nb_dead_lines > len(self.offsets):
+                self.compact()
+        finally:
+            self.mutex.release()
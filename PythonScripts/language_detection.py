@@ -0,0 +1,200 @@
+"""
+Détection de la langue des textes, commune à la traduction, à la NER et à la reconnaissance de dates.
+Chaque texte n'est analysé qu'une seule fois (les résultats sont gardés en mémoire, indexés par le hash du texte),
+les messages courts sont d'abord testés avec une heuristique rapide (alphabet, mots outils), et langdetect n'est utilisé que si elle ne suffit pas,
+avec une graine fixe pour que le résultat d'un texte soit toujours le même.
+
+Auteur: Nathan Cerisara
+"""
+
+from typing import Optional
+
+import re
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+from langdetect import DetectorFactory
+from langdetect import detect as language_detection
+
+
+# langdetect est probabiliste, on fixe sa graine pour que les résultats (et donc le cache) soient stables
+DetectorFactory.seed = 0
+
+# Nombre de résultats gardés en mémoire
+DEFAULT_CACHE_CAPACITY: int = 1 << 18
+
+# Alphabets qui suffisent à identifier une langue (les kanas avant les idéogrammes, qui sont aussi utilisés en japonais)
+SCRIPTS_LANGUAGES: list[tuple[re.Pattern, str]] = [
+    (re.compile("[぀-ヿ]"), "ja"),
+    (re.compile("[가-힯]"), "ko"),
+    (re.compile("[一-鿿]"), "zh"),
+]
+
+# Les mots outils ne sont utilisés que pour les messages courts, langdetect est fiable sur les textes plus longs
+SHORT_TEXT_MAX_LENGTH: int = 25
+
+# Mots outils fréquents de chaque langue (assez distinctifs pour des messages courts)
+STOPWORDS: dict[str, set[str]] = {
+    "fr": {"le", "la", "les", "des", "du", "un", "une", "et", "est", "je", "tu", "il", "nous", "vous", "ils", "pour", "avec", "dans", "sur", "pas", "que", "qui", "ce", "cette", "mais", "ou", "au", "aux", "mon", "ton", "son", "oui", "non", "bonjour", "merci", "salut"},
+    "en": {"the", "and", "is", "are", "was", "i", "you", "he", "she", "we", "they", "for", "with", "in", "on", "not", "that", "this", "but", "or", "to", "of", "my", "your", "yes", "no", "hello", "thanks", "hi"},
+    "es": {"el", "los", "las", "y", "es", "yo", "tú", "él", "nosotros", "para", "con", "en", "por", "pero", "no", "que", "una", "sí", "hola", "gracias"},
+}
+
+# Lettres accentuées de chaque langue : une autre lettre non ASCII indique une autre langue
+ACCENTED_LETTERS: dict[str, set[str]] = {
+    "fr": set("àâæçéèêëîïôœùûüÿ"),
+    "en": set(),
+    "es": set("áéíñóúü"),
+}
+
+# Découpage en mots pour l'heuristique des mots outils
+WORDS_REGEX: re.Pattern = re.compile(r"[^\W\d_]+")
+
+
+#
+def heuristic_language(txt: str) -> Optional[str]:
+    """
+    Devine la langue d'un texte avec son alphabet, ou avec ses mots outils si c'est un message court sans ambiguïté.
+
+    Args:
+        txt (str): Le texte
+
+    Returns:
+        Optional[str]: Code de la langue, ou None si l'heuristique ne permet pas de décider
+    """
+
+    #
+    for script_regex, lang in SCRIPTS_LANGUAGES:
+        if script_regex.search(txt):
+            return lang
+
+    # Les textes plus longs sont laissés à langdetect
+    if len(txt) > SHORT_TEXT_MAX_LENGTH:
+        return None
+
+    # On compte les mots outils de chaque langue
+    words: list[str] = WORDS_REGEX.findall(txt.lower())
+    scores: dict[str, int] = {lang: sum(1 for w in words if w in stopwords) for lang, stopwords in STOPWORDS.items()}
+    #
+    best: list[tuple[int, str]] = sorted(((score, lang) for lang, score in scores.items()), reverse=True)
+    best_lang: str = best[0][1]
+    # Il faut au moins 2 mots outils, aucun mot outil d'une autre langue, et aucune lettre accentuée étrangère à la langue
+    if best[0][0] >= 2 and best[1][0] == 0 and all(c.isascii() or c in ACCENTED_LETTERS[best_lang] for c in "".join(words)):
+        return best_lang
+
+    #
+    return None
+
+
+#
+class LanguageDetector:
+    """
+    Détecteur de langue avec cache, partagé par tout le processus.
+    """
+
+    def __init__(self, cache_capacity: int = DEFAULT_CACHE_CAPACITY) -> None:
+        """
+        Crée le détecteur, avec un cache vide.
+
+        Args:
+            cache_capacity (int, optional): Nombre de résultats gardés en mémoire. Defaults to DEFAULT_CACHE_CAPACITY.
+        """
+
+        # Hash du texte -> langue détectée, du moins récemment utilisé au plus récemment utilisé
+        self.cache_capacity: int = cache_capacity
+        self.cache: OrderedDict[bytes, str] = OrderedDict()
+
+        # langdetect n'est pas thread-safe, et le cache est partagé
+        self.mutex: Lock = Lock()
+
+    #
+    def detect(self, txt: str) -> str:
+        """
+        Détecte la langue d'un texte.
+
+        Args:
+            txt (str): Le texte
+
+        Returns:
+            str: Code de la langue (ex: "fr"), ou "" si elle n'a pas pu être détectée
+        """
+
+        #
+        return self.detect_many([txt])[0]
+
+    #
+    def detect_many(self, txts: list[str]) -> list[str]:
+        """
+        Détecte la langue de plusieurs textes, chaque texte différent n'est analysé qu'une seule fois.
+
+        Args:
+            txts (list[str]): Les textes
+
+        Returns:
+            list[str]: Code de la langue de chaque texte (ou "" si elle n'a pas pu être détectée), dans l'ordre
+        """
+
+        #
+        keys: list[bytes] = [hashlib.blake2b(txt.encode("utf-8"), digest_size=16).digest() for txt in txts]
+        results: list[str] = []
+
+        #
+        self.mutex.acquire()
+        try:
+            for txt, key in zip(txts, keys):
+                #
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    results.append(self.cache[key])
+                    continue
+
+                #
+                lang: Optional[str] = heuristic_language(txt)
+                if lang is None:
+                    try:
+                        lang = language_detection(txt)
+                    except:
+                        lang = ""
+
+                #
+                self.cache[key] = lang
+                if len(self.cache) > self.cache_capacity:
+                    self.cache.popitem(last=False)
+                #
+                results.append(lang)
+        finally:
+            self.mutex.release()
+
+        #
+        return results
+
+
+# Le détecteur commun à tout le processus
+LANGUAGE_DETECTOR: Optional[LanguageDetector] = None
+
+# Pour ne créer le détecteur qu'une seule fois même si plusieurs threads le demandent en même temps
+LANGUAGE_DETECTOR_MUTEX: Lock = Lock()
+
+
+#
+def get_language_detector() -> LanguageDetector:
+    """
+    Renvoie le détecteur de langue du processus (il est créé au premier appel).
+
+    Returns:
+        LanguageDetector: Le détecteur de langue
+    """
+
+    #
+    global LANGUAGE_DETECTOR
+    #
+    if LANGUAGE_DETECTOR is None:
+        LANGUAGE_DETECTOR_MUTEX.acquire()
+        try:
+            if LANGUAGE_DETECTOR is None:
+                LANGUAGE_DETECTOR = LanguageDetector()
+        finally:
+            LANGUAGE_DETECTOR_MUTEX.release()
+    #
+    return LANGUAGE_DETECTOR
@@ -7,15 +7,15 @@ Auteur: Nathan Cerisara
 
 from typing import Optional
 
-import os
-import json
 import re
 
-from langdetect import detect as language_detection
 from translate import Translator
 from easynmt import EasyNMT
 
 from config import Config
+from language_detection import get_language_detector
+from models_registry import RegistryEntry, get_models_registry
+from translation_cache import TranslationCache
 
 from profiling import profiling_task_start, profiling_last_task_ends
 
@@ -26,6 +26,9 @@ ALL_TRANSLATION_METHODS: set[str] = {
     "easyNMT"
 }
 
+# Nombre de textes traduits en même temps par le modèle de traduction
+TRANSLATION_BATCH_SIZE: int = 16
+
 
 
 #
@@ -40,13 +43,8 @@ def detect_language(txt: str) -> str:
         str: Code indiquant le langage détecté (ex: en, fr, es, ...)
     """
 
-    lang: str
-    try:
-        lang = language_detection(txt)
-    except:
-        lang = ""
-
-    return lang
+    # Détection partagée (et mise en cache) avec la NER et la reconnaissance de dates
+    return get_language_detector().detect(txt)
 
 #
 def remove_emojis(data: str) -> str:
@@ -104,32 +102,24 @@ class LanguageTranslation:
         if translation_method == "Translator":
             self.translator = Translator(to_lang=language)
         # Modèles de traduction depuis HuggingFace, si on utilise cette méthode
-        self.easy_nmt_model = EasyNMT('opus-mt')
-        # Cache de traduction
-        self.translation_cache: dict[str, dict[str, str]] = {}
-
-        # à chaque fois que l'on rajoute un message dans le cache, on a tant de chance de sauvegarder le cache sur le disque
-        self.translation_cache_save_chance: float = 0.2
-
-        print(f"DEBUG | conf = {conf}")
-
-        #
-        self.path_translation_cache: str = f"{self.conf.cache_translations_json}_{self.language}.json"
-
-        # On va charger le cache
-        if os.path.exists(self.path_translation_cache):
-            with open(self.path_translation_cache, "r", encoding="utf-8") as f:
-                self.translation_cache = json.load(f)
+        #   (partagés par toutes les langues cibles grâce au registre de modèles, un seul thread à la fois)
+        self.easy_nmt_entry: RegistryEntry = get_models_registry().acquire_for(self, ("easynmt", "opus-mt"), lambda: EasyNMT('opus-mt'))
+        self.easy_nmt_model = self.easy_nmt_entry.obj
+        # Cache de traduction (fichier en ajout seul, l'ancien cache json est importé s'il existe)
+        self.translation_cache: TranslationCache = TranslationCache(
+            f"{self.conf.cache_translations_json}_{self.language}.jsonl",
+            legacy_json_path=f"{self.conf.cache_translations_json}_{self.language}.json",
+            language=self.language
+        )
 
     #
     def save(self) -> None:
         """
-        Enregistre dans un fichier json le cache des traductions.
+        Écrit sur le disque les nouvelles traductions du cache.
         """
 
-        # On enregistre le cache
-        with open(self.path_translation_cache, "w", encoding="utf-8") as f:
-            json.dump(self.translation_cache, f)
+        # Seules les nouvelles traductions sont écrites
+        self.translation_cache.save()
         #
         print("Translation Cache saved")
 
@@ -165,58 +155,75 @@ class LanguageTranslation:
         """
 
         #
-        res: str
+        return self.translate_many([txt])[0]
 
-        # On teste si on a pas déjà traduit ce message
-        if self.language in self.translation_cache and txt in self.translation_cache[self.language]:
-            res = self.translation_cache[self.language][txt]
+    #
+    def translate_many(self, txts: list[str]) -> list[str]:
+        """
+        Traduit plusieurs textes à la fois : les traductions déjà en cache sont réutilisées,
+        les langues des autres textes sont détectées, puis les textes sont traduits par groupes de même langue source (un seul appel au modèle par langue),
+        et toutes les nouvelles traductions sont ajoutées au cache en une fois.
 
-            # Affichage de débug
-            # print(f"\nCached translation to {self.language}\n:  - \"{txt}\"\n  -> \"{res}\"\n")
+        Args:
+            txts (list[str]): Textes à traduire
 
-            #
-            return res
+        Returns:
+            list[str]: Textes traduits, dans l'ordre
+        """
 
-        # On détecte la langue
-        lang_detected: str = detect_language(txt)
+        #
+        results: list[Optional[str]] = [None] * len(txts)
+
+        # On teste si on a pas déjà traduit ces messages
+        for id_txt, txt in enumerate(txts):
+            results[id_txt] = self.translation_cache.get(txt)
 
-        # On vérifie s'il y a vraiment besoin de traduire
-        if lang_detected == self.language:
-            res = txt
+        # Textes à traduire (chacun une seule fois), regroupés par langue détectée
+        txts_by_lang: dict[str, list[str]] = {}
+        missing_txts: list[str] = list(dict.fromkeys(txt for id_txt, txt in enumerate(txts) if results[id_txt] is None))
+        for txt, lang_detected in zip(missing_txts, get_language_detector().detect_many(missing_txts)):
             #
-            return res
+            if not lang_detected in txts_by_lang:
+                txts_by_lang[lang_detected] = []
+            txts_by_lang[lang_detected].append(txt)
 
         #
-        if self.method_used == "Translator":
-            # nettoyage du texte
-            txt = remove_emojis(txt)
-            #
-            res = self.translate_translator(txt)
+        new_translations: dict[str, str] = {}
         #
-        elif self.method_used == "easyNMT":
-            # nettoyage du texte
-            txt = remove_emojis(txt)
+        for lang_detected, lang_txts in txts_by_lang.items():
+
+            # On vérifie s'il y a vraiment besoin de traduire
+            if lang_detected == self.language:
+                new_translations.update((txt, txt) for txt in lang_txts)
+                continue
+
+            # nettoyage des textes
+            cleaned_txts: list[str] = [remove_emojis(txt) for txt in lang_txts]
+            translated_txts: list[str]
+
             #
-            if lang_detected in ["fr", "es", "zh"]:
-                res = self.easy_nmt_model.translate(txt, source_lang=lang_detected, target_lang="en")
-            else:
-                res = txt
-        # Pas de méthode, on renvoie directement le texte alors
-        else:
-            res = txt
+            if self.method_used == "Translator":
+                translated_txts = [self.translate_translator(txt) for txt in cleaned_txts]
             #
-            return res
+            elif self.method_used == "easyNMT" and lang_detected in ["fr", "es", "zh"]:
+                self.easy_nmt_entry.mutex.acquire()
+                try:
+                    translated_txts = self.easy_nmt_model.translate(cleaned_txts, source_lang=lang_detected, target_lang="en", batch_size=TRANSLATION_BATCH_SIZE)
+                finally:
+                    self.easy_nmt_entry.mutex.release()
+            #
+            else:
+                translated_txts = cleaned_txts
 
-        # On ajoute le langage cible de la traduction dans le cache s'il n'y est pas déjà
-        if not self.language in self.translation_cache:
-            self.translation_cache[self.language] = {}
+            #
+            new_translations.update(zip(lang_txts, translated_txts))
 
-        # On ajoute la traduction dans le cache
-        self.translation_cache[self.language][txt] = res
+            # Affichage de débug
+            print(f"\nTranslated {len(lang_txts)} texts from {lang_detected} to {self.language}\n")
 
-        # Affichage de débug
-        print(f"\nTranslated from {lang_detected} to {self.language}\n:  - \"{txt}\"\n  -> \"{res}\"\n")
+        # On ajoute toutes les nouvelles traductions dans le cache en une fois
+        if len(new_translations) > 0:
+            self.translation_cache.add(new_translations)
 
         #
-        return res
-
+        return [res if res is not None else new_translations[txt] for txt, res in zip(txts, results)]
@@ -0,0 +1,244 @@
+"""
+Moteur de calcul de distances de Levenshtein pour les algorithmes de recherche syntaxiques, partagé entre toutes les recherches :
+    - les distances entre deux mots sont gardées dans un cache LRU,
+    - les couples de mots dont une borne inférieure de la distance (différence de longueurs, n-grammes en commun) est déjà trop grande ne sont pas calculés
+      (les n-grammes ne sont comparés qu'entre les mots de la recherche et ceux du message, le travail par message ne dépend que de leurs nombres de mots),
+    - les distances sont calculées avec un seuil, au-delà duquel le calcul s'arrête.
+
+Auteur: Nathan Cerisara
+"""
+
+from typing import Optional
+
+import math
+from collections import OrderedDict
+from threading import Lock
+
+from Levenshtein import distance as levenshtein_distance
+
+
+# Nombre de distances gardées dans le cache LRU
+DEFAULT_LRU_CAPACITY: int = 1 << 18
+
+# Taille des n-grammes de caractères des bornes inférieures
+NGRAM_SIZE: int = 2
+
+
+#
+def get_ngrams(word: str) -> dict[str, int]:
+    """
+    Renvoie les n-grammes de caractères d'un mot (avec des caractères de début et de fin), avec leur nombre d'occurrences.
+
+    Args:
+        word (str): Le mot
+
+    Returns:
+        dict[str, int]: Nombre d'occurrences de chaque n-gramme
+    """
+
+    #
+    padded: str = "\x02" * (NGRAM_SIZE - 1) + word + "\x03" * (NGRAM_SIZE - 1)
+    #
+    ngrams: dict[str, int] = {}
+    for i in range(len(padded) - NGRAM_SIZE + 1):
+        ngrams[padded[i:i+NGRAM_SIZE]] = ngrams.get(padded[i:i+NGRAM_SIZE], 0) + 1
+    #
+    return ngrams
+
+
+#
+def count_common_ngrams(ngrams_1: dict[str, int], ngrams_2: dict[str, int]) -> int:
+    """
+    Compte les n-grammes en commun entre deux mots, avec leurs multiplicités.
+
+    Args:
+        ngrams_1 (dict[str, int]): N-grammes du premier mot
+        ngrams_2 (dict[str, int]): N-grammes du second mot
+
+    Returns:
+        int: Nombre de n-grammes en commun
+    """
+
+    #
+    if len(ngrams_1) > len(ngrams_2):
+        ngrams_1, ngrams_2 = ngrams_2, ngrams_1
+    #
+    return sum(min(count, ngrams_2.get(ngram, 0)) for ngram, count in ngrams_1.items())
+
+
+#
+def split_words(txt: str) -> list[str]:
+    """
+    Découpe un texte en mots non vides (séparés par des espaces).
+
+    Args:
+        txt (str): Le texte
+
+    Returns:
+        list[str]: Les mots
+    """
+
+    #
+    return [w for w in txt.strip().split(" ") if w != ""]
+
+
+#
+class LevenshteinEngine:
+    """
+    Moteur de distances de Levenshtein avec cache LRU, qui élague les couples de mots avec les n-grammes en commun.
+    """
+
+    def __init__(self, lru_capacity: int = DEFAULT_LRU_CAPACITY) -> None:
+        """
+        Crée le moteur.
+
+        Args:
+            lru_capacity (int, optional): Nombre de distances gardées dans le cache. Defaults to DEFAULT_LRU_CAPACITY.
+        """
+
+        # Cache LRU (texte 1, texte 2) -> distance
+        self.lru_capacity: int = lru_capacity
+        self.lru: OrderedDict[tuple[str, str], int] = OrderedDict()
+
+        # Statistiques, pour savoir si l'élagage est efficace
+        self.nb_pairs_pruned: int = 0
+        self.nb_distances_calculated: int = 0
+        self.nb_lru_hits: int = 0
+
+        # Le moteur est partagé entre les threads des recherches
+        self.mutex: Lock = Lock()
+
+    #
+    def distance(self, txt1: str, txt2: str, max_distance: Optional[int] = None) -> int:
+        """
+        Distance de Levenshtein entre deux textes, avec le cache LRU.
+        Si `max_distance` est précisé, le calcul s'arrête dès que la distance le dépasse, et renvoie alors `max_distance + 1`.
+
+        Args:
+            txt1 (str): Premier texte
+            txt2 (str): Second texte
+            max_distance (Optional[int], optional): Seuil au-delà duquel on n'a pas besoin de la distance exacte. Defaults to None.
+
+        Returns:
+            int: La distance (ou `max_distance + 1` si elle dépasse le seuil)
+        """
+
+        #
+        key: tuple[str, str] = (txt1, txt2)
+        #
+        self.mutex.acquire()
+        try:
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                self.nb_lru_hits += 1
+                d: int = self.lru[key]
+                return d if max_distance is None or d <= max_distance else max_distance + 1
+        finally:
+            self.mutex.release()
+
+        #
+        self.nb_distances_calculated += 1
+        d = levenshtein_distance(txt1, txt2, score_cutoff=max_distance)
+
+        # Seule une distance exacte peut être mise dans le cache
+        if max_distance is not None and d > max_distance:
+            return max_distance + 1
+
+        #
+        self.mutex.acquire()
+        try:
+            self.lru[key] = d
+            if len(self.lru) > self.lru_capacity:
+                self.lru.popitem(last=False)
+        finally:
+            self.mutex.release()
+        #
+        return d
+
+    #
+    def words_distances(self, txt1: str, txt2: str, close_words_factor: float) -> float:
+        """
+        Même résultat que `words_levenshtein_distances`, mais en élaguant les couples de mots :
+        pour chaque mot de la recherche, on parcourt les mots du message par borne inférieure croissante de leur distance,
+        et on ne calcule une distance que si elle peut améliorer le minimum actuel, ou si les deux mots peuvent être "proches".
+
+        Args:
+            txt1 (str): premier texte à comparer (la recherche)
+            txt2 (str): second texte à comparer (le message)
+            close_words_factor (float): taux qui permet de calculer si deux mots sont proches ou non selon la distance de Levenshtein
+
+        Returns:
+            float: distance retournée
+        """
+
+        #
+        words_1: list[str] = split_words(txt1)
+        words_2: list[str] = split_words(txt2)
+
+        # N-grammes de chaque mot (calculés une seule fois par appel, seulement pour les mots des deux textes)
+        ngrams_1: list[dict[str, int]] = [get_ngrams(w1) for w1 in words_1]
+        ngrams_2: list[dict[str, int]] = [get_ngrams(w2) for w2 in words_2]
+        nb_ngrams_2: list[int] = [sum(ngrams.values()) for ngrams in ngrams_2]
+
+        # Index des mots du message "plus utilisables"
+        words_used: set[int] = set()
+
+        #
+        total: float = 0.0
+        #
+        id_word1: int
+        w1: str
+        for id_word1, w1 in enumerate(words_1):
+
+            #
+            nb_ngrams_1: int = sum(ngrams_1[id_word1].values())
+
+            # Borne inférieure de la distance avec chaque mot encore utilisable du message :
+            #   une opération d'édition change au plus NGRAM_SIZE n-grammes, et change la longueur d'au plus 1
+            lower_bounds: list[tuple[int, int]] = []
+            for id_word2 in range(len(words_2)):
+                if id_word2 in words_used:
+                    continue
+                #
+                w2: str = words_2[id_word2]
+                common: int = count_common_ngrams(ngrams_1[id_word1], ngrams_2[id_word2])
+                ngram_bound: int = math.ceil((max(nb_ngrams_1, nb_ngrams_2[id_word2]) - common) / NGRAM_SIZE)
+                lower_bounds.append( (max(abs(len(w1) - len(w2)), ngram_bound), id_word2) )
+            #
+            lower_bounds.sort()
+
+            #
+            best: Optional[int] = None
+            newly_used: list[int] = []
+            for lower_bound, id_word2 in lower_bounds:
+                #
+                w2 = words_2[id_word2]
+                close_bound: int = math.floor(close_words_factor * float(len(w1) + len(w2)))
+
+                # Ce couple ne peut ni améliorer le minimum, ni être "proche"
+                can_improve: bool = best is None or lower_bound < best
+                if not can_improve and lower_bound > close_bound:
+                    self.nb_pairs_pruned += 1
+                    continue
+
+                # Seuil : on a seulement besoin de savoir si la distance est plus petite que le minimum actuel, ou si les mots sont proches
+                max_distance: Optional[int] = None if best is None else max(best - 1, close_bound)
+                ld: int = self.distance(w1, w2, max_distance)
+
+                #
+                if best is None or ld < best:
+                    best = ld
+
+                # On teste si ces deux mots sont considérés comme "proches" ou non
+                if float(ld) / float(len(w1) + len(w2)) <= close_words_factor:
+                    newly_used.append(id_word2)
+
+            #
+            words_used.update(newly_used)
+
+            # Pour l'instant, on ne va prendre que la somme des minimums
+            if best is not None:
+                total += best
+
+        #
+        return total
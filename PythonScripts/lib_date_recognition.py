@@ -389,9 +389,11 @@ class SimpleDateExtractor:
         # Convert written numbers to digits in the text
         return self.word_to_number_converter.convert(text, lang)
 
-    def extract_dates(self, text: str) -> list[DateDetected]:
+    def extract_dates(self, text: str, language: Optional[str] = None) -> list[DateDetected]:
+        # Langue détectée sur le texte original, comme pour la traduction et la NER (le résultat est partagé)
+        if language is None:
+            language = detect_language(text)
         text = text.lower()
-        language = detect_language(text)
         print(f"Detected Language: {language}")
         if language not in SUPPORTED_LANGS:
             return []
@@ -5,7 +5,7 @@ Auteur: Nathan Cerisara
 """
 
 
-from typing import cast, Callable
+from typing import cast, Callable, Optional
 from dataclasses import dataclass
 
 from torch import Tensor
@@ -27,33 +27,41 @@ class MessageEmbedding:
     # n = nombre de tokens
     # d = dimension de l'embedding
 
+    # Les trois champs suivants ne sont gardés que si la fonction de distance a besoin des états de chaque token (voir DISTANCES_NEEDING_TOKENS_STATES),
+    #   sinon, ils valent None et seul `sentence_embedding` est gardé (embedding compact)
+
     # Le texte tokenisé - Dimension: (n, dtype=int)
-    tokens: Tensor
+    tokens: Optional[Tensor]
 
     # Le masque des tokens pour savoir sur quoi porter l'attention - Dimension: (n, dtype=float)
-    attention_mask: Tensor
+    attention_mask: Optional[Tensor]
 
     # La dernière couche dans le modèle d'embedding - Dimension: (n, d, dtype=float)
-    last_hidden_state: Tensor
+    last_hidden_state: Optional[Tensor]
+
+    # Moyenne des états des tokens, normalisée (norme L2 = 1) - Dimension: (d, dtype=float)
+    sentence_embedding: Optional[Tensor] = None
 
     #
     def export_to_dict(self) -> dict:
         return {
             "txt": self.txt,
-            "tokens": self.tokens.tolist(),
-            "attention_mask": self.attention_mask.tolist(),
-            "last_hidden_state": self.last_hidden_state.tolist()
+            "tokens": self.tokens.tolist() if self.tokens is not None else None,
+            "attention_mask": self.attention_mask.tolist() if self.attention_mask is not None else None,
+            "last_hidden_state": self.last_hidden_state.tolist() if self.last_hidden_state is not None else None,
+            "sentence_embedding": self.sentence_embedding.tolist() if self.sentence_embedding is not None else None
         }
 
 
 #
 def load_message_embedding_from_dict(me_dict: dict) -> MessageEmbedding:
     txt: str = me_dict["txt"]
-    tokens: Tensor = Tensor(me_dict["tokens"])
-    attention_mask: Tensor = Tensor(me_dict["attention_mask"])
-    last_hidden_state: Tensor = Tensor(me_dict["last_hidden_state"])
+    tokens: Optional[Tensor] = Tensor(me_dict["tokens"]) if me_dict.get("tokens") is not None else None
+    attention_mask: Optional[Tensor] = Tensor(me_dict["attention_mask"]) if me_dict.get("attention_mask") is not None else None
+    last_hidden_state: Optional[Tensor] = Tensor(me_dict["last_hidden_state"]) if me_dict.get("last_hidden_state") is not None else None
+    sentence_embedding: Optional[Tensor] = Tensor(me_dict["sentence_embedding"]) if me_dict.get("sentence_embedding") is not None else None
     #
-    return MessageEmbedding(txt, tokens, attention_mask, last_hidden_state)
+    return MessageEmbedding(txt, tokens, attention_mask, last_hidden_state, sentence_embedding)
 
 #
 #Mean Pooling - Take attention mask into account for correct averaging
@@ -69,6 +77,36 @@ def average_pool(last_hidden_states: Tensor, attention_mask: Tensor) -> Tensor:
     last_hidden = last_hidden_states.masked_fill(~attention_mask[..., None].bool(), 0.0)
     return last_hidden.sum(dim=0) / attention_mask.sum(dim=0)[..., None]
 
+#
+# Moyenne des vecteurs d'embeddings pour tout un batch, en prenant en compte le masque d'attention
+def batch_average_pool(last_hidden_states: Tensor, attention_mask: Tensor) -> Tensor:
+    #
+    mask: Tensor = attention_mask[..., None].to(last_hidden_states.dtype)
+    return (last_hidden_states * mask).sum(dim=1) / torch.clamp(mask.sum(dim=1), min=1e-9)
+
+#
+def get_sentence_embedding(me: MessageEmbedding) -> Tensor:
+    """
+    Renvoie l'embedding de phrase (moyenne des tokens normalisée) d'un message.
+    Pour un embedding non compact, il est calculé une seule fois puis gardé dans l'objet.
+
+    Args:
+        me (MessageEmbedding): Embedding du message
+
+    Returns:
+        Tensor: Vecteur normalisé de dimension (d)
+    """
+
+    #
+    if me.sentence_embedding is None:
+        #
+        if me.last_hidden_state is None or me.attention_mask is None:
+            raise UserWarning(f"Error: empty message embedding for `{me.txt}`")
+        #
+        me.sentence_embedding = F.normalize(average_pool(me.last_hidden_state, me.attention_mask), p=2, dim=0)
+    #
+    return me.sentence_embedding
+
 #
 def euclidian_norm(e1: torch.Tensor, e2: torch.Tensor) -> float:
     return cast(float, torch.norm(e1 - e2).item())
@@ -90,18 +128,9 @@ def dist_euclidian_norm(me1: MessageEmbedding, me2: MessageEmbedding, algo_confi
     # Profiling 1 - start
     # profiling_task_start(f"average_calc_|_{escapeCharacters(me1.txt)}_|_{escapeCharacters(me2.txt)}")
 
-    e1: torch.Tensor = average_pool(me1.last_hidden_state, me1.attention_mask)
-    e2: torch.Tensor = average_pool(me2.last_hidden_state, me2.attention_mask)
-
-    # Profiling 1 - end
-    # profiling_last_task_ends()
-
-    # Profiling 1 - start
-    # profiling_task_start(f"normalizing_|_{escapeCharacters(me1.txt)}_|_{escapeCharacters(me2.txt)}")
-
-    # Normalize ?
-    e1 = F.normalize(e1, p=2, dim=0)
-    e2 = F.normalize(e2, p=2, dim=0)
+    # Vecteurs moyens déjà normalisés
+    e1: torch.Tensor = get_sentence_embedding(me1)
+    e2: torch.Tensor = get_sentence_embedding(me2)
 
     # Profiling 1 - end
     # profiling_last_task_ends()
@@ -134,18 +163,9 @@ def dist_cosine(me1: MessageEmbedding, me2: MessageEmbedding, algo_config_dict:
     # Profiling 1 - start
     # profiling_task_start(f"average_calc_|_{escapeCharacters(me1.txt)}_|_{escapeCharacters(me2.txt)}")
 
-    e1: torch.Tensor = average_pool(me1.last_hidden_state, me1.attention_mask)
-    e2: torch.Tensor = average_pool(me2.last_hidden_state, me2.attention_mask)
-
-    # Profiling 1 - end
-    # profiling_last_task_ends()
-
-    # Profiling 1 - start
-    # profiling_task_start(f"normalizing_|_{escapeCharacters(me1.txt)}_|_{escapeCharacters(me2.txt)}")
-
-    # Normalize ?
-    e1 = F.normalize(e1, p=2, dim=0)
-    e2 = F.normalize(e2, p=2, dim=0)
+    # Vecteurs moyens déjà normalisés
+    e1: torch.Tensor = get_sentence_embedding(me1)
+    e2: torch.Tensor = get_sentence_embedding(me2)
 
     # Profiling 1 - end
     # profiling_last_task_ends()
@@ -153,7 +173,8 @@ def dist_cosine(me1: MessageEmbedding, me2: MessageEmbedding, algo_config_dict:
     # Profiling 1 - start
     # profiling_task_start(f"cos_calc_|_{escapeCharacters(me1.txt)}_|_{escapeCharacters(me2.txt)}")
 
-    cosine: torch.Tensor = torch.dot(e1, e2) / (torch.norm(e1) * torch.norm(e2))
+    # Les vecteurs sont normalisés, le cosinus est donc directement le produit scalaire
+    cosine: torch.Tensor = torch.dot(e1, e2)
 
     # On renvoie donc le taux de colinéarité entre ces deux vecteurs
     res: float = -cast(float, cosine.item())
@@ -166,6 +187,10 @@ def dist_cosine(me1: MessageEmbedding, me2: MessageEmbedding, algo_config_dict:
 #
 def dist_poor_attention(me1: MessageEmbedding, me2: MessageEmbedding, algo_config_dict: dict) -> float:
 
+    # Cette distance a besoin des états de chaque token
+    if me1.last_hidden_state is None or me1.attention_mask is None or me2.last_hidden_state is None or me2.attention_mask is None:
+        raise UserWarning("Error: the `poor_attention` distance needs non compact message embeddings")
+
     # Profiling 1 - start
     # profiling_task_start(f"distance_poor_attention_|_{escapeCharacters(me1.txt)}_|_{escapeCharacters(me2.txt)}")
 
@@ -224,3 +249,103 @@ DISTANCES_FUNCTIONS: dict[str, Callable[[MessageEmbedding, MessageEmbedding, dic
     "poor_attention": dist_poor_attention
 }
 
+# Fonctions de distance qui ont besoin des états de chaque token, et donc d'embeddings non compacts
+DISTANCES_NEEDING_TOKENS_STATES: list[str] = ["poor_attention"]
+
+
+#
+def stack_sentence_embeddings(lst_me: list[MessageEmbedding]) -> Tensor:
+    """
+    Empile les embeddings de phrase (déjà normalisés) d'une liste de messages dans une seule matrice.
+
+    Args:
+        lst_me (list[MessageEmbedding]): Liste des embeddings des messages
+
+    Returns:
+        Tensor: Matrice de dimension (n, d)
+    """
+
+    #
+    if len(lst_me) == 0:
+        return torch.zeros((0, 0), dtype=torch.float32)
+    #
+    return torch.stack([get_sentence_embedding(me).float() for me in lst_me])
+
+#
+def matrix_dist_euclidian_norm(m1: Tensor, m2: Tensor, algo_config_dict: dict) -> Tensor:
+    """
+    Version matricielle de `dist_euclidian_norm`, calcule toutes les distances euclidiennes entre les lignes de deux matrices d'embeddings normalisés.
+
+    Args:
+        m1 (Tensor): Matrice de dimension (n1, d)
+        m2 (Tensor): Matrice de dimension (n2, d)
+
+    Returns:
+        Tensor: Matrice des distances de dimension (n1, n2)
+    """
+
+    #
+    return torch.cdist(m1, m2, p=2)
+
+#
+def matrix_dist_cosine(m1: Tensor, m2: Tensor, algo_config_dict: dict) -> Tensor:
+    """
+    Version matricielle de `dist_cosine`, un seul produit matriciel suffit car les embeddings sont normalisés.
+
+    Args:
+        m1 (Tensor): Matrice de dimension (n1, d)
+        m2 (Tensor): Matrice de dimension (n2, d)
+
+    Returns:
+        Tensor: Matrice des distances de dimension (n1, n2)
+    """
+
+    #
+    return -(m1 @ m2.T)
+
+
+# Versions matricielles des fonctions de distance qui n'ont besoin que des embeddings de phrase
+MATRIX_DISTANCES_FUNCTIONS: dict[str, Callable[[Tensor, Tensor, dict], Tensor]] = {
+    "euclidian": matrix_dist_euclidian_norm,
+    "cosine": matrix_dist_cosine
+}
+
+
+#
+def calculate_distances_matrix(distance_function: str, lst_me1: list[MessageEmbedding], lst_me2: list[MessageEmbedding], algo_config_dict: dict) -> Tensor:
+    """
+    Calcule toutes les distances entre deux listes d'embeddings de messages.
+    Si la fonction de distance a une version matricielle, les embeddings sont empilés et tout est calculé en une seule opération,
+    sinon, on utilise la fonction de distance classique sur chaque couple.
+
+    Args:
+        distance_function (str): Nom de la fonction de distance (clé de DISTANCES_FUNCTIONS)
+        lst_me1 (list[MessageEmbedding]): Première liste d'embeddings (ex: la recherche seule pour du 1xN)
+        lst_me2 (list[MessageEmbedding]): Seconde liste d'embeddings
+        algo_config_dict (dict): Configuration de l'algorithme
+
+    Returns:
+        Tensor: Matrice des distances de dimension (len(lst_me1), len(lst_me2))
+    """
+
+    #
+    if len(lst_me1) == 0 or len(lst_me2) == 0:
+        return torch.zeros((len(lst_me1), len(lst_me2)), dtype=torch.float32)
+
+    # Version matricielle
+    if distance_function in MATRIX_DISTANCES_FUNCTIONS:
+        #
+        m1: Tensor = stack_sentence_embeddings(lst_me1)
+        # Pas besoin d'empiler deux fois pour la matrice de toutes les paires
+        m2: Tensor = m1 if lst_me2 is lst_me1 else stack_sentence_embeddings(lst_me2)
+        #
+        return MATRIX_DISTANCES_FUNCTIONS[distance_function](m1, m2, algo_config_dict).to(torch.float32)
+
+    # Sinon, couple par couple
+    res: Tensor = torch.zeros((len(lst_me1), len(lst_me2)), dtype=torch.float32)
+    #
+    for i in range(len(lst_me1)):
+        for j in range(len(lst_me2)):
+            res[i, j] = DISTANCES_FUNCTIONS[distance_function](lst_me1[i], lst_me2[j], algo_config_dict)
+    #
+    return res
@@ -70,14 +70,20 @@ TYPES: dict[str, dict[str, tuple[str, int, Optional[Any], Optional[Any], int]]]
         "type": ("string", 0, None, "ClusteringKmeansAlgorithm", 1),
         "coef": ("number", 1, None, 1.0, 1),
         "search_engine_config_dict": ("SearchEngine", 1, None, None, 1),
-        "treshold_conversation_distance": ("number", 1, None, 1.4, 1)
+        "treshold_conversation_distance": ("number", 1, None, 1.4, 1),
+        "max_iterations": ("number", 0, None, 100, 0),
+        "window_size": ("number", 0, None, 0, 0),
+        "window_seconds": ("number", 0, None, 0, 0)
     },
 
     "ClusteringSeq_ConversationAlgorithm": {
         "type": ("string", 0, None, "ClusteringSeqAlgorithm", 1),
         "coef": ("number", 1, None, 1.0, 1),
         "search_engine_config_dict": ("SearchEngine", 1, None, None, 1),
-        "treshold_conversation_distance": ("number", 1, None, 1.4, 1)
+        "treshold_conversation_distance": ("number", 1, None, 1.4, 1),
+        "conversation_distance_statistic": ("string", 0, None, "avg", 0),
+        "window_size": ("number", 0, None, 0, 0),
+        "window_seconds": ("number", 0, None, 0, 0)
     },
 
     "ConversationEngine": {
@@ -94,12 +100,18 @@ TYPES: dict[str, dict[str, tuple[str, int, Optional[Any], Optional[Any], int]]]
 
     "SpaCy_SM_NER_Algorithm": {
         "type": ("string", 0, None, "SpaCy_SM_NER", 1),
-        "coef": ("number", 1, None, 1.0, 1)
+        "coef": ("number", 1, None, 1.0, 1),
+        "batch_size": ("number", 0, None, 64, 0),
+        "n_process": ("number", 0, None, 1, 0),
+        "memory_budget_mb": ("number", 0, None, 0, 0)
     },
 
     "SpaCy_LG_NER_Algorithm": {
         "type": ("string", 0, None, "SpaCy_LG_NER", 1),
-        "coef": ("number", 1, None, 1.0, 1)
+        "coef": ("number", 1, None, 1.0, 1),
+        "batch_size": ("number", 0, None, 64, 0),
+        "n_process": ("number", 0, None, 1, 0),
+        "memory_budget_mb": ("number", 0, None, 0, 0)
     },
 
     "NER_Engine": {
@@ -115,6 +127,10 @@ TYPES: dict[str, dict[str, tuple[str, int, Optional[Any], Optional[Any], int]]]
         "batch_size": ("number", 0, None, 1, 1),
         "use_cuda": ("number", 0, [0, 1], 0, 0),
         "distance_function": ("string", 0, list(DISTANCES_FUNCTIONS.keys()), "euclidian", 0),
+        "compact_embeddings": ("number", 0, [0, 1], 1, 0),
+        "dynamic_padding": ("number", 0, [0, 1], 1, 0),
+        "micro_batch_max_wait_ms": ("number", 0, None, 5.0, 0),
+        "micro_batch_max_size": ("number", 0, None, 32, 0),
         "model_name": ("string", 0, None, "optimum/all-MiniLM-L6-v2", 1),
         "model_type": ("string", 0, None, "sentence-transformers", 1),
         "model_optimisations": ("string", 0, ["optimum", ""], "optimum", 0),
@@ -128,7 +144,8 @@ TYPES: dict[str, dict[str, tuple[str, int, Optional[Any], Optional[Any], int]]]
         "coef": ("number", 1, None, 1.0, 1),
         "translate_before": ("string", 0, ["", "en", "fr", "es", "zh", "ja", "de", "es"], "en", 0),
         "translate_method": ("string", 0, ["easyNMT", ""], "", 0),
-        "NER_text_replacement": ("number", 0, [0, 1], 0, 0)
+        "NER_text_replacement": ("number", 0, [0, 1], 0, 0),
+        "bm25": ("number", 0, [0, 1], 0, 0)
     },
 
     "SyntaxicFullSentenceLevenshtein_SearchAlgorithm": {
@@ -187,6 +204,8 @@ TYPES: dict[str, dict[str, tuple[str, int, Optional[Any], Optional[Any], int]]]
         "max_message_length": ("number", 0, None, 200, 1),
         "nb_search_results": ("number", 0, None, 30, 1),
         "distance_limit": ("number", 0, None, None, 0),
+        "ann_nb_candidates": ("number", 0, None, 0, 0),
+        "ann_nprobe": ("number", 0, None, 8, 0),
         "algorithms": ("list|SearchAlgorithm", 0, None, None, 1)
     }
 }
@@ -0,0 +1,119 @@
+"""
+Script de migration de l'ancien cache d'embeddings (un fichier pickle `.pk` par message) vers le store de vecteurs par modèle (voir embeddings_cache.py).
+
+Utilisation : python main_migrate_embeddings_cache.py [float16] [keep_tokens_states] [remove_old]
+    - float16 : les nouveaux stores seront enregistrés en float16 (deux fois moins de place sur le disque)
+    - keep_tokens_states : les états de chaque token sont gardés (pour la distance `poor_attention`), sinon seuls les embeddings compacts sont importés
+    - remove_old : les anciens fichiers `.pk` sont supprimés une fois importés
+
+Auteur: Nathan Cerisara
+"""
+
+import os
+import sys
+import pickle
+
+from config import Config
+from lib_embedding import MessageEmbedding, get_sentence_embedding
+from embeddings_cache import EmbeddingCache
+
+
+# Préfixe ajouté par l'EmbeddingCalculator devant les textes pour les modèles e5, il ne fait pas partie de la clé du cache
+E5_PREFIX: str = "query: "
+
+
+#
+def migrate_model_dir(model_name: str, conf: Config, dtype: str, keep_tokens_states: bool, remove_old: bool) -> tuple[int, int]:
+    """
+    Importe tous les fichiers `.pk` du dossier de cache d'un modèle dans le store de ce modèle.
+
+    Args:
+        model_name (str): Nom du modèle (= nom du sous-dossier du cache)
+        conf (Config): Configuration globale du projet
+        dtype (str): Type des vecteurs du store ("float32" ou "float16")
+        keep_tokens_states (bool): Si on garde les états de chaque token, ou seulement l'embedding compact
+        remove_old (bool): Si on supprime les anciens fichiers une fois importés
+
+    Returns:
+        tuple[int, int]: Le nombre d'embeddings importés, et le nombre de fichiers illisibles ignorés
+    """
+
+    # Même séparation des caches que dans SimpleEmbedding_SearchAlgorithm
+    cache: EmbeddingCache = EmbeddingCache(model_name, conf, dtype)
+    old_dir_path: str = cache.base_dir_path
+    if keep_tokens_states:
+        cache = EmbeddingCache(f"{model_name}/tokens_states", conf, dtype)
+    #
+    nb_imported: int = 0
+    nb_errors: int = 0
+
+    #
+    file_name: str
+    for file_name in os.listdir(old_dir_path):
+        #
+        if not file_name.endswith(".pk"):
+            continue
+        #
+        file_path: str = f"{old_dir_path}{file_name}"
+        #
+        try:
+            with open(file_path, "rb") as f:
+                msg_emb: MessageEmbedding = pickle.load(f)
+        except Exception as e:
+            print(f"Error while loading {file_path} : {e}")
+            nb_errors += 1
+            continue
+
+        # L'ancien nom de fichier n'est pas réversible, on retrouve la clé à partir du texte embeddé
+        txt_key: str = msg_emb.txt
+        if txt_key.startswith(E5_PREFIX):
+            txt_key = txt_key[len(E5_PREFIX):]
+
+        # Embedding compact : on fait la moyenne et la normalisation une seule fois ici
+        if not keep_tokens_states:
+            msg_emb = MessageEmbedding(msg_emb.txt, None, None, None, get_sentence_embedding(msg_emb))
+
+        #
+        cache.set(txt_key, msg_emb)
+        nb_imported += 1
+
+        #
+        if remove_old:
+            os.remove(file_path)
+
+    #
+    cache.save()
+
+    #
+    return (nb_imported, nb_errors)
+
+
+#
+if __name__ == "__main__":
+
+    # On charge le fichier de config
+    conf: Config = Config("config.json")
+
+    #
+    dtype: str = "float16" if "float16" in sys.argv else "float32"
+    keep_tokens_states: bool = "keep_tokens_states" in sys.argv
+    remove_old: bool = "remove_old" in sys.argv
+
+    #
+    if not os.path.exists(conf.cache_dir_embeddings):
+        print(f"Nothing to migrate, {conf.cache_dir_embeddings} doesn't exist.")
+        exit(0)
+
+    # Les noms de modèles peuvent contenir un `/` (ex: `optimum/all-MiniLM-L6-v2`), on cherche donc tous les dossiers contenant des `.pk`
+    root: str
+    files: list[str]
+    for root, _, files in os.walk(conf.cache_dir_embeddings):
+        #
+        if not any(f.endswith(".pk") for f in files):
+            continue
+        #
+        model_name: str = os.path.relpath(root, conf.cache_dir_embeddings).replace(os.sep, "/")
+        #
+        print(f"Migrating {model_name}...")
+        nb_imported, nb_errors = migrate_model_dir(model_name, conf, dtype, keep_tokens_states, remove_old)
+        print(f"Done : {nb_imported} embeddings imported, {nb_errors} errors.")
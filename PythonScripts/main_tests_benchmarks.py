@@ -22,6 +22,10 @@ from user import User
 from search_engine import SearchEngine, SearchSettings, SearchAlgorithm
 from conversations_engine import ConversationsEngine, ConversationsAlgorithm, ResultConversationCut
 from ner_engine import NER_Engine, NER_Algorithm
+from embedding_calculator import EmbeddingCalculator
+from search_algorithm import words_levenshtein_distances
+from levenshtein_engine import LevenshteinEngine
+from models_registry import get_models_registry
 from config import Config
 from lib import avg, ConfigError, FunctionResult, ResultError, escapeCharacters
 from lib import set_edit_distance, get_sequence_separations, get_tp_fp_fn_from_two_sets, get_f1_score_from_tp_fp_fn, hash_string_to_int
@@ -731,12 +735,14 @@ class TestBenchmarks:
         per_msg_scores: list[dict[str, float]] = []
         msg_ner_results: list[list[tuple[int, str, str]]] = []
 
+        # Tous les textes du benchmark sont traités d'un coup par le moteur de NER
+        algo_ners: list[list[tuple[int, str, str]]] = ner_engine.main_recognize_many([test["text"] for test in benchmark_dict["tests"]])
+
         #
-        for test in benchmark_dict["tests"]:
+        for test, algo_ner in zip(benchmark_dict["tests"], algo_ners):
             text: str = test["text"]
             correct_ner: list[tuple[int, str, str]] = [cast(tuple[int, str, str], tuple(t)) for t in test["entities"]]
             #
-            algo_ner: list[tuple[int, str, str]] = ner_engine.main_recognize(text)
             msg_ner_results.append(algo_ner)
             #
             msg_score: dict[str, float] = self.evaluate_ner(text, correct_ner, algo_ner)
@@ -910,6 +916,10 @@ class TestBenchmarks:
         # On va calculer la "coloration" par le moteur de découpe actuellement testé
         algo_results: ResultConversationCut = conversation_engine.main_cut(msgs_dict)
 
+        # Convergence des algorithmes itératifs
+        if algo_results.moves_per_iteration is not None:
+            print(f"Moves per iteration : {algo_results.moves_per_iteration}")
+
         # On va récupérer la "coloration" de chaque message de l'algorithme
         algo_msgs_cl: dict[str, int] = {}
         for cl in range(len(algo_results.conversations_msgs)):
@@ -1063,6 +1073,283 @@ class TestBenchmarks:
             self.current_conversation_engine = None
             self.current_conversation_engine_dict = {}
 
+    #
+    def get_benchmarks_corpus_texts(self) -> list[str]:
+        """
+        Récupère tous les textes de messages des corpus de tests/benchmarks (messages des benchmarks de conversations, et messages des RBI des benchmarks de recherche si elles sont présentes).
+
+        Returns:
+            list[str]: Liste des textes des messages
+        """
+
+        #
+        texts: list[str] = []
+
+        #
+        for fn in self.all_conversations_benchmarks_files:
+            texts += [msg["content"] for msg in self.loaded_benchmarks[fn]["messages"]]
+
+        #
+        for fn in self.all_search_benchmarks_files:
+            #
+            rbi_path: str = self.loaded_benchmarks[fn]["rbi_path"]
+            #
+            if not rbi_path in self.loaded_rbis:
+                # On ignore les RBI que l'on n'a pas
+                if not os.path.exists(f"{self.conf.base_path_rbi_converted_saved}{rbi_path}"):
+                    continue
+                #
+                rbi: RainbowInstance = RainbowInstance(rbi_path, self.conf)
+                res: FunctionResult = rbi.load()
+                if isinstance(res, ResultError):
+                    raise UserWarning(res.error_message)
+                self.loaded_rbis[rbi_path] = rbi
+            #
+            texts += [msg.content for msg in self.loaded_rbis[rbi_path].messages.values()]
+
+        #
+        return texts
+
+    #
+    def run_embedding_padding_benchmark(self, batch_size: int = 16) -> dict[str, float]:
+        """
+        Compare le nombre de messages par seconde pour le calcul des embeddings des corpus de tests/benchmarks :
+            - `max_length` : comportement d'origine, chaque message est complété jusqu'à 512 tokens, batchs dans l'ordre des messages
+            - `dynamic` : complété jusqu'au plus long message du batch, batchs dans l'ordre des messages
+            - `dynamic_buckets` : complété jusqu'au plus long message du batch, batchs de messages de longueurs proches
+        Le cache d'embeddings n'est pas utilisé ici.
+
+        Args:
+            batch_size (int, optional): Taille des batchs. Defaults to 16.
+
+        Returns:
+            dict[str, float]: Le nombre de messages par seconde pour chaque mode
+        """
+
+        #
+        texts: list[str] = self.get_benchmarks_corpus_texts()
+        #
+        print(f"\nRunning embedding padding benchmark on {len(texts)} messages, batch size {batch_size}...")
+
+        #
+        embedding_calculator: EmbeddingCalculator = EmbeddingCalculator({
+            "model_name": "optimum/all-MiniLM-L6-v2",
+            "model_type": "sentence-transformers",
+            "model_optimisations": "optimum",
+            "use_cuda": 1 if cuda.is_available() else 0
+        }, self.conf)
+
+        #
+        results: dict[str, float] = {}
+
+        #
+        mode: str
+        for mode in ["max_length", "dynamic", "dynamic_buckets"]:
+            #
+            embedding_calculator.dynamic_padding = mode != "max_length"
+            #
+            t1: float = time.time()
+            #
+            if mode == "dynamic_buckets":
+                embedding_calculator.get_embeddings_by_length_buckets(texts, batch_size)
+            else:
+                for i in range(0, len(texts), batch_size):
+                    embedding_calculator.get_embeddings(texts[i:i+batch_size])
+            #
+            tt: float = time.time() - t1
+            #
+            results[mode] = len(texts) / tt if tt > 0 else 0.0
+            #
+            print(f" - {mode} : {results[mode]:.1f} messages/s ({tt:.2f}s)")
+
+        #
+        return results
+
+    #
+    def get_search_results_ids(self, search_results: list[tuple[float, MessageSearch]]) -> set[str]:
+        """
+        Renvoie les ids des messages pointés par les résultats d'une recherche.
+
+        Args:
+            search_results (list[tuple[float, MessageSearch]]): Résultats de la recherche
+
+        Returns:
+            set[str]: Ids des messages résultats
+        """
+
+        #
+        return set(mp.msg_id for _, ms in search_results for mp in ms.msg_pointing)
+
+    #
+    def run_ann_benchmark(self, engine_config_file: str = "config_only_embeddings_with_all-MiniLM-L6-v2-optimum_optimised.json", nb_candidates_lst: list[int] = [50, 100, 300], nprobes: list[int] = [1, 4, 16]) -> dict[str, dict[str, float]]:
+        """
+        Compare la recherche avec pré-sélection des candidats par l'index de plus proches voisins à la recherche exacte (tous les messages), sur les recherches des benchmarks de recherche sémantique :
+            - recall : proportion des messages résultats de la recherche exacte que l'on retrouve avec l'index
+            - latence moyenne d'une recherche
+        L'index est construit avant les mesures (son temps de construction est affiché à part).
+
+        Args:
+            engine_config_file (str, optional): Fichier de configuration du moteur de recherche à utiliser. Defaults to "config_only_embeddings_with_all-MiniLM-L6-v2-optimum_optimised.json".
+            nb_candidates_lst (list[int], optional): Nombres de candidats k' à tester. Defaults to [50, 100, 300].
+            nprobes (list[int], optional): Nombres de listes parcourues à tester. Defaults to [1, 4, 16].
+
+        Returns:
+            dict[str, dict[str, float]]: Pour chaque réglage ("exact", ou "k'=..., nprobe=..."), le recall moyen et la latence moyenne en secondes
+        """
+
+        #
+        with open(f"{self.conf.search_engine_configs_paths}{engine_config_file}", encoding="utf-8") as f:
+            engine_dict: dict = json.load(f)
+
+        # Les recherches à effectuer : (rbi, texte de la recherche, utilisateur, dictionnaires de NER)
+        searchs: list[tuple[RainbowInstance, str, User, list[str]]] = []
+        #
+        for fn in self.all_search_benchmarks_files:
+            #
+            benchmark_dict: dict = self.loaded_benchmarks[fn]
+            #
+            if not benchmark_dict["rbi_path"] in self.loaded_rbis:
+                # On ignore les RBI que l'on n'a pas
+                if not os.path.exists(f"{self.conf.base_path_rbi_converted_saved}{benchmark_dict['rbi_path']}"):
+                    continue
+                #
+                self.loaded_rbis[benchmark_dict["rbi_path"]] = RainbowInstance(benchmark_dict["rbi_path"], self.conf)
+            #
+            rbi: RainbowInstance = self.loaded_rbis[benchmark_dict["rbi_path"]]
+            ner_dicts: list[str] = benchmark_dict["ner_dicts"] if "ner_dicts" in benchmark_dict else []
+            #
+            for search in benchmark_dict["searchs"]:
+                searchs.append( (rbi, search["search_input"], rbi.users[str(search["user_id"])], ner_dicts) )
+
+        #
+        print(f"\nRunning ANN benchmark with engine {engine_dict['config_name']} on {len(searchs)} searchs...")
+
+        # Recherche exacte, qui sert de référence
+        exact_engine: SearchEngine = SearchEngine(engine_dict, self.conf)
+        exact_results: list[set[str]] = []
+        #
+        t1: float = time.time()
+        for (rbi, search_input, user, ner_dicts) in searchs:
+            exact_results.append(self.get_search_results_ids(exact_engine.search_main(rbi, search_input, user, SearchSettings(), ner_dicts=ner_dicts)))
+        #
+        results: dict[str, dict[str, float]] = {"exact": {"recall": 1.0, "latency": (time.time() - t1) / max(1, len(searchs))}}
+        print(f" - exact : recall 1.000, {results['exact']['latency'] * 1000:.1f} ms/search")
+
+        #
+        for nb_candidates in nb_candidates_lst:
+            for nprobe in nprobes:
+                #
+                ann_engine: SearchEngine = SearchEngine({**engine_dict, "ann_nb_candidates": nb_candidates, "ann_nprobe": nprobe}, self.conf)
+
+                # Construction (ou mise à jour) des index, hors des mesures
+                t1 = time.time()
+                for (rbi, search_input, user, ner_dicts) in searchs:
+                    ann_engine.search_main(rbi, search_input, user, SearchSettings(), ner_dicts=ner_dicts)
+                build_time: float = time.time() - t1
+
+                #
+                recalls: list[float] = []
+                t1 = time.time()
+                for i, (rbi, search_input, user, ner_dicts) in enumerate(searchs):
+                    ann_ids: set[str] = self.get_search_results_ids(ann_engine.search_main(rbi, search_input, user, SearchSettings(), ner_dicts=ner_dicts))
+                    recalls.append(len(ann_ids & exact_results[i]) / len(exact_results[i]) if len(exact_results[i]) > 0 else 1.0)
+                #
+                setting: str = f"k'={nb_candidates}, nprobe={nprobe}"
+                results[setting] = {"recall": avg(recalls), "latency": (time.time() - t1) / max(1, len(searchs))}
+                print(f" - {setting} : recall {results[setting]['recall']:.3f}, {results[setting]['latency'] * 1000:.1f} ms/search (first pass with index update : {build_time:.2f}s)")
+
+        # Les index construits sont gardés avec leurs RBI
+        for rbi in self.loaded_rbis.values():
+            for index in rbi.vector_indexes.values():
+                index.save()
+
+        #
+        return results
+
+    #
+    def run_levenshtein_benchmark(self, close_words_factor: float = 0.2, files_prefix: str = "semantic_search_simple_") -> dict[str, float]:
+        """
+        Compare le nombre de messages par seconde de la distance de Levenshtein sur les couples de mots, pour les recherches des benchmarks `semantic_search_simple_*` sur tous les messages de leurs RBI :
+            - `naive` : tous les couples de mots sont calculés (`words_levenshtein_distances`)
+            - `engine_cold` : moteur avec élagage des couples de mots, cache vide
+            - `engine_warm` : moteur avec élagage des couples de mots, cache déjà rempli par une première passe (comme pour des recherches répétées)
+
+        Args:
+            close_words_factor (float, optional): Taux qui permet de calculer si deux mots sont proches. Defaults to 0.2.
+            files_prefix (str, optional): Préfixe des fichiers de benchmarks utilisés. Defaults to "semantic_search_simple_".
+
+        Returns:
+            dict[str, float]: Le nombre de messages par seconde pour chaque mode
+        """
+
+        # Les couples (recherche, messages de la RBI) à comparer
+        searchs: list[tuple[str, list[str]]] = []
+        #
+        for fn in self.all_search_benchmarks_files:
+            #
+            if not fn.startswith(files_prefix):
+                continue
+            #
+            benchmark_dict: dict = self.loaded_benchmarks[fn]
+            rbi_path: str = benchmark_dict["rbi_path"]
+            #
+            if not rbi_path in self.loaded_rbis:
+                # On ignore les RBI que l'on n'a pas
+                if not os.path.exists(f"{self.conf.base_path_rbi_converted_saved}{rbi_path}"):
+                    continue
+                #
+                rbi: RainbowInstance = RainbowInstance(rbi_path, self.conf)
+                res: FunctionResult = rbi.load()
+                if isinstance(res, ResultError):
+                    raise UserWarning(res.error_message)
+                self.loaded_rbis[rbi_path] = rbi
+            #
+            msgs_txts: list[str] = [msg.content for msg in self.loaded_rbis[rbi_path].messages.values()]
+            #
+            for search in benchmark_dict["searchs"]:
+                searchs.append( (search["search_input"], msgs_txts) )
+
+        #
+        nb_messages: int = sum(len(msgs_txts) for _, msgs_txts in searchs)
+        #
+        print(f"\nRunning Levenshtein benchmark on {len(searchs)} searchs ({nb_messages} messages compared)...")
+
+        #
+        results: dict[str, float] = {}
+        engine: LevenshteinEngine = LevenshteinEngine()
+
+        #
+        mode: str
+        for mode in ["naive", "engine_cold", "engine_warm"]:
+            #
+            t1: float = time.time()
+            #
+            for search_input, msgs_txts in searchs:
+                for txt in msgs_txts:
+                    if mode == "naive":
+                        words_levenshtein_distances(search_input, txt, close_words_factor)
+                    else:
+                        engine.words_distances(search_input, txt, close_words_factor)
+            #
+            tt: float = time.time() - t1
+            #
+            results[mode] = nb_messages / tt if tt > 0 else 0.0
+            #
+            print(f" - {mode} : {results[mode]:.1f} messages/s ({tt:.2f}s)")
+
+        #
+        print(f"Engine : {engine.nb_distances_calculated} distances calculated, {engine.nb_pairs_pruned} pairs pruned, {engine.nb_lru_hits} cache hits")
+
+        # Le mode "engine_warm" est mesuré après un premier passage sur tous les messages (cache rempli, vocabulaire de toutes les RBI)
+        vocabulary: set[str] = set(w for _, msgs_txts in searchs for txt in msgs_txts for w in txt.split(" ") if w != "")
+        print(f"Vocabulary : {len(vocabulary)} distinct words")
+        if results["naive"] > 0:
+            for mode in ["engine_cold", "engine_warm"]:
+                print(f" - naive / {mode} time ratio : {results[mode] / results['naive']:.2f}")
+
+        #
+        return results
+
     #
     def run_all_tests(self) -> None:
 
@@ -1148,8 +1435,20 @@ if __name__ == "__main__":
     # Profiling 1 - start
     # profiling_task_start("run_all_benchmarks")
 
-    #
-    test_benchmarks.run_all_tests()
+    # Benchmarks de performances seuls
+    if "embedding_padding_benchmark" in sys.argv:
+        test_benchmarks.run_embedding_padding_benchmark()
+    elif "ann_benchmark" in sys.argv:
+        test_benchmarks.run_ann_benchmark()
+    elif "levenshtein_benchmark" in sys.argv:
+        test_benchmarks.run_levenshtein_benchmark()
+    else:
+        test_benchmarks.run_all_tests()
+
+    # Mémoire prise par chaque modèle chargé
+    print("\nLoaded models :")
+    for model_report in get_models_registry().report():
+        print(f" - {model_report['key']} : {model_report['nb_references']} references, ~{model_report['memory_mb']:.1f} MB, loaded in {model_report['load_time']:.2f}s")
 
     # Profiling 1 - end
     # profiling_last_task_ends()
@@ -0,0 +1,217 @@
+"""
+Métadonnées des messages d'une instance Rainbow rangées en colonnes (bulle, auteur, date), alignées sur un indice de ligne par message.
+Les filtres d'une recherche (bulles, utilisateurs, intervalles de dates) deviennent des masques booléens calculés d'un seul coup sur ces colonnes,
+au lieu d'être testés message par message.
+
+Auteur: Nathan Cerisara
+"""
+
+from typing import Optional
+
+from threading import Lock
+
+import numpy as np
+from parse import parse
+
+from message import Message
+
+
+# Capacité initiale des colonnes, elle est doublée quand elle est pleine
+INITIAL_CAPACITY: int = 1024
+
+
+#
+def date_key(txt_date: str) -> Optional[int]:
+    """
+    Convertit une date au format des messages ("YYYY/MM/DD - HHhMM") en un entier YYYYMMDDHHMM, qui est dans le même ordre que les dates,
+    pour pouvoir comparer les dates comme des entiers.
+
+    Args:
+        txt_date (str): La date
+
+    Returns:
+        Optional[int]: La date en entier, ou None si la date n'a pas pu être lue
+    """
+
+    #
+    parsed = parse("{years:d}/{months:d}/{days:d} - {hours:d}h{minutes:d}", txt_date)
+    if parsed is None:
+        return None
+    #
+    return int(f"{parsed['years']:04}{parsed['months']:02}{parsed['days']:02}{parsed['hours']:02}{parsed['minutes']:02}")
+
+
+#
+class MessagesColumns:
+    """
+    Colonnes de métadonnées des messages : une ligne par message, les ids de bulles et d'auteurs sont remplacés par des codes entiers.
+    """
+
+    def __init__(self, messages: list[Message] = []) -> None:
+        """
+        Crée les colonnes, avec les messages donnés.
+
+        Args:
+            messages (list[Message], optional): Messages à ranger dans les colonnes. Defaults to [].
+        """
+
+        # Id et date (texte) du message de chaque ligne
+        self.messages_ids: list[str] = []
+        self.messages_dates: list[str] = []
+
+        # Code entier de chaque id de bulle et d'auteur
+        self.bubbles_codes: dict[str, int] = {}
+        self.authors_codes: dict[str, int] = {}
+
+        # Les colonnes, seules les `nb_rows` premières lignes sont utilisées
+        self.nb_rows: int = 0
+        self.bubble_col: np.ndarray = np.zeros((INITIAL_CAPACITY,), dtype=np.int32)
+        self.author_col: np.ndarray = np.zeros((INITIAL_CAPACITY,), dtype=np.int32)
+        self.date_col: np.ndarray = np.zeros((INITIAL_CAPACITY,), dtype=np.int64)
+        # Les messages trop courts, ou qui sont des commandes "/search", ne sont jamais recherchés
+        self.searchable_col: np.ndarray = np.zeros((INITIAL_CAPACITY,), dtype=bool)
+
+        # Les messages peuvent être ajoutés pendant qu'une recherche filtre les colonnes
+        self.mutex: Lock = Lock()
+
+        #
+        for msg in messages:
+            self.add_message(msg)
+
+    #
+    def get_code(self, codes: dict[str, int], id: str) -> int:
+        """
+        Renvoie le code entier d'un id, en lui en attribuant un nouveau s'il n'en a pas encore.
+
+        Args:
+            codes (dict[str, int]): Dictionnaire des codes (bulles ou auteurs)
+            id (str): L'id
+
+        Returns:
+            int: Le code de l'id
+        """
+
+        #
+        if not id in codes:
+            codes[id] = len(codes)
+        #
+        return codes[id]
+
+    #
+    def add_message(self, msg: Message) -> None:
+        """
+        Ajoute la ligne d'un message aux colonnes.
+
+        Args:
+            msg (Message): Le message à ajouter
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            # On agrandit les colonnes si besoin, les recherches en cours gardent leurs anciennes colonnes
+            if self.nb_rows >= self.bubble_col.shape[0]:
+                new_capacity: int = 2 * self.bubble_col.shape[0]
+                self.bubble_col = np.resize(self.bubble_col, new_capacity)
+                self.author_col = np.resize(self.author_col, new_capacity)
+                self.date_col = np.resize(self.date_col, new_capacity)
+                self.searchable_col = np.resize(self.searchable_col, new_capacity)
+
+            #
+            row: int = self.nb_rows
+            self.bubble_col[row] = self.get_code(self.bubbles_codes, msg.bubble_id)
+            self.author_col[row] = self.get_code(self.authors_codes, msg.author_id)
+            # Une date illisible vaut -1, ce message sera filtré en comparant les textes des dates
+            key: Optional[int] = date_key(msg.date)
+            self.date_col[row] = key if key is not None else -1
+            self.searchable_col[row] = len(msg.content) > 2 and not msg.content.startswith("/search")
+            self.messages_ids.append(msg.id)
+            self.messages_dates.append(msg.date)
+            #
+            self.nb_rows += 1
+        finally:
+            self.mutex.release()
+
+    #
+    def get_codes_array(self, codes: dict[str, int], ids: set) -> np.ndarray:
+        """
+        Renvoie les codes des ids donnés (les ids inconnus sont ignorés).
+
+        Args:
+            codes (dict[str, int]): Dictionnaire des codes (bulles ou auteurs)
+            ids (set): Les ids
+
+        Returns:
+            np.ndarray: Les codes des ids
+        """
+
+        #
+        return np.array([codes[id] for id in ids if id in codes], dtype=np.int32)
+
+    #
+    def filter_rows(self,
+                    bubbles_ids: set,
+                    from_users: Optional[set] = None,
+                    exclude_users: Optional[set] = None,
+                    date_intervals: Optional[list[tuple[str, str]]] = None
+                ) -> list[str]:
+        """
+        Applique les filtres d'une recherche sur toutes les lignes d'un coup, et renvoie les ids des messages qui passent tous les filtres.
+
+        Args:
+            bubbles_ids (set): Bulles dans lesquelles on recherche (filtres d'inclusion et d'exclusion des bulles déjà appliqués)
+            from_users (Optional[set], optional): Si précisé, seuls les messages de ces utilisateurs sont gardés. Defaults to None.
+            exclude_users (Optional[set], optional): Si précisé, les messages de ces utilisateurs sont ignorés. Defaults to None.
+            date_intervals (Optional[list[tuple[str, str]]], optional): Si précisé, seuls les messages dans l'un de ces intervalles (début, fin) de dates sont gardés. Defaults to None.
+
+        Returns:
+            list[str]: Les ids des messages gardés, dans l'ordre des lignes
+        """
+
+        # On récupère une vue cohérente des colonnes
+        self.mutex.acquire()
+        try:
+            nb_rows: int = self.nb_rows
+            bubble_col: np.ndarray = self.bubble_col[:nb_rows]
+            author_col: np.ndarray = self.author_col[:nb_rows]
+            date_col: np.ndarray = self.date_col[:nb_rows]
+            messages_dates: list[str] = self.messages_dates[:nb_rows]
+            mask: np.ndarray = self.searchable_col[:nb_rows].copy()
+            bubbles_codes: np.ndarray = self.get_codes_array(self.bubbles_codes, bubbles_ids)
+            from_users_codes: Optional[np.ndarray] = self.get_codes_array(self.authors_codes, from_users) if from_users is not None else None
+            exclude_users_codes: Optional[np.ndarray] = self.get_codes_array(self.authors_codes, exclude_users) if exclude_users is not None else None
+        finally:
+            self.mutex.release()
+
+        # Filtre des bulles
+        mask &= np.isin(bubble_col, bubbles_codes)
+
+        # Filtres sur les utilisateurs
+        if from_users_codes is not None:
+            mask &= np.isin(author_col, from_users_codes)
+        #
+        if exclude_users_codes is not None:
+            mask &= ~np.isin(author_col, exclude_users_codes)
+
+        # Filtre sur les dates : le message doit être dans au moins un des intervalles
+        if date_intervals is not None:
+            dates_mask: np.ndarray = np.zeros((nb_rows,), dtype=bool)
+            unparsed_rows: np.ndarray = np.flatnonzero(date_col < 0)
+            #
+            for (date_begin, date_end) in date_intervals:
+                #
+                key_begin: Optional[int] = date_key(date_begin)
+                key_end: Optional[int] = date_key(date_end)
+                # Si une borne n'a pas pu être lue, on compare les textes des dates, comme avant
+                if key_begin is None or key_end is None:
+                    dates_mask |= np.array([date_begin <= date <= date_end for date in messages_dates], dtype=bool)
+                    continue
+                #
+                dates_mask |= (date_col >= key_begin) & (date_col <= key_end)
+                # Pareil pour les messages dont la date n'a pas pu être lue
+                for row in unparsed_rows:
+                    dates_mask[row] |= date_begin <= messages_dates[row] <= date_end
+            mask &= dates_mask
+
+        #
+        return [self.messages_ids[row] for row in np.flatnonzero(mask)]
@@ -0,0 +1,251 @@
+"""
+Registre des modèles chargés en mémoire, commun à tout le processus.
+Plusieurs moteurs (de recherche, de NER, de découpe de conversations, de traduction, ...) peuvent utiliser le même modèle,
+au lieu que chacun en charge sa propre copie, le registre charge chaque modèle une seule fois et compte les objets qui l'utilisent.
+
+Auteur: Nathan Cerisara
+"""
+
+from typing import Any, Callable, Optional
+from dataclasses import dataclass, field
+
+import os
+import time
+import weakref
+from threading import Lock, RLock
+
+from profiling import profiling_task_start, profiling_last_task_ends
+
+
+#
+def get_process_memory_usage() -> int:
+    """
+    Renvoie la mémoire résidente actuelle du processus, en octets (0 si on ne peut pas la connaître sur ce système).
+
+    Returns:
+        int: Mémoire résidente du processus, en octets
+    """
+
+    # Linux
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm", "r", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    #
+    return 0
+
+
+#
+@dataclass
+class RegistryEntry:
+
+    # La clé de l'entrée, ex: ("embedding_model", "optimum/all-MiniLM-L6-v2", "optimum", "cpu")
+    key: tuple
+
+    # L'objet chargé (modèle, pipeline, ...)
+    obj: Any
+
+    # Nombre d'objets qui utilisent actuellement ce modèle
+    nb_references: int = 0
+
+    # Mémoire prise par le chargement du modèle (différence de mémoire résidente du processus), en octets
+    memory: int = 0
+
+    # Temps de chargement du modèle, en secondes
+    load_time: float = 0.0
+
+    # Date de dernière utilisation, pour pouvoir décharger les modèles les moins récemment utilisés
+    last_used: float = 0.0
+
+    # Verrou à prendre pour utiliser le modèle depuis plusieurs threads
+    mutex: Lock = field(default_factory=Lock)
+
+
+#
+class ModelsRegistry:
+    """
+    Registre des modèles chargés, avec un compteur de références par modèle.
+    Un modèle qui n'est plus référencé reste chargé (pour qu'un moteur recréé juste après le retrouve directement), jusqu'à un appel à `free_unused`.
+    """
+
+    def __init__(self) -> None:
+        #
+        self.entries: dict[tuple, RegistryEntry] = {}
+        # Réentrant, car le chargement d'un modèle peut demander un autre modèle du registre
+        self.mutex: RLock = RLock()
+
+    #
+    def acquire(self, key: tuple, loader: Callable[[], Any]) -> RegistryEntry:
+        """
+        Renvoie l'entrée du modèle demandé, en le chargeant avec `loader` s'il n'est pas encore chargé, et augmente son compteur de références.
+
+        Args:
+            key (tuple): Clé identifiant le modèle
+            loader (Callable[[], Any]): Fonction qui charge le modèle
+
+        Returns:
+            RegistryEntry: L'entrée du registre pour ce modèle
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            #
+            if not key in self.entries:
+
+                # Profiling 1 - start
+                # profiling_task_start(f"registry_loading_{key}")
+
+                #
+                mem_before: int = get_process_memory_usage()
+                t1: float = time.time()
+                #
+                obj: Any = loader()
+                #
+                self.entries[key] = RegistryEntry(
+                    key=key,
+                    obj=obj,
+                    memory=max(0, get_process_memory_usage() - mem_before),
+                    load_time=time.time() - t1
+                )
+                #
+                print(f"Model {key} loaded in {self.entries[key].load_time:.2f}s, resident size ~{self.entries[key].memory / (1024 * 1024):.1f} MB")
+
+                # Profiling 1 - end
+                # profiling_last_task_ends()
+
+            #
+            entry: RegistryEntry = self.entries[key]
+            entry.nb_references += 1
+            entry.last_used = time.time()
+            #
+            return entry
+        finally:
+            self.mutex.release()
+
+    #
+    def acquire_for(self, owner: object, key: tuple, loader: Callable[[], Any]) -> RegistryEntry:
+        """
+        Comme `acquire`, mais la référence est automatiquement relâchée quand l'objet `owner` est détruit.
+
+        Args:
+            owner (object): L'objet qui utilise le modèle
+            key (tuple): Clé identifiant le modèle
+            loader (Callable[[], Any]): Fonction qui charge le modèle
+
+        Returns:
+            RegistryEntry: L'entrée du registre pour ce modèle
+        """
+
+        #
+        entry: RegistryEntry = self.acquire(key, loader)
+        #
+        weakref.finalize(owner, self.release, key)
+        #
+        return entry
+
+    #
+    def release(self, key: tuple) -> None:
+        """
+        Relâche une référence sur un modèle.
+
+        Args:
+            key (tuple): Clé identifiant le modèle
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            if key in self.entries and self.entries[key].nb_references > 0:
+                self.entries[key].nb_references -= 1
+        finally:
+            self.mutex.release()
+
+    #
+    def unload(self, key: tuple) -> None:
+        """
+        Décharge un modèle du registre, quel que soit son nombre de références (les objets qui l'utilisent encore en gardent une copie).
+
+        Args:
+            key (tuple): Clé identifiant le modèle
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            if key in self.entries:
+                del self.entries[key]
+        finally:
+            self.mutex.release()
+
+    #
+    def free_unused(self) -> int:
+        """
+        Décharge tous les modèles qui ne sont plus référencés.
+
+        Returns:
+            int: Le nombre de modèles déchargés
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            unused: list[tuple] = [key for key, entry in self.entries.items() if entry.nb_references == 0]
+            for key in unused:
+                del self.entries[key]
+            return len(unused)
+        finally:
+            self.mutex.release()
+
+    #
+    def report(self) -> list[dict]:
+        """
+        Renvoie un rapport sur chaque modèle chargé (clé, nombre de références, mémoire, temps de chargement).
+
+        Returns:
+            list[dict]: Une ligne par modèle chargé
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            return [
+                {
+                    "key": list(entry.key),
+                    "nb_references": entry.nb_references,
+                    "memory_mb": entry.memory / (1024 * 1024),
+                    "load_time": entry.load_time
+                }
+                for entry in self.entries.values()
+            ]
+        finally:
+            self.mutex.release()
+
+
+# Le registre commun à tout le processus
+MODELS_REGISTRY: Optional[ModelsRegistry] = None
+
+# Pour ne créer le registre qu'une seule fois même si plusieurs threads le demandent en même temps
+MODELS_REGISTRY_MUTEX: Lock = Lock()
+
+
+#
+def get_models_registry() -> ModelsRegistry:
+    """
+    Renvoie le registre de modèles du processus (il est créé au premier appel).
+
+    Returns:
+        ModelsRegistry: Le registre de modèles
+    """
+
+    #
+    global MODELS_REGISTRY
+    #
+    if MODELS_REGISTRY is None:
+        MODELS_REGISTRY_MUTEX.acquire()
+        try:
+            if MODELS_REGISTRY is None:
+                MODELS_REGISTRY = ModelsRegistry()
+        finally:
+            MODELS_REGISTRY_MUTEX.release()
+    #
+    return MODELS_REGISTRY
@@ -8,15 +8,116 @@ Auteur: Nathan Cerisara
 from dataclasses import dataclass
 from typing import Optional, Any, cast
 
+import time
+from collections import OrderedDict
+from threading import Lock
+
 import spacy
-from langdetect import detect as language_detection
 
 from config import Config
 from lib import ConfigError
+from models_registry import RegistryEntry, get_models_registry
+from language_detection import get_language_detector
 
 from profiling import profiling_task_start, profiling_last_task_ends
 
 
+# Composants des pipelines spaCy dont la NER n'a pas besoin
+SPACY_UNUSED_COMPONENTS: set[str] = set(["parser", "lemmatizer", "tagger", "morphologizer", "attribute_ruler", "senter"])
+
+# Nombre de textes par batch de `nlp.pipe` par défaut
+DEFAULT_SPACY_BATCH_SIZE: int = 64
+
+# Mémoire maximale prise par les pipelines spaCy chargées, en Mo (0 = pas de limite)
+DEFAULT_SPACY_MEMORY_BUDGET_MB: float = 0
+
+
+#
+class SpacyPipelinesPool:
+    """
+    Ensemble des pipelines spaCy chargées, commun à tous les algorithmes de NER du processus.
+    Chaque pipeline n'est chargée (dans le registre de modèles) qu'à sa première utilisation,
+    et les pipelines les moins récemment utilisées sont déchargées quand la mémoire prise par les pipelines dépasse le budget.
+    """
+
+    def __init__(self, memory_budget_mb: float = DEFAULT_SPACY_MEMORY_BUDGET_MB) -> None:
+        """
+        Crée un ensemble de pipelines vide.
+
+        Args:
+            memory_budget_mb (float, optional): Mémoire maximale prise par les pipelines chargées, en Mo (0 = pas de limite). Defaults to DEFAULT_SPACY_MEMORY_BUDGET_MB.
+        """
+
+        #
+        self.memory_budget: int = int(memory_budget_mb * 1024 * 1024)
+
+        # Entrées du registre des pipelines chargées, de la moins récemment utilisée à la plus récemment utilisée
+        self.entries: OrderedDict[str, RegistryEntry] = OrderedDict()
+
+        #
+        self.mutex: Lock = Lock()
+
+    #
+    def set_memory_budget(self, memory_budget_mb: float) -> None:
+        """
+        Change le budget de mémoire des pipelines (il sera appliqué au prochain chargement).
+
+        Args:
+            memory_budget_mb (float): Mémoire maximale prise par les pipelines chargées, en Mo (0 = pas de limite)
+        """
+
+        #
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+
+    #
+    def get(self, spacy_model_name: str) -> RegistryEntry:
+        """
+        Renvoie l'entrée du registre d'une pipeline spaCy, en la chargeant si elle ne l'est pas encore.
+        Le verrou de l'entrée doit être pris pour utiliser la pipeline.
+
+        Args:
+            spacy_model_name (str): Nom du modèle spaCy (ex: en_core_web_sm)
+
+        Returns:
+            RegistryEntry: L'entrée du registre, la pipeline est dans `obj`
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            #
+            if spacy_model_name in self.entries:
+                self.entries.move_to_end(spacy_model_name)
+                self.entries[spacy_model_name].last_used = time.time()
+                return self.entries[spacy_model_name]
+
+            # Chargement (le registre affiche le temps de chargement et la mémoire prise)
+            entry: RegistryEntry = get_models_registry().acquire(("spacy", spacy_model_name), lambda: spacy.load(spacy_model_name))
+            self.entries[spacy_model_name] = entry
+
+            # On décharge les pipelines les moins récemment utilisées tant que le budget est dépassé (on garde toujours celle demandée)
+            while self.memory_budget > 0 and len(self.entries) > 1 and sum(e.memory for e in self.entries.values()) > self.memory_budget:
+                #
+                old_model_name: str
+                old_entry: RegistryEntry
+                old_model_name, old_entry = self.entries.popitem(last=False)
+                #
+                get_models_registry().release(old_entry.key)
+                if old_entry.nb_references == 0:
+                    get_models_registry().unload(old_entry.key)
+                #
+                print(f"SpaCy pipeline {old_model_name} unloaded (memory budget of {self.memory_budget / (1024 * 1024):.0f} MB exceeded), ~{old_entry.memory / (1024 * 1024):.1f} MB freed")
+
+            #
+            return entry
+        finally:
+            self.mutex.release()
+
+
+# Les pipelines spaCy communes à tout le processus
+SPACY_PIPELINES_POOL: SpacyPipelinesPool = SpacyPipelinesPool()
+
+
 #
 class NER_Algorithm:
     """
@@ -42,6 +143,22 @@ class NER_Algorithm:
         """
         return []
 
+    #
+    def recognize_many(self, txts: list[str]) -> list[ list[ tuple[int, str, str] ] ]:
+        """
+        Reconnaissance d'entités nommées sur plusieurs textes à la fois.
+        Par défaut, chaque texte est traité séparément, les algorithmes qui peuvent traiter des batchs redéfinissent cette fonction.
+
+        Args:
+            txts (list[str]): Les textes dont on veut extraire les entités nommés.
+
+        Returns:
+            list[ list[ tuple[int, str, str] ] ]: Les entités nommées reconnues de chaque texte, dans l'ordre des textes.
+        """
+
+        #
+        return [self.recognize(txt) for txt in txts]
+
 
 #
 class SimpleSyntaxic_NER_Algorithm(NER_Algorithm):
@@ -137,23 +254,30 @@ class SimpleSyntaxic_NER_Algorithm(NER_Algorithm):
 
 
 #
-class SpaCy_SM_NER_Algorithm(NER_Algorithm):
+class SpaCy_NER_Algorithm(NER_Algorithm):
     """
-    Algorithme de NER qui se base sur SpaCy.
+    Algorithme de NER qui se base sur SpaCy, avec un modèle anglais et un modèle français. Classe abstraite, les modèles sont choisis par les classes filles.
     """
 
+    # Noms des modèles spaCy anglais et français
+    spacy_model_en: str = ""
+    spacy_model_fr: str = ""
+
     def __init__(self, algo_config: dict, config: Config) -> None:
         super().__init__(algo_config, config)
-        #
-        self.nlp_en: spacy.language.Language = spacy.load("en_core_web_sm")
-        self.nlp_fr: spacy.language.Language = spacy.load("fr_core_news_sm")
+
+        # Les pipelines ne sont chargées qu'à la première utilisation de leur langue
+        if "memory_budget_mb" in algo_config:
+            SPACY_PIPELINES_POOL.set_memory_budget(float(algo_config["memory_budget_mb"]))
+
+        # Nombre de textes par batch de `nlp.pipe`, et nombre de processus qui traitent les batchs
+        self.batch_size: int = int(algo_config["batch_size"]) if "batch_size" in algo_config else DEFAULT_SPACY_BATCH_SIZE
+        self.n_process: int = int(algo_config["n_process"]) if "n_process" in algo_config else 1
 
     #
     def recognize(self, txt: str) -> list[ tuple[int, str, str] ]:
         """
-        Reconnaissance d'entité nommée par des règles syntaxiques de bases:
-            - Un mot qui commence par une majuscule et qui n'est pas le premier mot d'une phrase a de fortes chances d'être une entité nommée
-            - Un mot qui est tout en majuscule a de fortes chance d'être une entité nommée
+        Reconnaissance d'entités nommées avec le modèle spaCy de la langue détectée du texte.
 
         Args:
             txt (str): Le texte dont on veut extraire les entités nommés.
@@ -162,80 +286,75 @@ class SpaCy_SM_NER_Algorithm(NER_Algorithm):
             list[ tuple[int, str, str] ]: La liste des entités nommés reconnues, sous le format (position dans la chaîne `txt`, texte de l'entité, type de l'entité).
         """
 
-        # Liste des résultats que l'on va renvoyer
-        resultats: list[ tuple[int, str, str] ] = []
-
-        # On détecte le langage pour savoir quel modèle de spacy utiliser
-        lang: str
-        try:
-            lang = language_detection(txt)
-        except:
-            lang = ""
-
-        # On utilise spacy
-        doc: spacy.tokens.Doc
-        if lang == "fr":
-            doc = self.nlp_fr(txt)
-        else:
-            doc = self.nlp_en(txt)
-
-        # On récupère les résultats de spacy
-        for ent in doc.ents:
-            # resultats.append( (ent.start_char, ent.text, ent.label_) )
-            resultats.append( (ent.start_char, ent.text, "") )
-
-        # On renvoie les résultats
-        return resultats
-
-
-#
-class SpaCy_LG_NER_Algorithm(NER_Algorithm):
-    """
-    Algorithme de NER qui se base sur SpaCy.
-    """
-
-    def __init__(self, algo_config: dict, config: Config) -> None:
-        super().__init__(algo_config, config)
         #
-        self.nlp_en: spacy.language.Language = spacy.load("en_core_web_lg")
-        self.nlp_fr: spacy.language.Language = spacy.load("fr_core_news_lg")
+        return self.recognize_many([txt])[0]
 
     #
-    def recognize(self, txt: str) -> list[ tuple[int, str, str] ]:
+    def recognize_many(self, txts: list[str]) -> list[ list[ tuple[int, str, str] ] ]:
         """
-        Reconnaissance d'entité nommée par des règles syntaxiques de bases:
-            - Un mot qui commence par une majuscule et qui n'est pas le premier mot d'une phrase a de fortes chances d'être une entité nommée
-            - Un mot qui est tout en majuscule a de fortes chance d'être une entité nommée
+        Reconnaissance d'entités nommées sur plusieurs textes : les textes sont regroupés par langue détectée,
+        puis chaque groupe passe dans `nlp.pipe` par batchs, sans les composants de la pipeline inutiles pour la NER.
 
         Args:
-            txt (str): Le texte dont on veut extraire les entités nommés.
+            txts (list[str]): Les textes dont on veut extraire les entités nommés.
 
         Returns:
-            list[ tuple[int, str, str] ]: La liste des entités nommés reconnues, sous le format (position dans la chaîne `txt`, texte de l'entité, type de l'entité).
+            list[ list[ tuple[int, str, str] ] ]: Les entités nommées reconnues de chaque texte, dans l'ordre des textes.
         """
 
         # Liste des résultats que l'on va renvoyer
-        resultats: list[ tuple[int, str, str] ] = []
+        resultats: list[ list[ tuple[int, str, str] ] ] = [[] for _ in txts]
 
-        # On détecte le langage pour savoir quel modèle de spacy utiliser
-        lang: str
-        try:
-            lang = language_detection(txt)
-        except:
-            lang = ""
-
-        # On utilise spacy
-        doc: spacy.tokens.Doc
-        if lang == "fr":
-            doc = self.nlp_fr(txt)
-        else:
-            doc = self.nlp_en(txt)
-
-        # On récupère les résultats de spacy
-        for ent in doc.ents:
-            # resultats.append( (ent.start_char, ent.text, ent.label_) )
-            resultats.append( (ent.start_char, ent.text, "") )
+        # On détecte le langage de chaque texte pour savoir quel modèle de spacy utiliser
+        ids_by_entry: dict[int, list[int]] = {0: [], 1: []}
+        for id_txt, lang in enumerate(get_language_detector().detect_many(txts)):
+            ids_by_entry[1 if lang == "fr" else 0].append(id_txt)
+
+        #
+        for id_entry, ids_txts in ids_by_entry.items():
+            #
+            if len(ids_txts) == 0:
+                continue
+
+            # On utilise spacy (la pipeline est partagée, un seul thread à la fois)
+            nlp_entry: RegistryEntry = SPACY_PIPELINES_POOL.get(self.spacy_model_fr if id_entry == 1 else self.spacy_model_en)
+            docs: list[spacy.tokens.Doc]
+            nlp_entry.mutex.acquire()
+            try:
+                docs = list(nlp_entry.obj.pipe(
+                    [txts[id_txt] for id_txt in ids_txts],
+                    batch_size=self.batch_size,
+                    n_process=self.n_process,
+                    disable=[name for name in nlp_entry.obj.pipe_names if name in SPACY_UNUSED_COMPONENTS]
+                ))
+            finally:
+                nlp_entry.mutex.release()
+
+            # On récupère les résultats de spacy
+            for id_txt, doc in zip(ids_txts, docs):
+                for ent in doc.ents:
+                    # resultats[id_txt].append( (ent.start_char, ent.text, ent.label_) )
+                    resultats[id_txt].append( (ent.start_char, ent.text, "") )
 
         # On renvoie les résultats
         return resultats
 
+
+#
+class SpaCy_SM_NER_Algorithm(SpaCy_NER_Algorithm):
+    """
+    Algorithme de NER qui se base sur SpaCy (petits modèles).
+    """
+
+    spacy_model_en: str = "en_core_web_sm"
+    spacy_model_fr: str = "fr_core_news_sm"
+
+
+#
+class SpaCy_LG_NER_Algorithm(SpaCy_NER_Algorithm):
+    """
+    Algorithme de NER qui se base sur SpaCy (grands modèles).
+    """
+
+    spacy_model_en: str = "en_core_web_lg"
+    spacy_model_fr: str = "fr_core_news_lg"
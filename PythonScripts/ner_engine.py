@@ -8,10 +8,13 @@ Auteur: Nathan Cerisara
 from dataclasses import dataclass
 from typing import Optional, Any, cast
 
+import json
+
 from config import Config
 from lib import ConfigError, linear_collision
 from ner_algorithms import NER_Algorithm
 import ner_algorithms as NA
+from ner_results_cache import NERResultsCache
 
 from profiling import profiling_task_start, profiling_last_task_ends
 
@@ -74,6 +77,45 @@ class NER_Engine:
             list[ tuple[int, str, str] ]: La liste des entités nommés reconnues, sous le format (position dans la chaîne `txt`, texte de l'entité, type de l'entité).
         """
 
+        #
+        return self.main_recognize_many([txt])[0]
+
+    #
+    def main_recognize_many(self, txts: list[str]) -> list[ list[ tuple[int, str, str] ] ]:
+        """
+        Comme `main_recognize`, mais pour plusieurs textes à la fois : chaque algorithme de NER traite tous les textes d'un coup (par batchs si l'algorithme le peut).
+
+        Args:
+            txts (list[str]): Les textes dont on veut extraire les entités nommés.
+
+        Returns:
+            list[ list[ tuple[int, str, str] ] ]: Les entités nommées reconnues de chaque texte, dans l'ordre des textes.
+        """
+
+        #
+        if len(txts) == 0:
+            return []
+
+        # Résultats de chaque algorithme, pour chaque texte
+        algos_results: list[ list[ list[ tuple[int, str, str] ] ] ] = [algo.recognize_many(txts) for algo in self.algorithms]
+
+        #
+        return [self.combine_results([algo_results[id_txt] for algo_results in algos_results]) for id_txt in range(len(txts))]
+
+    #
+    def combine_results(self, algos_results: list[ list[ tuple[int, str, str] ] ]) -> list[ tuple[int, str, str] ]:
+        """
+        Combine les résultats des algorithmes de NER sur un même texte.
+        La combinaison des résultats est juste l'union de tous les résultats des sous-algorithmes de NER.
+        Si intersection, on prend le résultat du premier algorithme de NER avec le plus gros coefficients.
+
+        Args:
+            algos_results (list[ list[ tuple[int, str, str] ] ]): Les résultats de chaque algorithme, dans l'ordre des algorithmes.
+
+        Returns:
+            list[ tuple[int, str, str] ]: La liste des entités nommés reconnues, sous le format (position dans le texte, texte de l'entité, type de l'entité).
+        """
+
         # Contiendra la liste des résultats temporaires, avec indication de l'algorithme d'où chaque résultat vient (pour gérer les collisions).
         pre_results: list[ tuple[ int, tuple[int, str, str] ] ] = []
 
@@ -82,7 +124,7 @@ class NER_Engine:
         for id_algo in range(len(self.algorithms)):
 
             # On va récupérer les résultats de l'algorithme
-            algo_results: list[ tuple[int, str, str] ] = self.algorithms[id_algo].recognize(txt)
+            algo_results: list[ tuple[int, str, str] ] = algos_results[id_algo]
             bon_results: list[ tuple[ int, tuple[int, str, str] ] ] = []
 
             # Pour chaque résultat
@@ -114,8 +156,52 @@ class NER_Engine:
                 pre_results.append(br)
 
         #
-        #print(f"MAIN RECOGNIZE ||| Input msgs: {txt} | results : {pre_results}")
+        #print(f"MAIN RECOGNIZE ||| results : {pre_results}")
 
         #
         return [pr[1] for pr in pre_results]
 
+    #
+    def get_signature(self) -> str:
+        """
+        Renvoie une signature de la configuration de ce moteur : deux moteurs de même signature reconnaissent les mêmes entités.
+
+        Returns:
+            str: La signature
+        """
+
+        #
+        return json.dumps(self.ner_config, sort_keys=True, ensure_ascii=False)
+
+    #
+    def main_recognize_cached(self, txts: list[str], results_cache: Optional[NERResultsCache] = None) -> list[ list[ tuple[int, str, str] ] ]:
+        """
+        Reconnaît les entités nommées de plusieurs textes, en réutilisant les résultats déjà connus du cache (et en y ajoutant les nouveaux).
+
+        Args:
+            txts (list[str]): Les textes dont on veut extraire les entités nommés.
+            results_cache (Optional[NERResultsCache], optional): Cache des résultats de ce moteur. Defaults to None.
+
+        Returns:
+            list[ list[ tuple[int, str, str] ] ]: Les entités nommées reconnues de chaque texte, dans l'ordre.
+        """
+
+        #
+        if results_cache is None:
+            return self.main_recognize_many(txts)
+
+        #
+        results: list[ Optional[ list[ tuple[int, str, str] ] ] ] = [results_cache.get(txt) for txt in txts]
+
+        # On ne reconnaît qu'une seule fois chaque texte qui n'est pas encore dans le cache
+        new_txts: list[str] = list(dict.fromkeys(txt for txt, res in zip(txts, results) if res is None))
+        if len(new_txts) > 0:
+            #
+            new_results: list[ list[ tuple[int, str, str] ] ] = self.main_recognize_many(new_txts)
+            results_cache.add(new_txts, new_results)
+            #
+            new_results_dict: dict[str, list[ tuple[int, str, str] ]] = dict(zip(new_txts, new_results))
+            results = [res if res is not None else list(new_results_dict[txt]) for txt, res in zip(txts, results)]
+
+        #
+        return cast(list[ list[ tuple[int, str, str] ] ], results)
@@ -0,0 +1,99 @@
+"""
+Entités nommées reconnues dans les messages d'une instance Rainbow, pour une configuration de moteur de NER donnée.
+Les résultats sont écrits sur le disque à côté de la RBI (un fichier en ajout seul, voir `JsonlStore`), et les plus récemment utilisés sont gardés en mémoire (LRU),
+ainsi une recherche n'a plus qu'à reconnaître les entités du texte de la recherche.
+
+Auteur: Nathan Cerisara
+"""
+
+from typing import Optional, Any
+
+from jsonl_store import JsonlStore, DEFAULT_LRU_CAPACITY
+
+
+# Nom du fichier d'un cache de résultats de NER
+RESULTS_FILE: str = "entities.jsonl"
+
+
+#
+def decode_entities(entities: list[list[Any]]) -> list[tuple[int, str, str]]:
+    """
+    Convertit les entités lues dans le fichier (listes json) en tuples.
+
+    Args:
+        entities (list[list[Any]]): Les entités lues
+
+    Returns:
+        list[tuple[int, str, str]]: Les entités (position, texte, type)
+    """
+
+    #
+    return [tuple(e) for e in entities]
+
+
+#
+class NERResultsCache:
+    """
+    Dictionnaire texte -> entités nommées reconnues, persistant, pour une configuration de moteur de NER.
+    """
+
+    def __init__(self, dir_path: str, signature: str, lru_capacity: int = DEFAULT_LRU_CAPACITY) -> None:
+        """
+        Crée le cache, et charge l'index de ses résultats depuis le disque s'il y a déjà été sauvegardé.
+
+        Args:
+            dir_path (str): Dossier où est sauvegardé le cache
+            signature (str): Signature de la configuration du moteur de NER (elle est gardée dans le dossier pour pouvoir savoir à quoi il correspond)
+            lru_capacity (int, optional): Nombre de résultats gardés en mémoire. Defaults to DEFAULT_LRU_CAPACITY.
+        """
+
+        #
+        self.dir_path: str = dir_path
+        self.signature: str = signature
+        #
+        self.store: JsonlStore = JsonlStore(f"{dir_path}{RESULTS_FILE}", lru_capacity=lru_capacity, decode_value=decode_entities, meta={"signature": signature})
+
+    #
+    def has(self, txt: str) -> bool:
+        """
+        Indique si les entités de ce texte sont connues.
+
+        Args:
+            txt (str): Le texte
+
+        Returns:
+            bool: Si le résultat est connu
+        """
+
+        #
+        return self.store.has(txt)
+
+    #
+    def get(self, txt: str) -> Optional[list[tuple[int, str, str]]]:
+        """
+        Renvoie les entités reconnues dans un texte, si elles sont connues.
+
+        Args:
+            txt (str): Le texte
+
+        Returns:
+            Optional[list[tuple[int, str, str]]]: Les entités (position, texte, type), ou None si elles ne sont pas connues
+        """
+
+        #
+        entities: Optional[list[tuple[int, str, str]]] = self.store.get(txt)
+        #
+        return list(entities) if entities is not None else None
+
+    #
+    def add(self, txts: list[str], entities_lst: list[list[tuple[int, str, str]]]) -> None:
+        """
+        Ajoute des résultats au cache, et les écrit à la fin du fichier.
+
+        Args:
+            txts (list[str]): Les textes
+            entities_lst (list[list[tuple[int, str, str]]]): Les entités de chaque texte, dans le même ordre
+        """
+
+        #
+        self.store.add([(txt, list(entities)) for txt, entities in zip(txts, entities_lst)])
@@ -0,0 +1,98 @@
+"""
+Textes pré-traités (remplacements NER, traduction) des messages d'une instance Rainbow, pour une chaîne de pré-traitement donnée.
+Chaque texte n'est pré-traité qu'une seule fois, puis gardé sur le disque à côté de la RBI (un fichier en ajout seul),
+ainsi à chaque recherche, il n'y a plus que le texte de la recherche à pré-traiter.
+
+Auteur: Nathan Cerisara
+"""
+
+from typing import cast
+
+import hashlib
+
+from jsonl_store import JsonlStore
+
+
+# Nom du fichier d'un corpus pré-traité
+CORPUS_FILE: str = "corpus.jsonl"
+
+
+#
+def hash_signature(signature: str) -> str:
+    """
+    Renvoie un nom de dossier court et stable pour une signature de chaîne de pré-traitement.
+
+    Args:
+        signature (str): La signature
+
+    Returns:
+        str: Le hash de la signature, en hexadécimal
+    """
+
+    #
+    return hashlib.blake2b(signature.encode("utf-8"), digest_size=8).hexdigest()
+
+
+#
+class PreProcessedCorpus:
+    """
+    Dictionnaire texte original -> texte pré-traité, persistant (voir `JsonlStore`), pour une signature de chaîne de pré-traitement.
+    """
+
+    def __init__(self, dir_path: str, signature: str) -> None:
+        """
+        Crée le corpus, et charge l'index de ses textes depuis le disque s'il y a déjà été sauvegardé.
+
+        Args:
+            dir_path (str): Dossier où est sauvegardé le corpus
+            signature (str): Signature de la chaîne de pré-traitement (elle est gardée dans le dossier pour pouvoir savoir à quoi il correspond)
+        """
+
+        #
+        self.dir_path: str = dir_path
+        self.signature: str = signature
+        #
+        self.store: JsonlStore = JsonlStore(f"{dir_path}{CORPUS_FILE}", meta={"signature": signature})
+
+    #
+    def has(self, txt: str) -> bool:
+        """
+        Indique si ce texte a déjà été pré-traité.
+
+        Args:
+            txt (str): Texte original
+
+        Returns:
+            bool: Si le texte pré-traité est connu
+        """
+
+        #
+        return self.store.has(txt)
+
+    #
+    def get(self, txt: str) -> str:
+        """
+        Renvoie le texte pré-traité d'un texte original déjà pré-traité.
+
+        Args:
+            txt (str): Texte original
+
+        Returns:
+            str: Texte pré-traité
+        """
+
+        #
+        return cast(str, self.store.get(txt))
+
+    #
+    def add(self, original_txts: list[str], pre_processed_txts: list[str]) -> None:
+        """
+        Ajoute des textes pré-traités au corpus, et les écrit à la fin du fichier du corpus.
+
+        Args:
+            original_txts (list[str]): Textes originaux
+            pre_processed_txts (list[str]): Textes pré-traités, dans le même ordre
+        """
+
+        #
+        self.store.add(list(zip(original_txts, pre_processed_txts)))
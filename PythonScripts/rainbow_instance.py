@@ -7,13 +7,20 @@ Auteur: Nathan Cerisara
 from typing import Optional
 
 import os
+from threading import Lock
 
 from user import User
 from bubble import Bubble
 from message import Message
+from vector_index import IVFFlatIndex
+from messages_columns import MessagesColumns
+from preprocessed_corpus import PreProcessedCorpus, hash_signature
+from inverted_index import InvertedIndex
+from ner_results_cache import NERResultsCache
+from entities_index import EntitiesIndex
 
 from config import Config
-from lib import FunctionResult, ResultError, ResultSuccess
+from lib import FunctionResult, ResultError, ResultSuccess, escapeCharacters
 
 
 #
@@ -42,6 +49,30 @@ class RainbowInstance():
         # Liste des messages, indexés par leur id
         self.messages: dict[str, Message] = {}
 
+        # Métadonnées des messages en colonnes, pour filtrer rapidement les messages d'une recherche (construites à la demande)
+        self.messages_columns: Optional[MessagesColumns] = None
+        self.messages_columns_mutex: Lock = Lock()
+
+        # Textes pré-traités des messages, un corpus par chaîne de pré-traitement, chargés à la demande
+        self.preprocessed_corpora: dict[str, PreProcessedCorpus] = {}
+        self.preprocessed_corpora_mutex: Lock = Lock()
+
+        # Index inversés des mots des messages, un par chaîne de pré-traitement (None = textes bruts des messages), construits à la demande
+        self.inverted_indexes: dict[Optional[str], InvertedIndex] = {}
+        self.inverted_indexes_mutex: Lock = Lock()
+
+        # Entités nommées reconnues dans les messages, un cache par configuration de moteur de NER, chargés à la demande
+        self.ner_results_caches: dict[str, NERResultsCache] = {}
+        self.ner_results_caches_mutex: Lock = Lock()
+
+        # Index inversés des entités nommées des messages, un par configuration de moteur de NER, construits à la demande
+        self.entities_indexes: dict[str, EntitiesIndex] = {}
+        self.entities_indexes_mutex: Lock = Lock()
+
+        # Index de plus proches voisins des embeddings des messages, un par modèle (et pré-traitement), chargés à la demande
+        self.vector_indexes: dict[str, IVFFlatIndex] = {}
+        self.vector_indexes_mutex: Lock = Lock()
+
         #
         self.loaded: bool = False
 
@@ -91,6 +122,10 @@ class RainbowInstance():
             if isinstance(res, ResultError):
                 return res
 
+        # On sauvegarde les index de plus proches voisins qui ont changé
+        for index in list(self.vector_indexes.values()):
+            index.save()
+
         # Si on est arrivé jusqu'ici, c'est que tout a bien été sauvegardé
         return ResultSuccess()
 
@@ -124,6 +159,10 @@ class RainbowInstance():
 
         self.loaded = True
 
+        # Les colonnes de métadonnées et l'index inversé des textes bruts seront reconstruits avec les messages chargés
+        self.messages_columns = None
+        self.inverted_indexes = {}
+
         #
         base_path = f"{self.config.base_path_rbi_converted_saved}{self.server_name}/"
 
@@ -165,6 +204,146 @@ class RainbowInstance():
         # Si on est arrivé jusqu'ici, c'est que tout a bien été chargé
         return ResultSuccess()
 
+    #
+    def get_messages_columns(self) -> MessagesColumns:
+        """
+        Renvoie les métadonnées des messages en colonnes, en les construisant si ce n'est pas encore fait.
+
+        Returns:
+            MessagesColumns: Les colonnes de métadonnées des messages
+        """
+
+        #
+        self.messages_columns_mutex.acquire()
+        try:
+            #
+            if self.messages_columns is None:
+                self.messages_columns = MessagesColumns(list(self.messages.values()))
+            #
+            return self.messages_columns
+        finally:
+            self.messages_columns_mutex.release()
+
+    #
+    def get_preprocessed_corpus(self, signature: str) -> PreProcessedCorpus:
+        """
+        Renvoie le corpus des textes pré-traités des messages pour une chaîne de pré-traitement, en le chargeant depuis le dossier de cette instance Rainbow (ou en le créant vide) s'il n'est pas encore chargé.
+
+        Args:
+            signature (str): Signature de la chaîne de pré-traitement
+
+        Returns:
+            PreProcessedCorpus: Le corpus pré-traité
+        """
+
+        #
+        self.preprocessed_corpora_mutex.acquire()
+        try:
+            #
+            if not signature in self.preprocessed_corpora:
+                self.preprocessed_corpora[signature] = PreProcessedCorpus(f"{self.config.base_path_rbi_converted_saved}{self.server_name}/preprocessed/{hash_signature(signature)}/", signature)
+            #
+            return self.preprocessed_corpora[signature]
+        finally:
+            self.preprocessed_corpora_mutex.release()
+
+    #
+    def get_inverted_index(self, signature: Optional[str] = None) -> InvertedIndex:
+        """
+        Renvoie l'index inversé des mots des messages pour une chaîne de pré-traitement, en le créant s'il n'existe pas encore.
+        L'index des textes bruts (signature None) est rempli à sa création avec tous les messages, les autres sont remplis au fur et à mesure des recherches
+        (et avec tous les messages pré-traités de l'instance pour les statistiques de BM25).
+
+        Args:
+            signature (Optional[str], optional): Signature de la chaîne de pré-traitement des textes indexés. Defaults to None.
+
+        Returns:
+            InvertedIndex: L'index inversé
+        """
+
+        #
+        self.inverted_indexes_mutex.acquire()
+        try:
+            #
+            if not signature in self.inverted_indexes:
+                self.inverted_indexes[signature] = InvertedIndex()
+                if signature is None:
+                    self.inverted_indexes[signature].add_documents([(msg_id, msg.content) for msg_id, msg in list(self.messages.items())])
+            #
+            return self.inverted_indexes[signature]
+        finally:
+            self.inverted_indexes_mutex.release()
+
+    #
+    def get_ner_results_cache(self, signature: str) -> NERResultsCache:
+        """
+        Renvoie le cache des entités nommées reconnues dans les messages pour une configuration de moteur de NER, en le chargeant depuis le dossier de cette instance Rainbow (ou en le créant vide) s'il n'est pas encore chargé.
+
+        Args:
+            signature (str): Signature de la configuration du moteur de NER
+
+        Returns:
+            NERResultsCache: Le cache des résultats de NER
+        """
+
+        #
+        self.ner_results_caches_mutex.acquire()
+        try:
+            #
+            if not signature in self.ner_results_caches:
+                self.ner_results_caches[signature] = NERResultsCache(f"{self.config.base_path_rbi_converted_saved}{self.server_name}/ner_results/{hash_signature(signature)}/", signature)
+            #
+            return self.ner_results_caches[signature]
+        finally:
+            self.ner_results_caches_mutex.release()
+
+    #
+    def get_entities_index(self, signature: str) -> EntitiesIndex:
+        """
+        Renvoie l'index inversé des entités nommées des messages pour une configuration de moteur de NER, en le créant vide s'il n'existe pas encore.
+        Il est rempli au fur et à mesure des recherches (depuis le cache des résultats de NER).
+
+        Args:
+            signature (str): Signature de la configuration du moteur de NER
+
+        Returns:
+            EntitiesIndex: L'index des entités
+        """
+
+        #
+        self.entities_indexes_mutex.acquire()
+        try:
+            #
+            if not signature in self.entities_indexes:
+                self.entities_indexes[signature] = EntitiesIndex()
+            #
+            return self.entities_indexes[signature]
+        finally:
+            self.entities_indexes_mutex.release()
+
+    #
+    def get_vector_index(self, index_name: str) -> IVFFlatIndex:
+        """
+        Renvoie l'index de plus proches voisins demandé, en le chargeant depuis le dossier de cette instance Rainbow (ou en le créant vide) s'il n'est pas encore chargé.
+
+        Args:
+            index_name (str): Nom de l'index (modèle d'embedding et pré-traitements appliqués aux messages)
+
+        Returns:
+            IVFFlatIndex: L'index
+        """
+
+        #
+        self.vector_indexes_mutex.acquire()
+        try:
+            #
+            if not index_name in self.vector_indexes:
+                self.vector_indexes[index_name] = IVFFlatIndex(f"{self.config.base_path_rbi_converted_saved}{self.server_name}/vector_indexes/{escapeCharacters(index_name)}/")
+            #
+            return self.vector_indexes[index_name]
+        finally:
+            self.vector_indexes_mutex.release()
+
     #
     def get_first_user_new_usable_id(self) -> str:
         """Renvoie le premier id non utilisé pour créer un nouvel utilisateur
@@ -300,19 +479,47 @@ class RainbowInstance():
             self.bubbles[bubble_id].members_ids.add(author_id)
 
         # On crée le message et on lui ajoute les valeurs
-        self.messages[msg_id] = Message()
-        self.messages[msg_id].id = msg_id
-        self.messages[msg_id].content = msg_content
-        self.messages[msg_id].date = msg_date
-        self.messages[msg_id].author_id = author_id
-        self.messages[msg_id].author_name = author_name
-        self.messages[msg_id].bubble_id = bubble_id
-        self.messages[msg_id].answered_message_id = answered_message_id
+        msg: Message = Message()
+        msg.id = msg_id
+        msg.content = msg_content
+        msg.date = msg_date
+        msg.author_id = author_id
+        msg.author_name = author_name
+        msg.bubble_id = bubble_id
+        msg.answered_message_id = answered_message_id
+
+        # Le message est ajouté sous le mutex des colonnes de métadonnées, pour qu'il ne puisse pas manquer à des colonnes en cours de construction
+        msg_replaced: bool
+        self.messages_columns_mutex.acquire()
+        try:
+            # Un message remplacé rendrait sa ligne des colonnes de métadonnées fausse, on les reconstruira
+            msg_replaced = msg_id in self.messages
+            if msg_replaced:
+                self.messages_columns = None
+            #
+            self.messages[msg_id] = msg
+            # On ajoute sa ligne aux colonnes de métadonnées si elles sont construites
+            if self.messages_columns is not None:
+                self.messages_columns.add_message(msg)
+        finally:
+            self.messages_columns_mutex.release()
 
         # On ajoute ce message à sa bulle et à son utilisateur
         self.bubbles[bubble_id].messages_ids.add(msg_id)
         self.users[author_id].messages_ids.add(msg_id)
 
+        # On l'ajoute aux documents de l'index inversé des textes bruts s'il est construit,
+        #   et un message remplacé n'est plus un document des index des textes pré-traités (il y sera ajouté à nouveau, pré-traité, par la prochaine recherche)
+        for signature, inverted_index in list(self.inverted_indexes.items()):
+            if signature is None:
+                inverted_index.add_documents([(msg_id, msg_content)])
+            elif msg_replaced:
+                inverted_index.remove_document(msg_id)
+
+        # Les index de plus proches voisins chargés ajouteront ce message à leur prochaine mise à jour
+        for index in list(self.vector_indexes.values()):
+            index.mark_pending(msg_content)
+
         # On renvoie que la création du message s'est bien passée
         return True
 
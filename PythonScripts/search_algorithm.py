@@ -5,22 +5,33 @@ Auteur: Nathan Cerisara
 """
 
 from typing import cast, Optional, Any
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 
-from torch import Tensor, float32, eye, zeros
+from torch import Tensor, float32, eye, zeros, from_numpy
 import math
 import os
 import json
 
+import numpy as np
+
 from Levenshtein import distance as levenshtein_distance
 
 from message import MessageSearch, MessagePart, Message
+from rainbow_instance import RainbowInstance
+from vector_index import IVFFlatIndex
+from preprocessed_corpus import PreProcessedCorpus, hash_signature
+from aho_corasick import AhoCorasickAutomaton
+from inverted_index import InvertedIndex
+from entities_index import EntitiesIndex, BAD_ENTITIES
+from levenshtein_engine import LevenshteinEngine
+from windowed_distances import WindowedDistancesMatrix
 from embedding_calculator import EmbeddingCalculator
+from embedding_service import EmbeddingService, DEFAULT_MAX_WAIT_MS, DEFAULT_MAX_BATCH_SIZE
 from language_translation import LanguageTranslation
 from ner_engine import NER_Engine
 from config import Config
 from lib import ConfigError, escapeCharacters, Date
-from lib_embedding import MessageEmbedding, DISTANCES_FUNCTIONS
+from lib_embedding import MessageEmbedding, DISTANCES_FUNCTIONS, calculate_distances_matrix, get_sentence_embedding
 from embeddings_cache import EmbeddingCache
 
 from global_variables import GlobalVariables, init_global_variables, get_global_variables
@@ -139,7 +150,7 @@ def words_levenshtein_distances(txt1: str, txt2: str, close_words_factor: float)
 
         d: Optional[float] = None
         cdw: float
-        for cdw in words_distances:
+        for cdw in word_distances:
             if cdw >= 0:
                 if d is None or cdw < d:
                     d = cdw
@@ -150,10 +161,10 @@ def words_levenshtein_distances(txt1: str, txt2: str, close_words_factor: float)
     # Pour l'instant, on ne va prendre que la somme des distances
     # TODO: Piste d'amélioration?
 
-    return sum(word_distances)
+    return sum(words_distances)
 
 #
-def get_ner_jaccard_vec_base(ner_dicts: list[str]) -> list[str]:
+def get_ner_jaccard_vec_base(ner_dicts: list[str]) -> tuple[list[str], AhoCorasickAutomaton]:
     """
     Calcule la base pour l'espace vectoriel qui sera utilisée pour calculer la distance de jaccard pour les ner
 
@@ -161,80 +172,120 @@ def get_ner_jaccard_vec_base(ner_dicts: list[str]) -> list[str]:
         ner_dicts (list[str]): Liste des dictionnaires qui contient les noms des dictionnaires de NER utilisés.
 
     Returns:
-        list[str]: La liste du nom de toutes les entités nommées des dictionnaires.
+        tuple[list[str], AhoCorasickAutomaton]: La liste (triée) du nom de toutes les entités nommées des dictionnaires, et l'automate qui les recherche.
     """
 
-    # On va récupérer le set de tous les éléments des ner
-    ner_keys_set: set[str] = set()
+    # La base et son automate sont compilés une seule fois par ensemble de dictionnaires (et recompilés si un dictionnaire change)
+    return get_global_variables().get_NER_base(ner_dicts)
 
-    for ner_dict_name in ner_dicts:
-        list_of_ner_keys: list[str] = get_global_variables().get_NER_dict_keys(ner_dict_name)
-        ner_keys_set = ner_keys_set.union(set(list_of_ner_keys))
+#
+def calculate_NER_vector_from_txt_and_dicts(txt: str, ner_dicts: list[str]) -> int:
+    """
+    Calcule un vecteur bag of entity de NER pour le texte demandé et la base des dictionnaires demandés.
 
-    #
-    ner_base: list[str] = list(ner_keys_set)
+    Args:
+        txt (str): Texte avec lequel calculer le vecteur bag of entity de NER
+        ner_dicts (list[str]): Dictionnaires de NER de la base (voir `get_ner_jaccard_vec_base`)
 
-    # Pour s'assurer de toujours avoir le même ordre
-    ner_base.sort()
+    Returns:
+        int: Vecteur bag of entity de NER pour le texte, sous forme de bits (le bit i vaut 1 si le i-ème élément de la base est dans le texte)
+    """
 
-    return ner_base
+    # Les vecteurs sont calculés une seule fois par texte, en un seul passage sur le texte avec l'automate de la base
+    return get_global_variables().get_NER_vectors(ner_dicts, [txt])[0]
 
 #
-def calculate_NER_vector_from_txt_and_dicts(txt: str, ner_base: list[str]) -> set[int]:
+# https://fr.wikipedia.org/wiki/Indice_et_distance_de_Jaccard#:~:text=Similarit%C3%A9%20entre%20des%20ensembles%20binaires%5Bmodifier%20%7C%20modifier%20le%20code%5D
+def jaccard_distance(vec1: int, vec2: int) -> float:
     """
-    Calcule un vecteur bag of entity de NER pour le texte demandé et la base demandée.
+    Calcule la distance de Jaccard entre deux vecteurs de bits.
+    Les éléments absents des deux vecteurs ne comptent pas, l'indice de Jaccard est donc |vec1 ET vec2| / |vec1 OU vec2| (1 si les deux vecteurs sont vides).
 
     Args:
-        txt (str): Texte avec lequel calculer le vecteur bag of entity de NER
-        ner_base (list[str]): _description_
+        vec1 (int): Premier vecteur bag of entity de NER.
+        vec2 (int): Second vecteur bag of entity de NER.
 
     Returns:
-        set[int]: Vecteur bag of entity de NER pour le texte
+        float: La distance de Jaccard entre ces deux vecteurs.
     """
 
     #
-    vec: set[int] = set()
-    for i in range(len(ner_base)):
-        if ner_base[i] in txt:
-            vec.add(i)
-
+    union: int = (vec1 | vec2).bit_count()
+    #
+    if union == 0:
+        return 0.0
     #
-    return vec
+    return 1.0 - float((vec1 & vec2).bit_count()) / float(union)
+
+# Nombre de bits à 1 de chaque octet
+POPCOUNT_TABLE: np.ndarray = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Nombre maximum de mots de 64 bits traités d'un coup pour le calcul de matrices de distances de Jaccard
+JACCARD_MAX_WORDS_PER_STEP: int = 1 << 22
 
 #
-# https://fr.wikipedia.org/wiki/Indice_et_distance_de_Jaccard#:~:text=Similarit%C3%A9%20entre%20des%20ensembles%20binaires%5Bmodifier%20%7C%20modifier%20le%20code%5D
-def jaccard_distance(vec1: set[int], vec2: set[int], ner_base_length: int) -> float:
+def pack_NER_vectors(vectors: list[int], ner_base_length: int) -> np.ndarray:
     """
-    Calcule la distance de Jaccard entre deux vecteurs selon une certaine base.
+    Range des vecteurs de bits dans une matrice de mots de 64 bits.
 
     Args:
-        vec1 (set[int]): Premier vecteur bag of entity de NER.
-        vec2 (set[int]): Second vecteur bag of entity de NER.
-        ner_base_length (int): Dimension de la base de NER dans laquel sont les deux vecteurs.
+        vectors (list[int]): Les vecteurs de bits
+        ner_base_length (int): Dimension de la base de NER
 
     Returns:
-        float: La distance de Jaccard entre ces deux vecteurs.
+        np.ndarray: Matrice (n, nombre de mots) de type uint64
     """
 
     #
-    full_ner: set[int] = set(range(ner_base_length))
-
+    nb_words: int = max(1, (ner_base_length + 63) // 64)
     #
-    vec1_inv: set[int] = full_ner.difference(vec1)
-    vec2_inv: set[int] = full_ner.difference(vec2)
+    return np.frombuffer(b"".join(v.to_bytes(8 * nb_words, "little") for v in vectors), dtype="<u8").reshape(len(vectors), nb_words)
+
+#
+def popcount_rows(packed: np.ndarray) -> np.ndarray:
+    """
+    Compte les bits à 1 de chaque vecteur (sur la dernière dimension).
+
+    Args:
+        packed (np.ndarray): Vecteurs de mots de 64 bits (..., nombre de mots)
+
+    Returns:
+        np.ndarray: Nombre de bits à 1 de chaque vecteur (...)
+    """
 
     #
-    m11: int = len(vec1.intersection(vec2))
-    m00: int = len(vec1_inv.intersection(vec2_inv))
+    return POPCOUNT_TABLE[np.ascontiguousarray(packed).view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+#
+def matrix_jaccard_distances(packed1: np.ndarray, packed2: np.ndarray) -> np.ndarray:
+    """
+    Calcule les distances de Jaccard entre tous les couples de vecteurs de deux matrices de vecteurs de bits, avec des ET et des comptages de bits vectorisés.
+
+    Args:
+        packed1 (np.ndarray): Premiers vecteurs (n1, nombre de mots)
+        packed2 (np.ndarray): Seconds vecteurs (n2, nombre de mots)
+
+    Returns:
+        np.ndarray: Matrice (n1, n2) des distances de Jaccard
+    """
 
-    jaccard_indice: float = 0.0
+    #
+    n1: int = packed1.shape[0]
+    n2: int = packed2.shape[0]
+    #
+    counts1: np.ndarray = popcount_rows(packed1)
+    counts2: np.ndarray = popcount_rows(packed2)
 
-    if m00 == ner_base_length:
-        jaccard_indice = 1.0
-    else:
-        jaccard_indice = float(m11) / (float(ner_base_length) - float(m00))
+    # Intersections, par paquets de lignes pour limiter la mémoire
+    intersections: np.ndarray = np.zeros((n1, n2), dtype=np.int64)
+    step: int = max(1, JACCARD_MAX_WORDS_PER_STEP // max(1, n2 * packed2.shape[1]))
+    for i in range(0, n1, step):
+        intersections[i:i+step] = popcount_rows(packed1[i:i+step, None, :] & packed2[None, :, :])
 
-    return 1.0 - jaccard_indice
+    #
+    unions: np.ndarray = counts1[:, None] + counts2[None, :] - intersections
+    #
+    return 1.0 - np.where(unions == 0, 1.0, intersections / np.maximum(unions, 1))
 
 #
 def real_minutes_time_distances(msg1: Message, msg2: Message) -> float:
@@ -259,7 +310,6 @@ def time_distance(msg1: Message, msg2: Message) -> float:
     return math.exp( math.atan( (dm / 10.0) - 5.0 ) ) - math.exp( math.atan( -5.0 ) )
 
 #
-BAD_ENTITIES: set[str] = set(["", " ", "\n"])
 def calc_common_entities(ents_1: list[ tuple[ int, str, str] ], ents_2: list[ tuple[ int, str, str ] ]) -> float:
     """Calcule le score de similarité entre deux listes d'entités
 
@@ -279,12 +329,12 @@ def calc_common_entities(ents_1: list[ tuple[ int, str, str] ], ents_2: list[ tu
     ent_2: tuple[int, str, str]
     for ent_1 in ents_1:
         #
-        if ent_1 in BAD_ENTITIES:
+        if ent_1[1] in BAD_ENTITIES:
             continue
         #
         for ent_2 in ents_2:
             #
-            if ent_2 in BAD_ENTITIES:
+            if ent_2[1] in BAD_ENTITIES:
                 continue
             #
             if ent_1[1] == ent_2[1]:
@@ -330,28 +380,57 @@ class SearchAlgorithm():
         if "NER_text_replacement" in config_algo and int(config_algo["NER_text_replacement"]) > 0:
             self.NER_text_replacement = True
 
+        # Dossier des dictionnaires de NER, pour la signature de la chaîne de pré-traitement
+        self.ner_dicts_dir: str = conf.ner_dicts_dir
+
         # Profiling 1
         # profiling_last_task_ends()
 
     #
-    def pre_process_search_messages(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str]) -> tuple[str, list[MessageSearch]]:
+    def get_pre_processing_signature(self, ner_dicts: list[str]) -> Optional[str]:
         """
-        Couche de pré-traitement nécessaire avant d'effectuer la recherche avec l'algorithme de recherche.
+        Signature de la chaîne de pré-traitement des messages de cet algorithme : deux algorithmes de même signature pré-traitent les messages de la même façon.
+        Les dates de modification des dictionnaires de NER en font partie, pour ne pas réutiliser des textes pré-traités avec une ancienne version d'un dictionnaire.
 
         Args:
-            search_input (str): Texte de la recherche
-            lst_msgs (list[MessageSearch]): Liste des messages à comparer avec la recherche
+            ner_dicts (list[str]): Dictionnaires de NER de la recherche
 
         Returns:
-            tuple[str, list[MessageSearch]]: Le texte de la recherche pré-traité et la liste des messages pré-traités.
+            Optional[str]: La signature, ou None si cet algorithme ne pré-traite pas les messages
+        """
+
+        #
+        if self.translate_before is None and not (self.NER_text_replacement and len(ner_dicts) > 0):
+            return None
+
+        #
+        signature: str = f"translate_before={self.translate_before}|translation_method={self.translation_method}"
+        #
+        if self.NER_text_replacement:
+            for ner_dict_name in ner_dicts:
+                file_path: str = f"{self.ner_dicts_dir}{ner_dict_name}.json"
+                signature += f"|ner_dict={ner_dict_name}@{os.path.getmtime(file_path) if os.path.exists(file_path) else 0}"
+        #
+        return signature
+
+    #
+    def pre_process_texts(self, txts: list[str], ner_dicts: list[str]) -> list[str]:
+        """
+        Applique la chaîne de pré-traitement (remplacements NER, puis traduction) à des textes de messages.
+
+        Args:
+            txts (list[str]): Textes à pré-traiter
+            ner_dicts (list[str]): Dictionnaires de NER de la recherche
+
+        Returns:
+            list[str]: Les textes pré-traités, dans l'ordre
         """
 
         # Profiling 1 - start
-        # profiling_task_start(f"pre_process_search_msgs_|_{search_input}_|_{len(lst_msgs)}")
+        # profiling_task_start(f"pre_process_texts_|_{len(txts)}")
 
         # Préparation au pré-processing
-        pre_processed_search_input: str = search_input
-        pre_processed_lst_msgs: list[MessageSearch] = lst_msgs
+        pre_processed_txts: list[str] = list(txts)
 
         # définition d'une variable qui sera utilisée pleins de fois
         id_msg: int
@@ -361,121 +440,138 @@ class SearchAlgorithm():
         if self.NER_text_replacement:
 
             # Profiling 2 - start
-            # profiling_task_start(f"ner_replacements_|_{search_input}_|_{len(lst_msgs)}")
+            # profiling_task_start(f"ner_replacements_|_{len(txts)}")
 
             # On parcours chaque dictionnaire de NER | ordre de grandeur : 1 ~ 5
             for ner_dict_name in ner_dicts:
 
-                # On récupère le dico
-                ner_dict: dict[str, str] = get_global_variables().get_NER_dict(ner_dict_name)
+                # On récupère l'automate des clés du dico, et leurs remplacements
+                ner_automaton: AhoCorasickAutomaton
+                ner_replacements: list[str]
+                ner_automaton, ner_replacements = get_global_variables().get_NER_automaton(ner_dict_name)
 
                 # On parcours chaque message des messages à traiter | ordre de grandeur : 10~100000 (max du max, bien moins en moyenne)
-                for id_msg in range(len(pre_processed_lst_msgs)):
-
-                    # On parcours chaque clé dans le dictionnaire de NER | ordre de grandeur : 1~100
-                    nk: str
-                    for nk in ner_dict:
-
-                        # On remplace s'il y a une ou plus occurences dedans
-                        if nk in pre_processed_lst_msgs[id_msg].content:
-                            pre_processed_lst_msgs[id_msg].content = pre_processed_lst_msgs[id_msg].content.replace(nk, ner_dict[nk])
+                #   toutes les clés du dictionnaire sont cherchées et remplacées en un seul passage sur le message
+                for id_msg in range(len(pre_processed_txts)):
+                    pre_processed_txts[id_msg] = ner_automaton.replace(pre_processed_txts[id_msg], ner_replacements)
 
             # Profiling 2 - end
             # profiling_last_task_ends()
 
-        # Traduction avant de traduire les messages
+        # Traduction des messages
         if self.translate_before is not None:
 
             # Profiling 2 - start
-            # profiling_task_start(f"translation_|_{search_input}_|_{len(lst_msgs)}")
+            # profiling_task_start(f"translation_|_{len(txts)}")
 
-            # On s'occupe de la recherche
-            pre_processed_search_input = get_global_variables().translate(search_input)
-
-            # On s'occupe des messages à traiter
-            msg: MessageSearch
-            for id_msg in range(len(lst_msgs)):
-                msg = lst_msgs[id_msg]
-                pre_processed_lst_msgs[id_msg].content = get_global_variables().translate(msg.content)
+            # Tous les textes sont traduits d'un coup, groupés par langue
+            pre_processed_txts = get_global_variables().translate_many(pre_processed_txts)
 
             # Profiling 2 - end
             # profiling_last_task_ends()
 
         # Profiling 1 - end
-        # profiling_last_task_ends(f"search_input = {search_input}, len(lst_msgs)={len(lst_msgs)}")
+        # profiling_last_task_ends()
 
         #
-        return pre_processed_search_input, pre_processed_lst_msgs
+        return pre_processed_txts
 
     #
-    def pre_process_base_messages(self, lst_msgs: list[Message], ner_dicts: list[str]) -> list[Message]:
+    def get_pre_processed_texts(self, txts: list[str], ner_dicts: list[str], rbi: Optional[RainbowInstance] = None) -> list[str]:
         """
-        Couche de pré-traitement pour les messages.
+        Renvoie les textes pré-traités de messages.
+        Si l'instance Rainbow est donnée, on utilise son corpus pré-traité pour cette chaîne de pré-traitement : seuls les textes qui n'y sont pas encore sont pré-traités, puis ajoutés au corpus.
 
         Args:
-            lst_msgs (list[Message]): Liste des messages à pré-traiter.
+            txts (list[str]): Textes à pré-traiter
+            ner_dicts (list[str]): Dictionnaires de NER de la recherche
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages. Defaults to None.
 
         Returns:
-            list[Message]: Liste des messages pré-traités.
+            list[str]: Les textes pré-traités, dans l'ordre
         """
 
-        # Cas de la liste vide, comme ça, par la suite, on sait que la liste n'est pas vide.
-        if len(lst_msgs) == 0:
-            return []
+        #
+        signature: Optional[str] = self.get_pre_processing_signature(ner_dicts)
+        #
+        if signature is None:
+            return txts
+        #
+        if rbi is None:
+            return self.pre_process_texts(txts, ner_dicts)
 
-        # Profiling 1 - start
-        # profiling_task_start(f"pre_process_msgs_|_{escapeCharacters(lst_msgs[0].content)}_|_{len(lst_msgs)}")
+        #
+        corpus: PreProcessedCorpus = rbi.get_preprocessed_corpus(signature)
 
-        # Préparation au pré-processing
-        pre_processed_lst_msgs: list[Message] = [m.new_msg_copy() for m in lst_msgs]
+        # On ne pré-traite que les textes jamais vus avec cette chaîne de pré-traitement
+        missing_txts: list[str] = list(dict.fromkeys(txt for txt in txts if not corpus.has(txt)))
+        if len(missing_txts) > 0:
+            corpus.add(missing_txts, self.pre_process_texts(missing_txts, ner_dicts))
 
-        # définition d'une variable qui sera utilisée pleins de fois
-        id_msg: int
+        #
+        return [corpus.get(txt) for txt in txts]
 
-        # On s'occupe du NER text replacement
-        # TODO: pour l'instant, on remplace systématiquement, faire une détection de si on remplace ou pas
-        if self.NER_text_replacement:
+    #
+    def pre_process_search_messages(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str], rbi: Optional[RainbowInstance] = None) -> tuple[str, list[MessageSearch]]:
+        """
+        Couche de pré-traitement nécessaire avant d'effectuer la recherche avec l'algorithme de recherche.
+        Les messages donnés ne sont pas modifiés, les messages pré-traités sont des copies.
 
-            # Profiling 2 - start
-            # profiling_task_start(f"ner_replacements_|_{escapeCharacters(lst_msgs[0].content)}_|_{len(lst_msgs)}")
+        Args:
+            search_input (str): Texte de la recherche
+            lst_msgs (list[MessageSearch]): Liste des messages à comparer avec la recherche
+            ner_dicts (list[str]): Dictionnaires de NER de la recherche
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages, pour utiliser son corpus pré-traité. Defaults to None.
 
-            # On parcours chaque dictionnaire de NER | ordre de grandeur : 1 ~ 10
-            for ner_dict_name in ner_dicts:
+        Returns:
+            tuple[str, list[MessageSearch]]: Le texte de la recherche pré-traité et la liste des messages pré-traités.
+        """
 
-                # On récupère le dico
-                ner_dict: dict[str, str] = get_global_variables().get_NER_dict(ner_dict_name)
+        # Rien à faire si cet algorithme ne pré-traite pas les messages
+        if self.get_pre_processing_signature(ner_dicts) is None:
+            return search_input, lst_msgs
 
-                # On parcours chaque message des messages à traiter | ordre de grandeur : 10~100000 (100000=max du max, bien bien moins en moyenne)
-                for id_msg in range(len(pre_processed_lst_msgs)):
+        # Profiling 1 - start
+        # profiling_task_start(f"pre_process_search_msgs_|_{search_input}_|_{len(lst_msgs)}")
 
-                    # On parcours chaque clé dans le dictionnaire de NER | ordre de grandeur : 1~1000
-                    nk: str
-                    for nk in ner_dict:
+        # La recherche n'est pas dans le corpus, elle est toujours traduite
+        pre_processed_search_input: str = search_input
+        if self.translate_before is not None:
+            pre_processed_search_input = get_global_variables().translate(search_input)
 
-                        # On remplace s'il y a une ou plus occurences dedans
-                        if nk in pre_processed_lst_msgs[id_msg].content:
-                            pre_processed_lst_msgs[id_msg].content = pre_processed_lst_msgs[id_msg].content.replace(nk, ner_dict[nk])
+        # Les messages
+        pre_processed_txts: list[str] = self.get_pre_processed_texts([m.content for m in lst_msgs], ner_dicts, rbi)
+        pre_processed_lst_msgs: list[MessageSearch] = [replace(msg, content=txt) for msg, txt in zip(lst_msgs, pre_processed_txts)]
 
-            # Profiling 2 - end
-            # profiling_last_task_ends()
+        # Profiling 1 - end
+        # profiling_last_task_ends(f"search_input = {search_input}, len(lst_msgs)={len(lst_msgs)}")
 
-        # Traduction avant de traduire les messages
-        if self.translate_before is not None:
+        #
+        return pre_processed_search_input, pre_processed_lst_msgs
 
-            # Profiling 2 - start
-            # profiling_task_start(f"translation_|_{escapeCharacters(lst_msgs[0].content)}_|_{len(lst_msgs)}")
+    #
+    def pre_process_base_messages(self, lst_msgs: list[Message], ner_dicts: list[str]) -> list[Message]:
+        """
+        Couche de pré-traitement pour les messages.
 
-            # On s'occupe des messages à traiter
-            msg: Message
-            for id_msg in range(len(lst_msgs)):
-                msg = lst_msgs[id_msg]
-                pre_processed_lst_msgs[id_msg].content = get_global_variables().translate(msg.content)
+        Args:
+            lst_msgs (list[Message]): Liste des messages à pré-traiter.
 
-            # Profiling 2 - end
-            # profiling_last_task_ends()
+        Returns:
+            list[Message]: Liste des messages pré-traités.
+        """
 
-        # Profiling 1 - end
-        # profiling_last_task_ends(f"slen(lst_msgs)={len(lst_msgs)}")
+        # Cas de la liste vide, comme ça, par la suite, on sait que la liste n'est pas vide.
+        if len(lst_msgs) == 0:
+            return []
+
+        # Préparation au pré-processing
+        pre_processed_lst_msgs: list[Message] = [m.new_msg_copy() for m in lst_msgs]
+
+        # Même chaîne de pré-traitement (remplacements NER, puis traduction) que pour les recherches
+        pre_processed_txts: list[str] = self.pre_process_texts([m.content for m in lst_msgs], ner_dicts)
+        for msg, txt in zip(pre_processed_lst_msgs, pre_processed_txts):
+            msg.content = txt
 
         #
         return pre_processed_lst_msgs
@@ -500,6 +596,42 @@ class SearchAlgorithm():
 
         return matrix_distances
 
+    #
+    def get_windowed_distances_from_messages_main(self, lst_msgs: list[Message], windows: WindowedDistancesMatrix, ner_dicts: list[str] = []) -> np.ndarray:
+        """
+        Calcule les distances entre chaque message et les messages de sa fenêtre avec cet algorithme.
+        Par défaut, les lignes sont traitées par blocs : pour chaque bloc, on calcule la matrice dense des messages couverts par les fenêtres du bloc,
+        ce qui ne demande que O(n * taille des fenêtres) distances au lieu de O(n²).
+
+        Args:
+            lst_msgs (list[Message]): La liste des messages.
+            windows (WindowedDistancesMatrix): Les fenêtres de chaque message.
+
+        Returns:
+            np.ndarray: Les distances, dans l'ordre des coefficients de `windows.data`.
+        """
+
+        #
+        data: np.ndarray = np.zeros(windows.nnz(), dtype=np.float32)
+        block_size: int = max(1, windows.max_width())
+
+        #
+        for block_start in range(0, windows.n, block_size):
+            #
+            block_end: int = min(windows.n, block_start + block_size)
+            cols_start: int = int(windows.starts[block_start:block_end].min())
+            cols_end: int = int(windows.ends[block_start:block_end].max())
+
+            # Matrice dense des messages couverts par les fenêtres du bloc
+            block_distances: np.ndarray = self.get_matrix_distances_from_messages_main(lst_msgs[cols_start:cols_end], ner_dicts).numpy()
+
+            #
+            for i in range(block_start, block_end):
+                data[windows.indptr[i]:windows.indptr[i+1]] = block_distances[i - cols_start, windows.starts[i] - cols_start:windows.ends[i] - cols_start]
+
+        #
+        return data
+
     #
     def get_linear_distances_from_messages_main(self, lst_msgs: list[Message], ner_dicts: list[str] = []) -> list[float]:
         """
@@ -519,12 +651,13 @@ class SearchAlgorithm():
         return [0.0] * n
 
     #
-    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str]) -> list[float]:
+    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str], rbi: Optional[RainbowInstance] = None) -> list[float]:
         """Abstraction de la fonction principale d'un algorithme de recherche: la recherche
 
         Args:
             search_input (str): Texte de la recherche
             lst_msgs (list[MessageSearch]): Liste de messages à comparer avec la recherche
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages. Defaults to None.
 
         Returns:
             list[float]: Liste des scores correspondant à cette liste initiale de messages, dans l'ordre
@@ -564,6 +697,20 @@ class SimpleEmbedding_SearchAlgorithm(SearchAlgorithm):
         if "distance_function" in algo_config:
             self.distance_function = algo_config["distance_function"]
 
+        # Regroupement des calculs d'embeddings avec ceux des autres threads (voir EmbeddingService)
+        self.micro_batch_max_wait_ms: float = DEFAULT_MAX_WAIT_MS
+        if "micro_batch_max_wait_ms" in algo_config:
+            self.micro_batch_max_wait_ms = float(algo_config["micro_batch_max_wait_ms"])
+        #
+        self.micro_batch_max_size: int = max(self.batch_size, DEFAULT_MAX_BATCH_SIZE)
+        if "micro_batch_max_size" in algo_config:
+            self.micro_batch_max_size = int(algo_config["micro_batch_max_size"])
+
+        # Les embeddings non compacts (avec les états de chaque token) sont dans un cache séparé
+        self.embedding_cache_name: str = self.algo_dict["model_name"]
+        if not self.embedding_calculator.compact_embeddings:
+            self.embedding_cache_name = f"{self.algo_dict['model_name']}/tokens_states"
+
     #
     def calculate_embeddings_of_msgs_list(self, lst_msgs_to_process: list[str]) -> list[MessageEmbedding]:
 
@@ -574,177 +721,124 @@ class SimpleEmbedding_SearchAlgorithm(SearchAlgorithm):
         # 0 = search input, else it is the lst_msgs in order
         embeddings: list[Optional[MessageEmbedding]] = [None] * tot_length
 
-        # pré-définition d'une variable qui sera utilisée des deux côtés de la condition
-        embedding_cached: Optional[MessageEmbedding]
-
-        # Dans le cas où il n'y a pas de batchs
-        if self.batch_size == 1:
-
-            for i in range(tot_length):
+        # Les messages qui ne sont pas dans le cache, avec les indices où ils apparaissent (un même texte n'est calculé qu'une fois)
+        cache_misses: dict[str, list[int]] = {}
 
-                # Profiling 1 - start
-                # profiling_task_start(f"testing_cache_[{self.algo_dict['model_name']}]_nb_|_{lst_msgs_to_process[i]}")
-
-                embedding_cached = get_global_variables().get_embedding_cache(self.algo_dict["model_name"], lst_msgs_to_process[i])
+        #
+        embedding_cached: Optional[MessageEmbedding]
+        for i in range(tot_length):
 
-                # Profiling 1 - end
-                # profiling_last_task_ends()
+            # Profiling 1 - start
+            # profiling_task_start(f"testing_cache_[{self.algo_dict['model_name']}]_nb_|_{lst_msgs_to_process[i]}")
 
-                if embedding_cached is not None:
-                    embeddings[i] = embedding_cached
+            # Si l'embedding est directement dans le cache, on le récupère directement
+            embedding_cached = get_global_variables().get_embedding_cache(self.embedding_cache_name, lst_msgs_to_process[i])
 
-                else:
+            # Profiling 1 - end
+            # profiling_last_task_ends()
 
-                    # Profiling 1 - start
-                    # profiling_task_start(f"calculate_embedding_[{self.algo_dict['model_name']}]_nb_|_{lst_msgs_to_process[i]}")
+            if embedding_cached is not None:
+                embeddings[i] = embedding_cached
+            # Sinon, on le garde de côté pour le calculer
+            elif lst_msgs_to_process[i] in cache_misses:
+                cache_misses[lst_msgs_to_process[i]].append(i)
+            else:
+                cache_misses[lst_msgs_to_process[i]] = [i]
 
-                    embeddings[i] = self.embedding_calculator.get_embeddings([lst_msgs_to_process[i]])[0]
-                    #
-                    if embeddings[i] is None:
-                        raise UserWarning("Error, embeddings is None")
-                    #
-                    get_global_variables().set_embedding_cache(self.algo_dict["model_name"],lst_msgs_to_process[i], cast(MessageEmbedding, embeddings[i]))
+        # Si tout était dans le cache, pas besoin d'aller plus loin
+        if len(cache_misses) == 0:
+            return cast(list[MessageEmbedding], embeddings)
 
-                    # Profiling 1 - end
-                    # profiling_last_task_ends()
+        # Profiling 1 - start
+        # profiling_task_start(f"calculate_embeddings_batchs_[{self.algo_dict['model_name']}]_|_{len(cache_misses)}")
 
-        else:
-            # On va devoir découper par batchs
+        # On calcule les messages manquants avec le service partagé du modèle, qui les regroupe avec les demandes des autres threads
+        #   par batchs de messages de longueurs proches
+        txts_to_calculate: list[str] = list(cache_misses.keys())
+        embedding_service: EmbeddingService = get_global_variables().get_embedding_service(self.embedding_calculator, self.micro_batch_max_wait_ms, self.micro_batch_max_size)
+        calculated_embeddings: list[MessageEmbedding] = embedding_service.get_embeddings(txts_to_calculate)
 
-            # Batch
-            batch: list[str] = []
-            # Index du résultat à placer dans le tableau embeddings
-            batch_embeddings_ids: list[int] = []
+        # Profiling 1 - end
+        # profiling_last_task_ends()
 
+        # On restitue les résultats, et on les rajoute aussi au cache
+        for txt, me in zip(txts_to_calculate, calculated_embeddings):
             #
-            batch_embeddings: list[MessageEmbedding]
-
-            # Index pour savoir où est-ce qu'on en est
-            id_msg_batch: int = -1
-
-            while id_msg_batch+1 < tot_length:
-                id_msg_batch += 1
-
-                # Profiling 1 - start
-                # profiling_task_start(f"testing_cache_[{self.algo_dict['model_name']}]_b_{id_msg_batch}_|_{lst_msgs_to_process[id_msg_batch]}")
-
-                # Si l'embedding est directement dans le cache, on le récupère directement
-                embedding_cached = get_global_variables().get_embedding_cache(self.algo_dict["model_name"], lst_msgs_to_process[id_msg_batch])
-
-                # Profiling 1 - end
-                # profiling_last_task_ends()
-
-                if embedding_cached is not None:
-                    embeddings[id_msg_batch] = embedding_cached
-                    continue
-
-                # Sinon, on le rajoute dans le batch
-                batch.append(lst_msgs_to_process[id_msg_batch])
-                batch_embeddings_ids.append(id_msg_batch)
-
-                # On teste s'il faut calculer le batch
-                if len(batch) >= self.batch_size:
-
-                    # Profiling 1 - start
-                    # profiling_task_start(f"calculate_embeddings_batch_[{self.algo_dict['model_name']}]_|_{len(batch)}_|_{batch[0]}")
-
-                    # On calcule le batch
-                    batch_embeddings = self.embedding_calculator.get_embeddings(batch)
-
-                    # Profiling 1 - end
-                    # profiling_last_task_ends()
-
-                    # Profiling 1 - start
-                    # profiling_task_start(f"saving_batch_embeddings_[{self.algo_dict['model_name']}]_|_{len(batch)}_|_{batch[0]}")
-
-                    # On restitue les résultats
-                    id_bes: int
-                    for id_bes in range(len(batch_embeddings_ids)):
-
-                        # Profiling 2 - start
-                        # profiling_task_start(f"saving_1_embedding_[{self.algo_dict['model_name']}]_|_{lst_msgs_to_process[batch_embeddings_ids[id_bes]]}")
-
-                        #
-                        embeddings[batch_embeddings_ids[id_bes]] = batch_embeddings[id_bes]
-                        # On rajoute aussi le résultat au cache
-                        get_global_variables().set_embedding_cache(self.algo_dict["model_name"],lst_msgs_to_process[batch_embeddings_ids[id_bes]], batch_embeddings[id_bes])
-
-                        # Profiling 2 - end
-                        # profiling_last_task_ends()
-
-                    # Profiling 1 - end
-                    # profiling_last_task_ends()
-
-            # Si le batch n'est pas vide
-            if len(batch) > 0:
-
-                # Profiling 1 - start
-                # profiling_task_start(f"calculate_embedding_batch_[{self.algo_dict['model_name']}]_|_{len(batch)}_|_{batch[0]}")
-
-                # On calcule le batch
-                batch_embeddings = self.embedding_calculator.get_embeddings(batch)
-
-                # Profiling 1 - end
-                # profiling_last_task_ends()
-
-                # Profiling 1 - start
-                # profiling_task_start(f"saving_batch_embeddings_[{self.algo_dict['model_name']}]_|_{len(batch)}_|_{batch[0]}")
+            if me is None:
+                raise UserWarning("Error, embeddings is None")
+            #
+            for i in cache_misses[txt]:
+                embeddings[i] = me
+            #
+            get_global_variables().set_embedding_cache(self.embedding_cache_name, txt, me)
 
-                # On restitue les résultats
-                for id_bes in range(len(batch_embeddings_ids)):
+        # On renvoie le résultat
+        return cast(list[MessageEmbedding], embeddings)
 
-                    # Profiling 2 - start
-                    # profiling_task_start(f"saving_1_embedding_[{self.algo_dict['model_name']}]_|_{lst_msgs_to_process[batch_embeddings_ids[id_bes]]}")
+    #
+    def get_matrix_distances_from_messages_main(self, lst_msgs: list[Message], ner_dicts: list[str] = []) -> Tensor:
+        """
+        Calcule la matrice des distances entre chaque messages avec cet algorithme.
 
-                    embeddings[batch_embeddings_ids[id_bes]] = batch_embeddings[id_bes]
-                    get_global_variables().set_embedding_cache(self.algo_dict["model_name"],lst_msgs_to_process[batch_embeddings_ids[id_bes]], batch_embeddings[id_bes])
+        Args:
+            lst_msgs (list[Message]): La liste des messages.
 
-                    # Profiling 2 - end
-                    # profiling_last_task_ends()
+        Returns:
+            Tensor: La matrice des distances entre chaque messages. De dimensions (n, n).
+        """
 
-                # Profiling 1 - end
-                # profiling_last_task_ends()
+        # On pré-traite les messages
+        pre_processed_lst_msgs: list[Message] = self.pre_process_base_messages(lst_msgs, ner_dicts)
 
-        # Profiling 1
-        # profiling_task_start(f"saving_embeding_cache_|_{lst_msgs_to_process[0]}_|_{len(lst_msgs_to_process)}")
+        # On va calculer une liste des embeddings des messages
+        embeddings: list[MessageEmbedding] = self.calculate_embeddings_of_msgs_list([m.content for m in pre_processed_lst_msgs])
 
-        # Profiling 1 - end
-        # profiling_last_task_ends()
+        # On calcule les distances pour chaque couple de messages, en une seule opération matricielle (n x n)
+        matrix_distances: Tensor = calculate_distances_matrix(self.distance_function, embeddings, embeddings, self.algo_dict)
 
         # On renvoie le résultat
-        return embeddings
+        return matrix_distances
 
     #
-    def get_matrix_distances_from_messages_main(self, lst_msgs: list[Message], ner_dicts: list[str] = []) -> Tensor:
+    def get_windowed_distances_from_messages_main(self, lst_msgs: list[Message], windows: WindowedDistancesMatrix, ner_dicts: list[str] = []) -> np.ndarray:
         """
-        Calcule la matrice des distances entre chaque messages avec cet algorithme.
+        Calcule les distances entre chaque message et les messages de sa fenêtre avec cet algorithme.
+        Les embeddings ne sont calculés qu'une seule fois, puis les distances sont calculées par blocs de lignes.
 
         Args:
             lst_msgs (list[Message]): La liste des messages.
+            windows (WindowedDistancesMatrix): Les fenêtres de chaque message.
 
         Returns:
-            Tensor: La matrice des distances entre chaque messages. De dimensions (n, n).
+            np.ndarray: Les distances, dans l'ordre des coefficients de `windows.data`.
         """
 
         # On pré-traite les messages
         pre_processed_lst_msgs: list[Message] = self.pre_process_base_messages(lst_msgs, ner_dicts)
 
-        # Nombre de messages pour les lignes et les colonnes de la matrice
-        n: int = len(lst_msgs)
-
         # On va calculer une liste des embeddings des messages
-        embeddings: list[Optional[MessageEmbedding]] = self.calculate_embeddings_of_msgs_list([m.content for m in pre_processed_lst_msgs])
+        embeddings: list[MessageEmbedding] = self.calculate_embeddings_of_msgs_list([m.content for m in pre_processed_lst_msgs])
 
-        # On initialise la matrice
-        matrix_distances: Tensor = zeros((n, n), dtype=float32)
+        #
+        data: np.ndarray = np.zeros(windows.nnz(), dtype=np.float32)
+        block_size: int = max(1, windows.max_width())
 
-        # On calcule les distances pour chaque couple de messages
-        for id_msg1 in range(n):
-            for id_msg2 in range(n):
-                matrix_distances[id_msg1, id_msg2] = DISTANCES_FUNCTIONS[self.distance_function](cast(MessageEmbedding, embeddings[id_msg1]), cast(MessageEmbedding, embeddings[id_msg2]), self.algo_dict)
+        #
+        for block_start in range(0, windows.n, block_size):
+            #
+            block_end: int = min(windows.n, block_start + block_size)
+            cols_start: int = int(windows.starts[block_start:block_end].min())
+            cols_end: int = int(windows.ends[block_start:block_end].max())
 
-        # On renvoie le résultat
-        return matrix_distances
+            # Distances des messages du bloc aux messages couverts par leurs fenêtres, en une seule opération matricielle
+            block_distances: np.ndarray = calculate_distances_matrix(self.distance_function, embeddings[block_start:block_end], embeddings[cols_start:cols_end], self.algo_dict).numpy()
+
+            #
+            for i in range(block_start, block_end):
+                data[windows.indptr[i]:windows.indptr[i+1]] = block_distances[i - block_start, windows.starts[i] - cols_start:windows.ends[i] - cols_start]
+
+        #
+        return data
 
     #
     def get_linear_distances_from_messages_main(self, lst_msgs: list[Message], ner_dicts: list[str] = []) -> list[float]:
@@ -778,13 +872,14 @@ class SimpleEmbedding_SearchAlgorithm(SearchAlgorithm):
         return res
 
     #
-    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str]) -> list[float]:
+    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str], rbi: Optional[RainbowInstance] = None) -> list[float]:
         """
         Recherche embedding simple: calcule des embeddings par batchs, puis compare les embeddings de chaque message à celui de la recherche
 
         Args:
             search_input (str): Texte de la recherche
             lst_msgs (list[MessageSearch]): Liste de messages à comparer avec la recherche
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages. Defaults to None.
 
         Returns:
             list[float]: Liste des scores de distance correspondant à cette liste initiale de messages, dans l'ordre
@@ -796,7 +891,7 @@ class SimpleEmbedding_SearchAlgorithm(SearchAlgorithm):
         # Préparation au pré-processing
         pre_processed_search_input: str
         pre_processed_lst_msgs: list[MessageSearch]
-        pre_processed_search_input, pre_processed_lst_msgs = self.pre_process_search_messages(search_input, lst_msgs, ner_dicts)
+        pre_processed_search_input, pre_processed_lst_msgs = self.pre_process_search_messages(search_input, lst_msgs, ner_dicts, rbi)
 
         #
         lst_msgs_to_process: list[str] = [pre_processed_search_input] + [m.content for m in pre_processed_lst_msgs]
@@ -806,12 +901,8 @@ class SimpleEmbedding_SearchAlgorithm(SearchAlgorithm):
         # Profiling 1 - start
         # profiling_task_start(f"calculating_distances_of_embeddings_[{self.distance_function}]_|_{search_input}_|_{len(lst_msgs)}_|_{lst_msgs[0]}")
 
-        # On renvoie ensuite la distance de l'embedding de recherche avec tous les autres
-        res: list[float] = [
-            DISTANCES_FUNCTIONS[self.distance_function](cast(MessageEmbedding, embeddings[0]), cast(MessageEmbedding, embeddings[i]), self.algo_dict)
-
-            for i in range(1, len(pre_processed_lst_msgs)+1)
-        ]
+        # On renvoie ensuite la distance de l'embedding de recherche avec tous les autres, en une seule opération matricielle (1 x n)
+        res: list[float] = calculate_distances_matrix(self.distance_function, embeddings[:1], embeddings[1:], self.algo_dict)[0].tolist()
 
         # Profiling 1 - end
         # profiling_last_task_ends()
@@ -821,6 +912,96 @@ class SimpleEmbedding_SearchAlgorithm(SearchAlgorithm):
 
         return res
 
+    #
+    def get_vector_index_name(self, ner_dicts: list[str]) -> str:
+        """
+        Nom de l'index de plus proches voisins de cet algorithme : les vecteurs dépendent du modèle, et des pré-traitements appliqués aux messages.
+
+        Args:
+            ner_dicts (list[str]): Dictionnaires de NER de la recherche
+
+        Returns:
+            str: Le nom de l'index
+        """
+
+        #
+        index_name: str = self.embedding_cache_name
+        # Même chaîne de pré-traitement que le corpus pré-traité des messages
+        signature: Optional[str] = self.get_pre_processing_signature(ner_dicts)
+        if signature is not None:
+            index_name += f"|{hash_signature(signature)}"
+        #
+        return index_name
+
+    #
+    def update_vector_index(self, rbi: RainbowInstance, index: IVFFlatIndex, keys: list[str], ner_dicts: list[str]) -> None:
+        """
+        Ajoute à l'index les messages qui n'y sont pas encore (ceux demandés, et ceux ajoutés à l'instance Rainbow depuis la dernière mise à jour).
+
+        Args:
+            rbi (RainbowInstance): L'instance Rainbow de l'index
+            index (IVFFlatIndex): L'index à mettre à jour
+            keys (list[str]): Contenus des messages qui doivent être dans l'index
+            ner_dicts (list[str]): Dictionnaires de NER de la recherche
+        """
+
+        #
+        missing_keys: list[str] = list(dict.fromkeys([key for key in keys if not index.has(key)] + list(index.pending_keys)))
+        #
+        if len(missing_keys) == 0:
+            return
+
+        # Profiling 1 - start
+        # profiling_task_start(f"update_vector_index_[{self.algo_dict['model_name']}]_|_{len(missing_keys)}")
+
+        #
+        embeddings: list[MessageEmbedding] = self.calculate_embeddings_of_msgs_list(self.get_pre_processed_texts(missing_keys, ner_dicts, rbi))
+        #
+        index.add(missing_keys, np.stack([get_sentence_embedding(me).float().cpu().numpy() for me in embeddings]))
+
+        # Profiling 1 - end
+        # profiling_last_task_ends()
+
+    #
+    def get_ann_candidates(self, rbi: RainbowInstance, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str], nb_candidates: int, nprobe: int) -> list[MessageSearch]:
+        """
+        Renvoie les messages les plus proches de la recherche d'après l'index de plus proches voisins de cet algorithme pour cette instance Rainbow (mis à jour au passage).
+
+        Args:
+            rbi (RainbowInstance): L'instance Rainbow dans laquelle on recherche
+            search_input (str): Texte de la recherche
+            lst_msgs (list[MessageSearch]): Messages à traiter (déjà filtrés)
+            ner_dicts (list[str]): Dictionnaires de NER de la recherche
+            nb_candidates (int): Nombre de contenus de messages différents à garder
+            nprobe (int): Nombre minimum de listes de l'index à parcourir
+
+        Returns:
+            list[MessageSearch]: Les messages candidats, dans l'ordre de la liste initiale
+        """
+
+        # Profiling 0 - start
+        # profiling_task_start(f"ann_candidates_[{self.algo_dict['model_name']}]_|_{search_input}_|_{len(lst_msgs)}")
+
+        #
+        index: IVFFlatIndex = rbi.get_vector_index(self.get_vector_index_name(ner_dicts))
+        #
+        keys: set[str] = set(m.content for m in lst_msgs)
+        self.update_vector_index(rbi, index, list(keys), ner_dicts)
+
+        # Embedding de la recherche
+        pre_processed_search_input: str
+        pre_processed_search_input, _ = self.pre_process_search_messages(search_input, [], ner_dicts)
+        query: np.ndarray = get_sentence_embedding(self.calculate_embeddings_of_msgs_list([pre_processed_search_input])[0]).float().cpu().numpy()
+
+        #
+        candidates_keys: set[str] = set(key for _, key in index.search(query, nb_candidates, nprobe, keys))
+
+        # Profiling 0 - end
+        # profiling_last_task_ends()
+
+        #
+        return [m for m in lst_msgs if m.content in candidates_keys]
+
 
 #
 class SimpleSyntaxic_SearchAlgorithm(SearchAlgorithm):
@@ -835,6 +1016,11 @@ class SimpleSyntaxic_SearchAlgorithm(SearchAlgorithm):
         self.config: Config = conf
         self.algo_config: dict = algo_config
 
+        # Score BM25 au lieu du nombre de mots en commun (seulement pour la recherche)
+        self.bm25: bool = False
+        if "bm25" in algo_config and int(algo_config["bm25"]) > 0:
+            self.bm25 = True
+
     #
     def get_matrix_distances_from_messages_main(self, lst_msgs: list[Message], ner_dicts: list[str] = []) -> Tensor:
         """
@@ -893,13 +1079,14 @@ class SimpleSyntaxic_SearchAlgorithm(SearchAlgorithm):
         return res
 
     #
-    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str]) -> list[float]:
+    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str], rbi: Optional[RainbowInstance] = None) -> list[float]:
         """
         Recherche syntaxique simple: compte le nombre de mots en communs
 
         Args:
             search_input (str): Texte de la recherche
             lst_msgs (list[MessageSearch]): Liste de messages à comparer avec la recherche
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages. Defaults to None.
 
         Returns:
             list[float]: Liste des scores correspondant à cette liste initiale de messages, dans l'ordre
@@ -908,10 +1095,39 @@ class SimpleSyntaxic_SearchAlgorithm(SearchAlgorithm):
         # Préparation au pré-processing
         pre_processed_search_input: str
         pre_processed_lst_msgs: list[MessageSearch]
-        pre_processed_search_input, pre_processed_lst_msgs = self.pre_process_search_messages(search_input, lst_msgs, ner_dicts)
+        pre_processed_search_input, pre_processed_lst_msgs = self.pre_process_search_messages(search_input, lst_msgs, ner_dicts, rbi)
+
+        # Sans instance Rainbow, pas d'index inversé, on compare avec chaque message
+        if rbi is None:
+            return [-find_common_words(pre_processed_search_input, msg.content) for msg in pre_processed_lst_msgs]
+
+        # Index inversé des messages pré-traités de la même façon, on y ajoute les textes qui n'y sont pas encore (parties de messages, nouveaux messages pré-traités)
+        index: InvertedIndex = rbi.get_inverted_index(self.get_pre_processing_signature(ner_dicts))
+        index.add([msg.content for msg in pre_processed_lst_msgs if not index.has(msg.content)])
+
+        # Les statistiques de BM25 sont calculées sur tous les messages (pré-traités) de l'instance Rainbow, pas seulement sur ceux des recherches précédentes
+        if self.bm25:
+            missing_ids: list[str] = index.get_missing_documents(list(rbi.messages.keys()))
+            if len(missing_ids) > 0:
+                missing_txts: list[str] = self.get_pre_processed_texts([rbi.messages[msg_id].content for msg_id in missing_ids], ner_dicts, rbi)
+                index.add_documents(list(zip(missing_ids, missing_txts)))
+
+        # Seuls les messages qui ont au moins un mot en commun avec la recherche ont un score
+        scores: dict[int, float] = index.score(pre_processed_search_input, bm25=self.bm25)
+
+        #
+        res: list[float] = []
+        for msg in pre_processed_lst_msgs:
+            #
+            score: float = scores.get(index.get_row(msg.content), 0.0)
+            # Bonus si la recherche entière est dans le message, comme dans `find_common_words`
+            if not self.bm25 and score > 0 and pre_processed_search_input.strip().lower() in msg.content.lower():
+                score += 1.0
+            #
+            res.append(-score)
 
         # On renvoie les résultats
-        return [-find_common_words(pre_processed_search_input, msg.content) for msg in pre_processed_lst_msgs]
+        return res
 
 
 #
@@ -948,10 +1164,13 @@ class SyntaxicFullSentenceLevenshtein_SearchAlgorithm(SearchAlgorithm):
         # On initialise la matrice
         matrix_distances: Tensor = zeros((n, n), dtype=float32)
 
+        #
+        levenshtein_engine: LevenshteinEngine = get_global_variables().get_levenshtein_engine()
+
         # On calcule les distances pour chaque couple de messages
         for id_msg1 in range(n):
             for id_msg2 in range(n):
-                matrix_distances[id_msg1, id_msg2] = full_sentence_levenshtein_distance(pre_processed_lst_msgs[id_msg1], pre_processed_lst_msgs[id_msg2])
+                matrix_distances[id_msg1, id_msg2] = levenshtein_engine.distance(pre_processed_lst_msgs[id_msg1].content, pre_processed_lst_msgs[id_msg2].content)
 
         # On renvoie le résultat
         return matrix_distances
@@ -971,9 +1190,12 @@ class SyntaxicFullSentenceLevenshtein_SearchAlgorithm(SearchAlgorithm):
         # On pré-traite les messages
         pre_processed_lst_msgs: list[Message] = self.pre_process_base_messages(lst_msgs, ner_dicts)
 
+        #
+        levenshtein_engine: LevenshteinEngine = get_global_variables().get_levenshtein_engine()
+
         # On calcule les résultats
         res: list[float] = [0] + [
-            full_sentence_levenshtein_distance(pre_processed_lst_msgs[i-1], pre_processed_lst_msgs[i])
+            levenshtein_engine.distance(pre_processed_lst_msgs[i-1].content, pre_processed_lst_msgs[i].content)
 
             for i in range(1, len(pre_processed_lst_msgs))
         ]
@@ -982,13 +1204,14 @@ class SyntaxicFullSentenceLevenshtein_SearchAlgorithm(SearchAlgorithm):
         return res
 
     #
-    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str]) -> list[float]:
+    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str], rbi: Optional[RainbowInstance] = None) -> list[float]:
         """
         Recherche syntaxique qui constiste à calculer la distance de Levenshtein sur les textes complets de recherche et de messages
 
         Args:
             search_input (str): Texte de la recherche
             lst_msgs (list[MessageSearch]): Liste de messages à comparer avec la recherche
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages. Defaults to None.
 
         Returns:
             list[float]: Liste des scores correspondant à cette liste initiale de messages, dans l'ordre
@@ -997,11 +1220,13 @@ class SyntaxicFullSentenceLevenshtein_SearchAlgorithm(SearchAlgorithm):
         # Préparation au pré-processing
         pre_processed_search_input: str
         pre_processed_lst_msgs: list[MessageSearch]
-        pre_processed_search_input, pre_processed_lst_msgs = self.pre_process_search_messages(search_input, lst_msgs, ner_dicts)
+        pre_processed_search_input, pre_processed_lst_msgs = self.pre_process_search_messages(search_input, lst_msgs, ner_dicts, rbi)
 
+        # Les distances déjà calculées (par une recherche précédente) sont dans le cache du moteur
+        levenshtein_engine: LevenshteinEngine = get_global_variables().get_levenshtein_engine()
 
         # On renvoie les résultats
-        return [full_sentence_levenshtein_distance(pre_processed_search_input, msg.content) for msg in pre_processed_lst_msgs]
+        return [levenshtein_engine.distance(pre_processed_search_input, msg.content) for msg in pre_processed_lst_msgs]
 
 
 #
@@ -1046,10 +1271,13 @@ class SyntaxicWordsLevenshtein_SearchAlgorithm(SearchAlgorithm):
         # On initialise la matrice
         matrix_distances: Tensor = zeros((n, n), dtype=float32)
 
+        #
+        levenshtein_engine: LevenshteinEngine = get_global_variables().get_levenshtein_engine()
+
         # On calcule les distances pour chaque couple de messages
         for id_msg1 in range(n):
             for id_msg2 in range(n):
-                matrix_distances[id_msg1, id_msg2] = words_levenshtein_distances(pre_processed_lst_msgs[id_msg1], pre_processed_lst_msgs[id_msg2])
+                matrix_distances[id_msg1, id_msg2] = levenshtein_engine.words_distances(pre_processed_lst_msgs[id_msg1].content, pre_processed_lst_msgs[id_msg2].content, self.close_words_factor)
 
         # On renvoie le résultat
         return matrix_distances
@@ -1069,9 +1297,12 @@ class SyntaxicWordsLevenshtein_SearchAlgorithm(SearchAlgorithm):
         # On pré-traite les messages
         pre_processed_lst_msgs: list[Message] = self.pre_process_base_messages(lst_msgs, ner_dicts)
 
+        #
+        levenshtein_engine: LevenshteinEngine = get_global_variables().get_levenshtein_engine()
+
         # On calcule les résultats
         res: list[float] = [0] + [
-            words_levenshtein_distances(pre_processed_lst_msgs[i-1], pre_processed_lst_msgs[i])
+            levenshtein_engine.words_distances(pre_processed_lst_msgs[i-1].content, pre_processed_lst_msgs[i].content, self.close_words_factor)
 
             for i in range(1, len(pre_processed_lst_msgs))
         ]
@@ -1080,7 +1311,7 @@ class SyntaxicWordsLevenshtein_SearchAlgorithm(SearchAlgorithm):
         return res
 
     #
-    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str]) -> list[float]:
+    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str], rbi: Optional[RainbowInstance] = None) -> list[float]:
         """
         Recherche syntaxique qui consiste à calculer la distance de Levenshtein sur les couples de mots entre la recherche et chacun des messages à rechercher
         Deux mots sont considérés comme "proches" s'ils ont une distance de Levenshtein inférieure à un certain pourcentage de la somme de leurs tailles.
@@ -1088,6 +1319,7 @@ class SyntaxicWordsLevenshtein_SearchAlgorithm(SearchAlgorithm):
         Args:
             search_input (str): Texte de la recherche
             lst_msgs (list[MessageSearch]): Liste de messages à comparer avec la recherche
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages. Defaults to None.
 
         Returns:
             list[float]: Liste des scores correspondant à cette liste initiale de messages, dans l'ordre
@@ -1096,10 +1328,13 @@ class SyntaxicWordsLevenshtein_SearchAlgorithm(SearchAlgorithm):
         # Préparation au pré-processing
         pre_processed_search_input: str
         pre_processed_lst_msgs: list[MessageSearch]
-        pre_processed_search_input, pre_processed_lst_msgs = self.pre_process_search_messages(search_input, lst_msgs, ner_dicts)
+        pre_processed_search_input, pre_processed_lst_msgs = self.pre_process_search_messages(search_input, lst_msgs, ner_dicts, rbi)
+
+        # Les couples de mots qui ne peuvent pas changer le résultat ne sont pas calculés, et les distances déjà calculées sont dans le cache du moteur
+        levenshtein_engine: LevenshteinEngine = get_global_variables().get_levenshtein_engine()
 
         # On renvoie les résultats
-        return [words_levenshtein_distances(pre_processed_search_input, msg.content, self.close_words_factor) for msg in pre_processed_lst_msgs]
+        return [levenshtein_engine.words_distances(pre_processed_search_input, msg.content, self.close_words_factor) for msg in pre_processed_lst_msgs]
 
 
 #
@@ -1137,20 +1372,18 @@ class SimpleDictJaccard_NER_SearchAlgorithm(SearchAlgorithm):
         matrix_distances: Tensor = zeros((n, n), dtype=float32)
 
         # On calcule la base de Jaccard
-        ner_base: list[str] = get_ner_jaccard_vec_base(ner_dicts)
+        ner_base: list[str]
+        ner_base, _ = get_ner_jaccard_vec_base(ner_dicts)
         ner_base_length: int = len(ner_base)
 
         if ner_base_length == 0:
             return matrix_distances
 
-        # On calcule les distances pour chaque couple de messages
-        for id_msg1 in range(n):
-            for id_msg2 in range(n):
-                matrix_distances[id_msg1, id_msg2] = -jaccard_distance(
-                    calculate_NER_vector_from_txt_and_dicts(pre_processed_lst_msgs[id_msg1], ner_base),
-                    calculate_NER_vector_from_txt_and_dicts(pre_processed_lst_msgs[id_msg2], ner_base),
-                    ner_base_length
-                )
+        # Vecteurs de bits de chaque message, rangés dans une matrice de mots de 64 bits
+        packed: np.ndarray = pack_NER_vectors(get_global_variables().get_NER_vectors(ner_dicts, [m.content for m in pre_processed_lst_msgs]), ner_base_length)
+
+        # On calcule les distances pour chaque couple de messages, en une seule opération vectorisée
+        matrix_distances = -from_numpy(matrix_jaccard_distances(packed, packed).astype(np.float32))
 
         # On renvoie le résultat
         return matrix_distances
@@ -1168,7 +1401,8 @@ class SimpleDictJaccard_NER_SearchAlgorithm(SearchAlgorithm):
         """
 
         # On calcule la base de Jaccard
-        ner_base: list[str] = get_ner_jaccard_vec_base(ner_dicts)
+        ner_base: list[str]
+        ner_base, _ = get_ner_jaccard_vec_base(ner_dicts)
         ner_base_length: int = len(ner_base)
 
         if ner_base_length == 0:
@@ -1177,13 +1411,12 @@ class SimpleDictJaccard_NER_SearchAlgorithm(SearchAlgorithm):
         # On pré-traite les messages
         pre_processed_lst_msgs: list[Message] = self.pre_process_base_messages(lst_msgs, ner_dicts)
 
+        # Vecteurs de bits de chaque message
+        vectors: list[int] = get_global_variables().get_NER_vectors(ner_dicts, [m.content for m in pre_processed_lst_msgs])
+
         # On calcule les résultats
         res: list[float] = [0] + [
-                -jaccard_distance(
-                    calculate_NER_vector_from_txt_and_dicts(pre_processed_lst_msgs[i-1], ner_base),
-                    calculate_NER_vector_from_txt_and_dicts(pre_processed_lst_msgs[i], ner_base),
-                    ner_base_length
-                )
+                -jaccard_distance(vectors[i-1], vectors[i])
             for i in range(1, len(pre_processed_lst_msgs))
         ]
 
@@ -1191,13 +1424,14 @@ class SimpleDictJaccard_NER_SearchAlgorithm(SearchAlgorithm):
         return res
 
     #
-    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str]) -> list[float]:
+    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str], rbi: Optional[RainbowInstance] = None) -> list[float]:
         """
         Recherche qui va juste faire un petit NER simple qui va détecter tous les éléments de NER depuis les dictionnaires de NER, puis va calculer une distance de Jaccard sur les résultats
 
         Args:
             search_input (str): Texte de la recherche
             lst_msgs (list[MessageSearch]): Liste de messages à comparer avec la recherche
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages. Defaults to None.
 
         Returns:
             list[float]: Liste des scores correspondant à cette liste initiale de messages, dans l'ordre
@@ -1206,23 +1440,22 @@ class SimpleDictJaccard_NER_SearchAlgorithm(SearchAlgorithm):
         # Préparation au pré-processing
         pre_processed_search_input: str
         pre_processed_lst_msgs: list[MessageSearch]
-        pre_processed_search_input, pre_processed_lst_msgs = self.pre_process_search_messages(search_input, lst_msgs, ner_dicts)
+        pre_processed_search_input, pre_processed_lst_msgs = self.pre_process_search_messages(search_input, lst_msgs, ner_dicts, rbi)
 
         # On calcule la base de Jaccard
-        ner_base: list[str] = get_ner_jaccard_vec_base(ner_dicts)
+        ner_base: list[str]
+        ner_base, _ = get_ner_jaccard_vec_base(ner_dicts)
         ner_base_length: int = len(ner_base)
 
         if ner_base_length == 0:
             return [0.0] * len(lst_msgs)
 
-        #
-        vec_input: set[int] = calculate_NER_vector_from_txt_and_dicts(pre_processed_search_input, ner_base)
+        # Vecteurs de bits de la recherche et des messages (ceux des messages sont gardés en mémoire d'une recherche à l'autre)
+        packed_input: np.ndarray = pack_NER_vectors([calculate_NER_vector_from_txt_and_dicts(pre_processed_search_input, ner_dicts)], ner_base_length)
+        packed_msgs: np.ndarray = pack_NER_vectors(get_global_variables().get_NER_vectors(ner_dicts, [m.content for m in pre_processed_lst_msgs]), ner_base_length)
 
-        # On renvoie les résultats
-        return [
-            -jaccard_distance(vec_input, calculate_NER_vector_from_txt_and_dicts(msg.content, ner_base), ner_base_length)
-            for msg in pre_processed_lst_msgs
-        ]
+        # On renvoie les résultats, en une seule opération vectorisée (1 x n)
+        return (-matrix_jaccard_distances(packed_input, packed_msgs)[0]).tolist()
 
 
 #
@@ -1290,13 +1523,14 @@ class SimpleSearchByTime_SearchAlgorithm(SearchAlgorithm):
         return res
 
     #
-    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str]) -> list[float]:
+    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str], rbi: Optional[RainbowInstance] = None) -> list[float]:
         """
         Recherche de temps simple: on n'a pas de temps avec le texte de recherche, on va donc renvoyer un score neutre.
 
         Args:
             search_input (str): Texte de la recherche
             lst_msgs (list[MessageSearch]): Liste de messages à comparer avec la recherche
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages. Defaults to None.
 
         Returns:
             list[float]: Liste des scores correspondant à cette liste initiale de messages, dans l'ordre
@@ -1465,13 +1699,14 @@ class SearchByUsers_SearchAlgorithm(SearchAlgorithm):
         return res
 
     #
-    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str]) -> list[float]:
+    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str], rbi: Optional[RainbowInstance] = None) -> list[float]:
         """
         Recherche entre utilisateurs simple: on renvoie un score neutre, on n'a pas d'utilisateurs sur le texte de recherche.
 
         Args:
             search_input (str): Texte de la recherche
             lst_msgs (list[MessageSearch]): Liste de messages à comparer avec la recherche
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages. Defaults to None.
 
         Returns:
             list[float]: Liste des scores correspondant à cette liste initiale de messages, dans l'ordre
@@ -1506,9 +1741,45 @@ class SearchWith_NER_Engine_SearchAlgorithm(SearchAlgorithm):
         self.ner_engine: NER_Engine = NER_Engine(self.ner_engine_config_dict, self.config)
 
     #
-    def analyse_entities(self, lst_msgs: list[MessageSearch | Message], ner_dicts: list[str] = []) -> tuple[Tensor, dict[int, int] ]:
+    def get_authors_entities(self, msg: MessageSearch | Message) -> list[ tuple[int, str, str] ]:
+        """
+        Renvoie les entités correspondant aux auteurs d'un message.
+
+        Args:
+            msg (MessageSearch | Message): Le message
+
+        Returns:
+            list[ tuple[int, str, str] ]: Une entité "PERS" par auteur
+        """
+
+        #
+        if isinstance(msg.author_name, set):
+            return [(0, name, "PERS") for name in msg.author_name]
+        elif isinstance(msg.author_name, str):
+            return [(0, msg.author_name, "PERS")]
+        #
+        return []
+
+    #
+    def get_messages_entities(self, lst_msgs: list[MessageSearch | Message]) -> list[ list[ tuple[int, str, str] ] ]:
+        """
+        Renvoie les entités de chaque message (entités reconnues dans le texte, et auteurs).
+
+        Args:
+            lst_msgs (list[MessageSearch | Message]): Les messages
+
+        Returns:
+            list[ list[ tuple[int, str, str] ] ]: Les entités de chaque message, dans l'ordre
+        """
+
+        #
+        return [entities + self.get_authors_entities(msg) for entities, msg in zip(self.ner_engine.main_recognize_many([msg.content for msg in lst_msgs]), lst_msgs)]
+
+    #
+    def analyse_entities(self, lst_msgs: list[MessageSearch | Message], ner_dicts: list[str] = []) -> Tensor:
         """
         Cette fonction analyse messages d'une liste de messages de recherche (lst_msgs).
+        Seuls les couples de messages qui ont au moins une entité liée (égale, ou contenue dans l'autre) sont calculés, grâce à un index inversé des entités.
 
         Args:
             lst_msgs (list[MessageSearch]): Une liste d'objets MessageSearch contenant les informations sur les messages.
@@ -1523,26 +1794,28 @@ class SearchWith_NER_Engine_SearchAlgorithm(SearchAlgorithm):
         nb_msgs: int = len(lst_msgs)
 
         # On récupère la liste des entités par messages
-        lst_msgs_entities: list[ list[ tuple[ int, str, str ] ] ] = []
-
-        #
-        id_msg: int
-        for id_msg in range(nb_msgs):
-            lst_msgs_entities.append( self.ner_engine.main_recognize(lst_msgs[id_msg].content) )
-            if isinstance(lst_msgs[id_msg].author_name, set):
-                lst_msgs_entities[-1] += [(0, name, "PERS") for name in lst_msgs[id_msg].author_name]
-            elif isinstance(lst_msgs[id_msg].author_name, str):
-                lst_msgs_entities[-1].append( (0, lst_msgs[id_msg].author_name, "PERS") )
+        lst_msgs_entities: list[ list[ tuple[ int, str, str ] ] ] = self.get_messages_entities(lst_msgs)
 
-        # On crée la matrice des messages
-        msgs_matrix: Tensor = zeros(nb_msgs, nb_msgs, dtype=float32)
+        # Index des entités des messages, la ligne de chaque message est son indice dans la liste
+        index: EntitiesIndex = EntitiesIndex()
+        index.add([str(id_msg) for id_msg in range(nb_msgs)], lst_msgs_entities)
 
+        # Coefficients non nuls de la matrice
+        rows: list[int] = []
+        cols: list[int] = []
+        values: list[float] = []
         #
         id_msg_1: int
-        id_msg_2: int
         for id_msg_1 in range(nb_msgs):
-            for id_msg_2 in range(nb_msgs):
-                msgs_matrix[id_msg_1][id_msg_2] -= calc_common_entities(lst_msgs_entities[id_msg_1], lst_msgs_entities[id_msg_2])
+            for id_msg_2, score in index.score(lst_msgs_entities[id_msg_1]).items():
+                rows.append(id_msg_1)
+                cols.append(id_msg_2)
+                values.append(-score)
+
+        # On crée la matrice des messages
+        msgs_matrix: Tensor = zeros(nb_msgs, nb_msgs, dtype=float32)
+        if len(values) > 0:
+            msgs_matrix[rows, cols] = Tensor(values)
 
         #
         return msgs_matrix
@@ -1578,9 +1851,8 @@ class SearchWith_NER_Engine_SearchAlgorithm(SearchAlgorithm):
             list[float]: La liste des distances entre chaques messages séquentiellement.
         """
 
-        # On récupère les analyse des messages
-        matrix_distances: Tensor
-        matrix_distances = self.analyse_entities(lst_msgs, ner_dicts)
+        # On récupère la liste des entités par messages, seuls les couples de messages consécutifs sont nécessaires
+        lst_msgs_entities: list[ list[ tuple[ int, str, str ] ] ] = self.get_messages_entities(lst_msgs)
 
         # On calcule les résultats
         res: list[float] = [0]
@@ -1589,19 +1861,20 @@ class SearchWith_NER_Engine_SearchAlgorithm(SearchAlgorithm):
             id_msg1: int = i - 1
             id_msg2: int = i
             #
-            res.append( matrix_distances[id_msg1][id_msg2] )
+            res.append( -calc_common_entities(lst_msgs_entities[id_msg1], lst_msgs_entities[id_msg2]) )
 
         # On renvoie les résultats
         return res
 
     #
-    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str]) -> list[float]:
+    def search(self, search_input: str, lst_msgs: list[MessageSearch], ner_dicts: list[str], rbi: Optional[RainbowInstance] = None) -> list[float]:
         """
         _summary_
 
         Args:
             search_input (str): Texte de la recherche
             lst_msgs (list[MessageSearch]): Liste de messages à comparer avec la recherche
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages. Defaults to None.
 
         Returns:
             list[float]: Liste des scores correspondant à cette liste initiale de messages, dans l'ordre
@@ -1612,20 +1885,40 @@ class SearchWith_NER_Engine_SearchAlgorithm(SearchAlgorithm):
         #
         search_input_entitites: list[ tuple[int, str, str] ] = self.ner_engine.main_recognize(search_input)
 
+        # Les entités des messages de la RBI sont normalement déjà dans le cache (calculées à l'import des messages)
+        if rbi is None:
+            #
+            lst_msgs_entities: list[ list[ tuple[ int, str, str ] ] ] = self.ner_engine.main_recognize_cached([msg_srch.content for msg_srch in lst_msgs])
+            #
+            return [
+                -calc_common_entities(search_input_entitites, lst_msgs_entities[i] + self.get_authors_entities(lst_msgs[i]))
+                for i in range(len(lst_msgs))
+            ]
+
+        # Index des entités des textes des messages, on y ajoute les textes qui n'y sont pas encore (parties de messages, nouveaux messages)
+        signature: str = self.ner_engine.get_signature()
+        index: EntitiesIndex = rbi.get_entities_index(signature)
+        new_txts: list[str] = list(dict.fromkeys(msg_srch.content for msg_srch in lst_msgs if not index.has(msg_srch.content)))
+        if len(new_txts) > 0:
+            index.add(new_txts, self.ner_engine.main_recognize_cached(new_txts, rbi.get_ner_results_cache(signature)))
+
+        # Seuls les messages qui ont au moins une entité liée à une entité de la recherche ont un score
+        scores: dict[int, float] = index.score(search_input_entitites)
+
+        # Les auteurs sont des entités de chaque message, leurs scores ne dépendent que de leurs noms
+        authors_scores: dict[str, float] = {}
+
         #
-        lst_msgs_entities: list[ list[ tuple[ int, str, str ] ] ] = []
+        res: list[float] = []
+        msg_srch: MessageSearch
         for msg_srch in lst_msgs:
             #
-            lst_msgs_entities.append( self.ner_engine.main_recognize(msg_srch.content) )
+            authors_key: str = "\n".join(sorted(msg_srch.author_name)) if isinstance(msg_srch.author_name, set) else str(msg_srch.author_name)
+            if not authors_key in authors_scores:
+                authors_scores[authors_key] = calc_common_entities(search_input_entitites, self.get_authors_entities(msg_srch))
             #
-            if isinstance(msg_srch.author_name, set):
-                lst_msgs_entities[-1] += [ (0, name, "PERS") for name in msg_srch.author_name]
-            elif isinstance(msg_srch.author_name, str):
-                lst_msgs_entities[-1].append( (0, msg_srch.author_name, "PERS") )
+            res.append( -(scores.get(index.get_row(msg_srch.content), 0.0) + authors_scores[authors_key]) )
 
         # On renvoie le résultats
-        return [
-            -calc_common_entities(search_input_entitites, lst_msgs_entities[i])
-            for i in range(len(lst_msgs))
-        ]
+        return res
 
@@ -7,7 +7,7 @@ Auteur: Nathan Cerisara
 from dataclasses import dataclass
 from typing import Optional, Any, cast
 
-import threading
+import heapq
 from multiprocessing.dummy import Pool as ThreadPool
 
 from user import User
@@ -16,6 +16,7 @@ from message import Message, MessagePart, MessageSearch
 from rainbow_instance import RainbowInstance
 from search_algorithm import SearchAlgorithm
 import search_algorithm as SA
+from windowed_distances import WindowedDistancesMatrix, get_messages_windows
 
 from torch import Tensor, float32, zeros, mul as torch_mul
 
@@ -39,6 +40,59 @@ ALGORITHMS: dict[str, type[SearchAlgorithm]] = {
 }
 
 
+# Caractères de fin de phrase, où l'on coupe de préférence les messages trop longs
+END_SENTENCES_CHARS: str = ".;?!\n\r"
+
+
+#
+def split_message_content(content: str, max_message_length: int) -> list[tuple[str, Optional[tuple[int, int]]]]:
+    """
+    Découpe le texte d'un message trop long en parties, de préférence après une fin de phrase, sinon après un espace, sinon n'importe où.
+    C'est le découpage utilisé par les recherches (les caches remplis à l'avance doivent utiliser les mêmes parties).
+
+    Args:
+        content (str): Texte du message
+        max_message_length (int): Taille maximale d'une partie, 0 ou moins pour ne pas découper
+
+    Returns:
+        list[tuple[str, Optional[tuple[int, int]]]]: Les parties (texte, bornes pour le MessagePart), ou le texte entier avec None s'il n'est pas découpé
+    """
+
+    # Le message n'est pas trop long
+    if max_message_length <= 0 or len(content) <= max_message_length:
+        return [(content, None)]
+
+    #
+    parts: list[tuple[str, Optional[tuple[int, int]]]] = []
+
+    # Pour tracer la progression du curseur sur le message
+    i: int = 0
+    while len(content) - i >= max_message_length + 1:
+        # On va chercher le dernier signe de fin de phrase
+        j: int = i+max_message_length
+        while j > i and content[j] not in END_SENTENCES_CHARS:
+            j -= 1
+        # S'il n'y a pas de fin de phrase, on va alors aller chercher le dernier espace
+        if j == i:
+            j = i+max_message_length
+            while j > i and content[j] != ' ':
+                j -= 1
+        # S'il n'y a pas d'espaces, on va couper comme des bourrins.
+        if j == i:
+            parts.append( (content[i: i+max_message_length], (i, i+max_message_length)) )
+            i += max_message_length
+        else:
+            parts.append( (content[i: j+1], (i, i+max_message_length)) )
+            i = j + 1
+
+    # S'il reste encore des choses à la fin
+    if len(content) - i > 0:
+        parts.append( (content[i:], (i, len(content))) )
+
+    #
+    return parts
+
+
 #
 @dataclass
 class SearchSettings():
@@ -127,19 +181,24 @@ class SearchEngine():
         if "distance_limit" in engine_config:
             self.distance_limit = float(engine_config["distance_limit"])
 
-        # On sauvegardera ici les attributs d'une recherche pour faciliter l'implémentation du multi-threading
-
-        # Utilisateur qui a fait la recherche
-        self.current_search_user: Optional[User] = None
-
-        # Texte de la recherche
-        self.current_search_input: Optional[str] = None
-
-        # Parametres de la recherche
-        self.current_search_settings: Optional[SearchSettings] = None
-
-        # NER dicts de la recherche
-        self.current_search_ner_dicts: list[str] = []
+        # Pré-sélection des candidats avec l'index de plus proches voisins du premier algorithme d'embedding (0 = désactivée, on traite tous les messages)
+        self.ann_nb_candidates: int = 0
+        if "ann_nb_candidates" in engine_config:
+            self.ann_nb_candidates = int(engine_config["ann_nb_candidates"])
+        #
+        self.ann_nprobe: int = 8
+        if "ann_nprobe" in engine_config:
+            self.ann_nprobe = int(engine_config["ann_nprobe"])
+        #
+        self.ann_algorithm: Optional[SA.SimpleEmbedding_SearchAlgorithm] = None
+        if self.ann_nb_candidates > 0:
+            for algo in self.algorithms:
+                if isinstance(algo, SA.SimpleEmbedding_SearchAlgorithm):
+                    self.ann_algorithm = algo
+                    break
+            #
+            if self.ann_algorithm is None:
+                raise ConfigError(f"La configuration du moteur de recherche {self.config_name} a l'attribut `ann_nb_candidates` mais n'a pas d'algorithme SimpleEmbedding_SearchAlgorithm")
 
     #
     def get_distances_matrix_from_messages_main(self, msgs_lsts: list[Message], ner_dicts: list[str] = []) -> Tensor:
@@ -168,6 +227,30 @@ class SearchEngine():
 
         return matrix_distances
 
+    #
+    def get_windowed_distances_from_messages_main(self, msgs_lsts: list[Message], ner_dicts: list[str] = [], window_size: int = 0, window_seconds: float = 0) -> WindowedDistancesMatrix:
+        """
+        Calcule les distances entre chaque message et les messages de sa fenêtre (en nombre de messages et/ou en temps) en combinants les distances de chaque algorithmes de ce moteur de recherche.
+
+        Args:
+            msgs_lsts (list[Message]): La liste des messages, rangés par date.
+            window_size (int, optional): Nombre de messages avant et après chaque message dans sa fenêtre, 0 pour ne pas limiter. Defaults to 0.
+            window_seconds (float, optional): Écart de temps maximal entre un message et ceux de sa fenêtre, 0 pour ne pas limiter. Defaults to 0.
+
+        Returns:
+            WindowedDistancesMatrix: Matrice creuse des distances. De dimensions (n, n).
+        """
+
+        # On calcule les fenêtres de chaque message
+        windowed_distances: WindowedDistancesMatrix = get_messages_windows(msgs_lsts, window_size, window_seconds)
+
+        # Pour chaque algorithme
+        for (algo_id, algo) in enumerate(self.algorithms):
+
+            windowed_distances.data += self.coef_algorithms[algo_id] * algo.get_windowed_distances_from_messages_main(msgs_lsts, windowed_distances, ner_dicts)
+
+        return windowed_distances
+
     #
     def get_distances_linear_from_messages_main(self, msgs_lsts: list[Message], ner_dicts: list[str] = []) -> list[float]:
         """
@@ -198,38 +281,64 @@ class SearchEngine():
         return lst_distances
 
     #
-    def search_part_of_msg_list(self, msg_lst: list[MessageSearch] | MessageSearch) -> list[tuple[float, MessageSearch]]:
+    def select_best_results(self, scores: list[float], msg_lst: list[MessageSearch]) -> list[tuple[float, MessageSearch]]:
         """
-        On va lancer la recherche sur les différents algorithmes, et combiner les résultats
+        Sélectionne les `nb_search_results` meilleurs résultats en une seule passe sur les scores :
+        on ne garde que le meilleur score de chaque message (ses parties sont en double sinon), on applique `distance_limit`,
+        puis on prend les k meilleurs avec un tas, sans trier tous les scores.
 
         Args:
-            msg_lst (list[MessageSearch]): Liste des messages à traiter
+            scores (list[float]): Score de chaque message
+            msg_lst (list[MessageSearch]): Les messages, dans le même ordre que les scores
 
         Returns:
-            list[tuple[float, MessageSearch]]: Le résultat, sous la forme: liste de (score du message, message)
+            list[tuple[float, MessageSearch]]: Les meilleurs résultats (score, message), triés par score croissant
         """
 
-        if isinstance(msg_lst, MessageSearch):
-            msg_lst = [msg_lst]
+        # Meilleur (score, indice dans la liste) pour chaque id de message
+        best_per_msg: dict[str, tuple[float, int]] = {}
+        #
+        for i, score in enumerate(scores):
+            #
+            if self.distance_limit is not None and score >= self.distance_limit:
+                continue
+            #
+            msg_id: str = msg_lst[i].msg_pointing[0].msg_id if len(msg_lst[i].msg_pointing) > 0 else ""
+            #
+            if not msg_id in best_per_msg or score < best_per_msg[msg_id][0]:
+                best_per_msg[msg_id] = (score, i)
+
+        #
+        best: list[tuple[float, int]]
+        if self.nb_search_results > 0:
+            best = heapq.nsmallest(self.nb_search_results, best_per_msg.values())
+        else:
+            best = sorted(best_per_msg.values())
 
-        # Tests de bonnes valeurs
-        if self.current_search_input is None:
-            raise SystemError("Erreur, current_search_input est vide.")
+        #
+        return [(score, msg_lst[i]) for (score, i) in best]
 
-        if self.current_search_user is None:
-            raise SystemError("Erreur, current_search_user est vide.")
+    #
+    def search_part_of_msg_list(self, search_input: str, msg_lst: list[MessageSearch], ner_dicts: list[str] = [], rbi: Optional[RainbowInstance] = None) -> list[tuple[float, MessageSearch]]:
+        """
+        On va lancer la recherche sur les différents algorithmes, et combiner les résultats.
+        Tout l'état de la recherche est passé en paramètres, cette fonction peut donc être appelée en même temps par plusieurs threads.
 
-        if self.current_search_settings is None:
-            raise SystemError("Erreur, current_search_settings est vide.")
+        Args:
+            search_input (str): Texte de la recherche
+            msg_lst (list[MessageSearch]): Liste des messages à traiter
+            ner_dicts (list[str], optional): Dictionnaires de NER de la recherche. Defaults to [].
+            rbi (Optional[RainbowInstance], optional): L'instance Rainbow d'où viennent les messages (pour ses textes pré-traités). Defaults to None.
 
-        # Id du thread actuel
-        id_crt_thread: int = threading.get_native_id()
+        Returns:
+            list[tuple[float, MessageSearch]]: Les meilleurs résultats de cette partie, sous la forme: liste de (score du message, message), triée par score croissant
+        """
 
         # Profiling 1 - start
         # profiling_task_start(f"search_part_of_msg_list_[{self.config_name}]_|_{len(msg_lst)}_|_{msg_lst[0]}")
 
-        # On prépare la liste de résultat
-        final_results: list[list[Any]] = [[.0, m] for m in msg_lst]
+        # On prépare la liste des scores
+        scores: list[float] = [0.0] * len(msg_lst)
 
         # Pour chaque algorithme
         for (algo_id, algo) in enumerate(self.algorithms):
@@ -238,23 +347,23 @@ class SearchEngine():
             # profiling_task_start(f"search_algo_{algo_id}_[{self.config_name}]_|_{len(msg_lst)}_|_{msg_lst[0]}")
 
             # On applique l'algorithme
-            msgs_scores: list[float] = algo.search(self.current_search_input, msg_lst, self.current_search_ner_dicts)
+            msgs_scores: list[float] = algo.search(search_input, msg_lst, ner_dicts, rbi)
 
             # On combine le résultat
             for i in range(len(msg_lst)):
-                final_results[i][0] += msgs_scores[i] * self.coef_algorithms[algo_id]
+                scores[i] += msgs_scores[i] * self.coef_algorithms[algo_id]
 
             # Profiling 2 - end
             # profiling_last_task_ends()
 
-        # On convertit, car final_results utilise des listes car on veut modifier les valeurs, mais après, on ne veut plus, donc on convertit en tuple
-        final_results_converted: list[tuple[float, MessageSearch]] = [cast(tuple[float, MessageSearch], tuple(r)) for r in final_results]
+        # On ne garde que les meilleurs résultats de cette partie, triés, pour pouvoir ensuite fusionner les résultats de chaque partie
+        final_results: list[tuple[float, MessageSearch]] = self.select_best_results(scores, msg_lst)
 
         # Profiling 1 - end
         # profiling_last_task_ends()
 
         # On renvoie le résultat final
-        return final_results_converted
+        return final_results
 
     #
     def search_main(self, rbi: RainbowInstance, search_input: str, user: User, search_settings: SearchSettings, ner_dicts: list[str] = []) -> list[tuple[float, MessageSearch]]:
@@ -276,149 +385,78 @@ class SearchEngine():
         # Profiling 2 - start
         # profiling_task_start(f"get_all_messages_to_process_[{self.config_name}]_|_{search_input}_|_{user.id}_|_{rbi.server_name}")
 
-        # On parcourt toutes les bulles d'un utilisateur selon les filtres
-        for bubble_id in user.bubbles_ids:
-
-            # On teste les filtres pour les bulles
-
-            # Filtre d'exclusion
-            if search_settings.exclude_bubbles is not None and bubble_id in search_settings.exclude_bubbles:
-                continue
-
-            # Filtre d'inclusion
-            if search_settings.filter_bubbles is not None and bubble_id not in search_settings.filter_bubbles:
-                continue
-
-            # On va donc pour l'instant, juste récupérer simplement tous les messages sans découpage
-
-            # Pour cela, on va parcourir tous les messages de la bulle
-            for message_id in rbi.bubbles[bubble_id].messages_ids:
-
-                # On récupère le message
-                msg: Message = rbi.messages[message_id]
-
-                # On filtre les messages trop courts
-                if len(msg.content) <= 2:
-                    continue
-
-                # On filtre les messages qui commencent par "/search"
-                if msg.content.startswith("/search"):
-                    continue
-
-                # On applique les filtres positifs sur les utilisateurs
-                if search_settings.from_users is not None and msg.author_id not in search_settings.from_users:
-                    continue
-
-                # On applique les filtres négatifs sur les utilisateurs
-                if search_settings.exclude_users is not None and msg.author_id in search_settings.exclude_users:
-                    continue
-
-                # On applique les filtres sur les dates
-                if search_settings.filter_date_precisely is not None:
-                    inside: bool = False
-
-                    # On va donc vérifier si la date du message est dans l'un des intervalles du filtre
-                    for date_intervalle in search_settings.filter_date_precisely:
-                        if msg.date >= date_intervalle[0] and msg.date <= date_intervalle[1]:
-                            inside = True
-                            break
-
-                    # S'elle n'y est pas, on ne traite pas le message
-                    if not inside:
-                        continue
-
-                # Si on est arrivé ici, c'est que l'on va traiter ce message
-
-                # Pour l'instant, on l'ajoute donc simplement à la liste des messages à traiter, sans plus de découpage intelligent des conversations
-                if self.max_message_length <= 0 or len(msg.content) <= self.max_message_length:
-                    msgs_to_search.append(MessageSearch(
-                                                content=msg.content,
-                                                date=msg.date,
-                                                author_id=set([msg.author_id]),
-                                                author_name=set([msg.author_name]) if isinstance(msg.author_name, str) else msg.author_name,
-                                                msg_pointing=[MessagePart(message_id)]
-                                        ))
-
-                # Mais quand même, si le message est trop long, on va découper le message en plusieurs parties, et faire une recherche indépendamment des parties
-                else:
-
-                    END_SENTENCES_CHARS: list[str] = ".;?!\n\r"
-
-                    # Pour tracer la progression du curseur sur le message
-                    i: int = 0
-                    while len(msg.content) - i >= self.max_message_length + 1:
-                        # On va chercher le dernier signe de fin de phrase
-                        j: int = i+self.max_message_length
-                        while j > i and msg.content[j] not in END_SENTENCES_CHARS:
-                            j -= 1
-                        # S'il n'y a pas de fin de phrase, on va alors aller chercher le dernier espace
-                        if j == i:
-                            j = i+self.max_message_length
-                            while j > i and msg.content[j] != ' ':
-                                j -= 1
-                        # S'il n'y a pas d'espaces, on va couper comme des bourrins.
-                        if j == i:
-                            msgs_to_search.append(MessageSearch(
-                                                        content=msg.content[i: i+self.max_message_length],
-                                                        date=msg.date,
-                                                        author_id=set([msg.author_id]),
-                                                        author_name=set([msg.author_name]) if isinstance(msg.author_name, str) else msg.author_name,
-                                                        msg_pointing=[MessagePart(message_id, (i, i+self.max_message_length))]
-                                                ))
-                            i += self.max_message_length
-                        else:
-                            msgs_to_search.append(MessageSearch(
-                                                        content=msg.content[i: j+1],
-                                                        date=msg.date,
-                                                        author_id=set([msg.author_id]),
-                                                        author_name=set([msg.author_name]) if isinstance(msg.author_name, str) else msg.author_name,
-                                                        msg_pointing=[MessagePart(message_id, (i, i+self.max_message_length))]
-                                                ))
-                            i = j + 1
-
-                    # S'il reste encore des choses à la fin
-                    if len(msg.content) - i > 0:
-                        msgs_to_search.append(MessageSearch(
-                                                    content=msg.content[i:],
-                                                    date=msg.date,
-                                                    author_id=set([msg.author_id]),
-                                                    author_name=set([msg.author_name]) if isinstance(msg.author_name, str) else msg.author_name,
-                                                    msg_pointing=[MessagePart(message_id, (i, len(msg.content)))]
-                                            ))
+        # Bulles de l'utilisateur dans lesquelles on recherche, selon les filtres d'inclusion et d'exclusion
+        bubbles_ids: set = set(user.bubbles_ids)
+        if search_settings.exclude_bubbles is not None:
+            bubbles_ids -= set(search_settings.exclude_bubbles)
+        if search_settings.filter_bubbles is not None:
+            bubbles_ids &= set(search_settings.filter_bubbles)
+
+        # Les filtres sur les bulles, les utilisateurs et les dates sont appliqués d'un seul coup sur les colonnes de métadonnées de la RBI
+        #   (ainsi que le filtre des messages trop courts, ou qui commencent par "/search")
+        filtered_messages_ids: list[str] = rbi.get_messages_columns().filter_rows(
+            bubbles_ids,
+            from_users=search_settings.from_users,
+            exclude_users=search_settings.exclude_users,
+            date_intervals=search_settings.filter_date_precisely
+        )
+
+        # On va donc pour l'instant, juste récupérer simplement tous les messages filtrés sans découpage
+        for message_id in filtered_messages_ids:
+
+            # On récupère le message
+            msg: Message = rbi.messages[message_id]
+
+            # Si on est arrivé ici, c'est que l'on va traiter ce message
+
+            # Si le message est trop long, il est découpé en plusieurs parties, et on fait une recherche indépendamment des parties
+            part_content: str
+            part_bounds: Optional[tuple[int, int]]
+            for part_content, part_bounds in split_message_content(msg.content, self.max_message_length):
+                msgs_to_search.append(MessageSearch(
+                                            content=part_content,
+                                            date=msg.date,
+                                            author_id=set([msg.author_id]),
+                                            author_name=set([msg.author_name]) if isinstance(msg.author_name, str) else msg.author_name,
+                                            msg_pointing=[MessagePart(message_id, part_bounds) if part_bounds is not None else MessagePart(message_id)]
+                                    ))
 
         # Arrivé ici, on a donc la liste de tous les messages bien découpés avec lesquels on va faire la recherche
 
         # Profiling 2 - end
         # profiling_last_task_ends()
 
-        # Score/Distance des messages selon la recherche, (plus petit veut dire meilleur)
-        msgs_scores: list[tuple[float, MessageSearch]] = []
-
-        # On sauvegarde les paramètres actuels de la recherche
-        self.current_search_input = search_input
-        self.current_search_settings = search_settings
-        self.current_search_user = user
-        self.current_search_ner_dicts = ner_dicts
-
         # Profiling 2 - start
         # profiling_task_start(f"searching_[{self.config_name}]_|_{search_input}_|_{user.id}_|_{rbi.server_name}")
 
         assert isinstance(msgs_to_search, list)
 
+        # On ne garde que les k' meilleurs candidats d'après l'index de plus proches voisins, les algorithmes ne seront appliqués que sur eux
+        if self.ann_algorithm is not None and len(msgs_to_search) > self.ann_nb_candidates:
+            msgs_to_search = self.ann_algorithm.get_ann_candidates(rbi, search_input, msgs_to_search, ner_dicts, self.ann_nb_candidates, self.ann_nprobe)
+
+        # Résultats de chaque partie de la liste des messages, chacun trié par score croissant (plus petit veut dire meilleur)
+        chunks_results: list[list[tuple[float, MessageSearch]]]
+
         # Cas où l'on ne va pas faire de multi-threading
-        if True or self.nb_threads <= 1:
+        if self.nb_threads <= 1 or len(msgs_to_search) <= 1:
 
             # On fait donc simplement la recherche sur toute la liste entière de messages à traiter, en un seul coup
-            msgs_scores = self.search_part_of_msg_list(msgs_to_search)
+            chunks_results = [self.search_part_of_msg_list(search_input, msgs_to_search, ner_dicts, rbi)]
 
         # Cas où l'on va faire du multi-threading
         else:
 
+            # On découpe la liste des messages en parties contiguës, une par thread
+            nb_chunks: int = min(self.nb_threads, len(msgs_to_search))
+            chunk_size: int = (len(msgs_to_search) + nb_chunks - 1) // nb_chunks
+            chunks: list[list[MessageSearch]] = [msgs_to_search[i:i+chunk_size] for i in range(0, len(msgs_to_search), chunk_size)]
+
             # On prépare l'outil de multi-threading
-            pool = ThreadPool(self.nb_threads)
+            pool = ThreadPool(len(chunks))
 
-            # On lance le calcul parallélisé
-            msgs_scores = pool.map(self.search_part_of_msg_list, msgs_to_search)
+            # On lance le calcul parallélisé, l'état de la recherche est passé explicitement à chaque partie
+            chunks_results = pool.starmap(self.search_part_of_msg_list, [(search_input, chunk, ner_dicts, rbi) for chunk in chunks])
 
             # On ferme le Pool, et on attends que tous les threads ont fini leur travail
             pool.close()
@@ -430,50 +468,23 @@ class SearchEngine():
         # Profiling 2 - start
         # profiling_task_start(f"sorting_results_|_{search_input}_|_{user.id}_|_{rbi.server_name}")
 
+        # On fusionne les meilleurs résultats de chaque partie avec un tas, en ne gardant que les N meilleurs résultats
+        #   et en filtrant les messages qui sont en double entre deux parties (on garde sa partie de meilleur score, qui arrive en premier)
+        search_result: list[tuple[float, MessageSearch]] = []
         msgs_ids: set[str] = set()
-        # On va filtrer les messages qui sont en double
-        for res_msg in msgs_scores:
-            is_duplicate: bool = False
+        #
+        for res_msg in heapq.merge(*chunks_results, key=lambda r: r[0]):
+            #
+            if any(msg_pointing.msg_id in msgs_ids for msg_pointing in res_msg[1].msg_pointing):
+                continue
+            #
             for msg_pointing in res_msg[1].msg_pointing:
-                if msg_pointing.msg_id in msgs_ids:
-                    is_duplicate = True
-                    break
                 msgs_ids.add(msg_pointing.msg_id)
-            if is_duplicate:
-                msgs_scores.remove(res_msg)
-
-        # Ici, les calculs de distance sont donc finis, il faut donc maintent trier dans l'ordre de score croissant les résultats de recherche
-        msgs_scores.sort(key=lambda r: r[0])
-
-        # Pour l'instant, on va simplement directement renvoyer les N messages les plus proches
-        search_result: list[tuple[float, MessageSearch]] = []
-
-        # Dans le cas où l'on veut tous les résultas ou que l'on a moins de résultats que demandés, on renvoie tous les résultats de la recherche
-        if self.nb_search_results <= 0 or len(msgs_scores) <= self.nb_search_results:
-            search_result = msgs_scores
-
-        # Dans le cas où l'on a plus de résultats que demandé, on ne renvoie que le nombre demandé
-        else:
-            search_result = msgs_scores[:self.nb_search_results]
-
-        # Si l'attribut "distance_limit" est activé
-        if self.distance_limit is not None:
             #
-            msgs_to_skip: Optional[int] = None
-            for i in range(len(search_result)):
-                if search_result[i][0] >= self.distance_limit:
-                    msgs_to_skip = i
-                    break
+            search_result.append(res_msg)
             #
-            if msgs_to_skip is not None:
-                search_result = search_result[:msgs_to_skip]
-
-        # Fin de la recherche, phase de nettoyage
-
-        # On nettoie les paramètres actuels de la recherche
-        self.current_search_input = None
-        self.current_search_settings = None
-        self.current_search_user = None
+            if self.nb_search_results > 0 and len(search_result) >= self.nb_search_results:
+                break
 
         # Profiling 2 - end
         # profiling_last_task_ends()
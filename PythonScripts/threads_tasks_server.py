@@ -12,6 +12,7 @@ from typing import Optional, Callable, Any
 from dataclasses import dataclass
 
 from threading import Thread, Lock, Condition
+from concurrent.futures import Future
 import signal
 import asyncio
 import websockets
@@ -29,10 +30,11 @@ from rainbow_instance import RainbowInstance
 from message import Message, MessageSearch
 from user import User
 from bubble import Bubble
-from search_engine import SearchEngine, SearchSettings
+from search_engine import SearchEngine, SearchSettings, split_message_content
 from conversations_engine import ConversationsEngine, ResultConversationCut
 from ner_engine import NER_Engine
 from embedding_calculator import EmbeddingCalculator, MessageEmbedding
+from embedding_service import EmbeddingService, PRIORITY_BULK
 from config import Config
 from lib import FunctionResult, ResultError, ResultSuccess, Date, escapeCharacters
 from lib_types import TYPES, GENERAL_CLASSES
@@ -249,6 +251,25 @@ class ThreadsTasksServer():
                                                                             "use_cuda": 1 if cuda_available() else 0
                                                                         }, self.config)
 
+        # Service partagé qui regroupe les calculs d'embeddings des imports avec ceux des recherches simultanées
+        #   (les textes des imports sont soumis avec une priorité basse, pour ne pas retarder les recherches)
+        self.bubble_import_embedding_service: EmbeddingService = get_global_variables().get_embedding_service(self.bubble_import_embedding_calculator)
+
+        # Configurations des moteurs de NER utilisés par les moteurs de recherche, indexées par leur signature,
+        # pour reconnaître les entités des messages importés à l'avance (les moteurs sont chargés à la première importation)
+        #   ainsi que les tailles maximales des parties de messages de ces moteurs de recherche (les messages trop longs sont recherchés par parties)
+        self.bubble_import_ner_engines_configs: dict[str, dict] = {}
+        self.bubble_import_ner_engines_max_lengths: dict[str, set[int]] = {}
+        for search_engine_config in self.configs_search_engines.values():
+            for algo_config in search_engine_config.get("algorithms", []):
+                if algo_config.get("type") == "SearchWith_NER_Engine_SearchAlgorithm" and "ner_engine_config_dict" in algo_config:
+                    ner_config_key: str = json.dumps(algo_config["ner_engine_config_dict"], sort_keys=True, ensure_ascii=False)
+                    self.bubble_import_ner_engines_configs[ner_config_key] = algo_config["ner_engine_config_dict"]
+                    self.bubble_import_ner_engines_max_lengths.setdefault(ner_config_key, set()).add(int(search_engine_config.get("max_message_length", 0)))
+        #
+        self.bubble_import_ner_engines: Optional[list[tuple[NER_Engine, set[int]]]] = None
+        self.bubble_import_ner_engines_mutex: Lock = Lock()
+
         ##### GLOBAL MULTI-TASKS THREADS #####
 
         # Dictionnaire de toutes les queues de requêtes en attente
@@ -489,6 +510,49 @@ class ThreadsTasksServer():
 
         print("Results sent to client.")
 
+    #
+    def get_bubble_import_ner_engines(self) -> list[tuple[NER_Engine, set[int]]]:
+        """
+        Renvoie les moteurs de NER utilisés par les moteurs de recherche, en les chargeant s'ils ne le sont pas encore.
+
+        Returns:
+            list[tuple[NER_Engine, set[int]]]: Les moteurs de NER (un par configuration différente), avec les tailles maximales des parties de messages des moteurs de recherche qui les utilisent
+        """
+
+        #
+        self.bubble_import_ner_engines_mutex.acquire()
+        try:
+            #
+            if self.bubble_import_ner_engines is None:
+                self.bubble_import_ner_engines = [
+                    (NER_Engine(ner_config, self.config), self.bubble_import_ner_engines_max_lengths[ner_config_key])
+                    for ner_config_key, ner_config in self.bubble_import_ner_engines_configs.items()
+                ]
+            #
+            return self.bubble_import_ner_engines
+        finally:
+            self.bubble_import_ner_engines_mutex.release()
+
+    #
+    def recognize_messages_entities(self, rbi: RainbowInstance, msgs_contents: list[str]) -> None:
+        """
+        Reconnaît les entités nommées de messages avec chaque moteur de NER des moteurs de recherche, pour qu'elles soient dans les caches de la RBI avant les recherches.
+        Les messages trop longs sont découpés en parties comme lors des recherches, ce sont ces parties qui sont reconnues.
+
+        Args:
+            rbi (RainbowInstance): La RBI des messages
+            msgs_contents (list[str]): Les textes des messages
+        """
+
+        #
+        ner_engine: NER_Engine
+        max_lengths: set[int]
+        for ner_engine, max_lengths in self.get_bubble_import_ner_engines():
+            #
+            txts: list[str] = list(dict.fromkeys(part_content for max_length in max_lengths for content in msgs_contents for part_content, _ in split_message_content(content, max_length)))
+            #
+            ner_engine.main_recognize_cached(txts, rbi.get_ner_results_cache(ner_engine.get_signature()))
+
     #
     async def bubble_import_handler_import(self, id_thread: int, bubble_import_request: ImportRequest) -> None:
         """
@@ -565,26 +629,29 @@ class ThreadsTasksServer():
             "estimated_time": str_estimated_time
         })
 
+        # Traduction de tous les messages de la bulle d'un coup, groupés par langue
+        translated_contents: list[str] = get_global_variables().translate_many([rbi.messages[msg_id].content for msg_id in bubble.messages_ids])
+
+        # Embeddings sans et avec traduction de tous les messages, tous soumis d'un coup pour que le service d'embeddings les regroupe en batchs
+        txts_to_embed: list[str] = [
+            txt for txt in dict.fromkeys(txt for msg_id, translated_content in zip(bubble.messages_ids, translated_contents) for txt in [rbi.messages[msg_id].content, translated_content])
+            if get_global_variables().get_embedding_cache(self.embedding_model_name, txt) is None
+        ]
+        embeddings_futures: dict[str, Future] = dict(zip(txts_to_embed, self.bubble_import_embedding_service.submit(txts_to_embed, PRIORITY_BULK)))
+
         #
         tot_nb_messages: int = len(bubble.messages_ids)
         msgs_processed: int = 0
         tot_time: float = 0
         last_update: float = time.time()
         #
-        for msg_id in bubble.messages_ids:
+        for msg_id, translated_content in zip(bubble.messages_ids, translated_contents):
             #
             msg: Message = rbi.messages[msg_id]
-            # Traduction
-            translated_content: str = get_global_variables().translate(msg.content)
-            # Calcul de l'embedding sans traduction
-            emb: MessageEmbedding
-            if get_global_variables().get_embedding_cache(self.embedding_model_name, msg.content) is None:
-                emb = self.bubble_import_embedding_calculator.get_embeddings([msg.content])[0]
-                get_global_variables().set_embedding_cache(self.embedding_model_name, msg.content, emb)
-            # Calcul de l'embedding avec traduction
-            if get_global_variables().get_embedding_cache(self.embedding_model_name, translated_content) is None:
-                emb = self.bubble_import_embedding_calculator.get_embeddings([translated_content])[0]
-                get_global_variables().set_embedding_cache(self.embedding_model_name, translated_content, emb)
+            # On récupère les embeddings sans et avec traduction de ce message
+            for txt in [msg.content, translated_content]:
+                if txt in embeddings_futures:
+                    get_global_variables().set_embedding_cache(self.embedding_model_name, txt, embeddings_futures.pop(txt).result())
             #
             msgs_processed += 1
             #
@@ -605,6 +672,8 @@ class ThreadsTasksServer():
                 "msgs_processed": msgs_processed,
                 "estimated_time": str_estimated_time
             })
+        # Entités nommées de tous les messages de la bulle, reconnues par batchs
+        self.recognize_messages_entities(rbi, [rbi.messages[msg_id].content for msg_id in bubble.messages_ids])
         #
         get_global_variables().save()
         #
@@ -668,6 +737,19 @@ class ThreadsTasksServer():
         finally:
             self.main_server.mutex_loading_rbi.release()
 
+        # Traduction de tous les nouveaux messages d'un coup, groupés par langue
+        translated_contents: dict[str, str] = dict(zip(
+            [msg_to_add["content"] for msg_to_add in add_request.msgs_lst if "content" in msg_to_add],
+            get_global_variables().translate_many([msg_to_add["content"] for msg_to_add in add_request.msgs_lst if "content" in msg_to_add])
+        ))
+
+        # Embeddings sans et avec traduction de tous les nouveaux messages, tous soumis d'un coup pour que le service d'embeddings les regroupe en batchs
+        txts_to_embed: list[str] = [
+            txt for txt in dict.fromkeys(txt for msg_content, translated_content in translated_contents.items() for txt in [msg_content, translated_content])
+            if get_global_variables().get_embedding_cache(self.embedding_model_name, txt) is None
+        ]
+        embeddings_futures: dict[str, Future] = dict(zip(txts_to_embed, self.bubble_import_embedding_service.submit(txts_to_embed, PRIORITY_BULK)))
+
         # On va ajouter chaque message
         for msg_to_add in add_request.msgs_lst:
 
@@ -683,16 +765,14 @@ class ThreadsTasksServer():
             msg_content = msg_to_add["content"]
 
             # Traduction
-            translated_content: str = get_global_variables().translate(msg_content)
-            # Calcul de l'embedding sans traduction
-            emb: MessageEmbedding
-            if get_global_variables().get_embedding_cache(self.embedding_model_name, msg_content) is None:
-                emb = self.bubble_import_embedding_calculator.get_embeddings([msg_content])[0]
-                get_global_variables().set_embedding_cache(self.embedding_model_name, msg_content, emb)
-            # Calcul de l'embedding avec traduction
-            if get_global_variables().get_embedding_cache(self.embedding_model_name, translated_content) is None:
-                emb = self.bubble_import_embedding_calculator.get_embeddings([translated_content])[0]
-                get_global_variables().set_embedding_cache(self.embedding_model_name, translated_content, emb)
+            translated_content: str = translated_contents[msg_content]
+            # Embeddings sans et avec traduction
+            for txt in [msg_content, translated_content]:
+                if txt in embeddings_futures:
+                    get_global_variables().set_embedding_cache(self.embedding_model_name, txt, embeddings_futures.pop(txt).result())
+
+        # Entités nommées de tous les nouveaux messages
+        self.recognize_messages_entities(rbi, [msg_to_add["content"] for msg_to_add in add_request.msgs_lst if "content" in msg_to_add])
 
         # On sauvegarde la rbi
         rbi.save()
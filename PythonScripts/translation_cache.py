@@ -0,0 +1,83 @@
+"""
+Cache des traductions vers une langue, sur le disque dans un fichier en ajout seul (une ligne par traduction, voir `JsonlStore`),
+avec les traductions les plus récemment utilisées gardées en mémoire (LRU).
+Une sauvegarde n'écrit que les nouvelles traductions, et une écriture interrompue ne peut perdre que les dernières traductions ajoutées.
+
+Auteur: Nathan Cerisara
+"""
+
+from typing import Optional
+
+import os
+import json
+
+from jsonl_store import JsonlStore, DEFAULT_LRU_CAPACITY
+
+
+# Nombre de nouvelles traductions à partir duquel elles sont écrites sur le disque sans attendre une sauvegarde
+FLUSH_THRESHOLD: int = 256
+
+
+#
+class TranslationCache:
+    """
+    Dictionnaire texte -> texte traduit, persistant dans un fichier en ajout seul.
+    """
+
+    def __init__(self, file_path: str, legacy_json_path: Optional[str] = None, language: str = "en", lru_capacity: int = DEFAULT_LRU_CAPACITY) -> None:
+        """
+        Crée le cache, et charge l'index de ses traductions depuis le disque.
+
+        Args:
+            file_path (str): Fichier du cache
+            legacy_json_path (Optional[str], optional): Ancien cache json (langue -> texte -> traduction), importé s'il existe et que le fichier du cache n'existe pas encore. Defaults to None.
+            language (str, optional): Langue cible des traductions (pour lire l'ancien cache json). Defaults to "en".
+            lru_capacity (int, optional): Nombre de traductions gardées en mémoire. Defaults to DEFAULT_LRU_CAPACITY.
+        """
+
+        #
+        is_new: bool = not os.path.exists(file_path)
+        #
+        self.store: JsonlStore = JsonlStore(file_path, lru_capacity=lru_capacity, flush_threshold=FLUSH_THRESHOLD)
+
+        #
+        if is_new and legacy_json_path is not None and os.path.exists(legacy_json_path):
+            with open(legacy_json_path, "r", encoding="utf-8") as f:
+                self.store.add(list(json.load(f).get(language, {}).items()), overwrite=True)
+            self.store.save()
+
+    #
+    def get(self, txt: str) -> Optional[str]:
+        """
+        Renvoie la traduction d'un texte, si elle est connue.
+
+        Args:
+            txt (str): Le texte
+
+        Returns:
+            Optional[str]: La traduction, ou None si elle n'est pas connue
+        """
+
+        #
+        return self.store.get(txt)
+
+    #
+    def add(self, translations: dict[str, str]) -> None:
+        """
+        Ajoute des traductions au cache, elles sont écrites dans le fichier à la prochaine sauvegarde (ou dès qu'il y en a assez).
+
+        Args:
+            translations (dict[str, str]): Texte -> traduction
+        """
+
+        #
+        self.store.add(list(translations.items()), overwrite=True)
+
+    #
+    def save(self) -> None:
+        """
+        Écrit les nouvelles traductions sur le disque, et compacte le fichier s'il a trop de lignes inutiles.
+        """
+
+        #
+        self.store.save()
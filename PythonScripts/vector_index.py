@@ -0,0 +1,373 @@
+"""
+Index approximatif de plus proches voisins (ANN) sur les embeddings des messages d'une instance Rainbow, pour un modèle donné.
+C'est un index IVF-flat : les vecteurs sont répartis en listes autour de centroïdes (k-means sphérique),
+et une recherche ne compare le vecteur de la recherche qu'aux vecteurs des `nprobe` listes les plus proches.
+
+Le moteur de recherche s'en sert pour ne garder que les k' meilleurs candidats par similarité des embeddings,
+avant d'appliquer tous les autres algorithmes (temps, utilisateurs, NER, ...) seulement sur ces candidats.
+
+Auteur: Nathan Cerisara
+"""
+
+from typing import Optional
+
+import os
+import json
+from threading import Lock
+
+import numpy as np
+
+from profiling import profiling_task_start, profiling_last_task_ends
+
+
+# Noms des fichiers de l'index
+INDEX_VECTORS_FILE: str = "vectors.npy"
+INDEX_CENTROIDS_FILE: str = "centroids.npy"
+INDEX_ASSIGNMENTS_FILE: str = "assignments.npy"
+INDEX_KEYS_FILE: str = "keys.json"
+
+# En dessous de ce nombre de vecteurs, on ne fait pas de listes, on compare avec tout
+MIN_ROWS_FOR_CLUSTERING: int = 1024
+
+# On ré-entraîne les centroïdes quand l'index a grossi de ce facteur depuis le dernier entraînement
+RETRAIN_GROWTH_FACTOR: float = 2.0
+
+# Nombre d'itérations du k-means
+KMEANS_NB_ITERATIONS: int = 10
+
+# Nombre maximum de vecteurs utilisés pour entraîner le k-means
+KMEANS_MAX_TRAINING_ROWS: int = 65536
+
+
+#
+class IVFFlatIndex:
+    """
+    Index IVF-flat sur des vecteurs normalisés, la similarité utilisée est le produit scalaire (= cosinus).
+    Chaque ligne de l'index est identifiée par une clé texte (le contenu du message qui a été embeddé).
+    """
+
+    def __init__(self, dir_path: str) -> None:
+        """
+        Crée l'index, et le charge depuis le disque s'il y a déjà été sauvegardé.
+
+        Args:
+            dir_path (str): Dossier où est sauvegardé l'index
+        """
+
+        #
+        self.dir_path: str = dir_path
+
+        # Clé de chaque ligne, et ligne de chaque clé
+        self.keys: list[str] = []
+        self.keys_rows: dict[str, int] = {}
+
+        # Matrice des vecteurs (n, d), la capacité est doublée quand elle est pleine
+        self.vectors: Optional[np.ndarray] = None
+        self.nb_rows: int = 0
+
+        # Centroïdes (nlist, d), et liste de chaque ligne
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments: np.ndarray = np.zeros((0,), dtype=np.int32)
+        self.nb_trained_rows: int = 0
+
+        # Lignes de chaque liste, recalculées à la demande
+        self.lists_rows: Optional[list[np.ndarray]] = None
+
+        # Clés ajoutées dans l'instance Rainbow depuis la dernière mise à jour, et si l'index a changé depuis sa dernière sauvegarde
+        self.pending_keys: set[str] = set()
+        self.dirty: bool = False
+
+        # L'index peut être utilisé par plusieurs recherches en même temps
+        self.mutex: Lock = Lock()
+
+        #
+        self.load()
+
+    #
+    def load(self) -> None:
+        """
+        Charge l'index depuis son dossier s'il existe.
+        """
+
+        #
+        if not os.path.exists(f"{self.dir_path}{INDEX_KEYS_FILE}"):
+            return
+
+        #
+        with open(f"{self.dir_path}{INDEX_KEYS_FILE}", "r", encoding="utf-8") as f:
+            self.keys = json.load(f)
+        #
+        self.vectors = np.load(f"{self.dir_path}{INDEX_VECTORS_FILE}")
+        self.nb_rows = len(self.keys)
+
+        # Sauvegarde interrompue : on ne garde que ce qui est cohérent
+        if self.vectors.shape[0] < self.nb_rows:
+            self.keys = self.keys[:self.vectors.shape[0]]
+            self.nb_rows = len(self.keys)
+        #
+        self.keys_rows = {key: row for row, key in enumerate(self.keys)}
+
+        #
+        if os.path.exists(f"{self.dir_path}{INDEX_CENTROIDS_FILE}"):
+            self.centroids = np.load(f"{self.dir_path}{INDEX_CENTROIDS_FILE}")
+            self.assignments = np.load(f"{self.dir_path}{INDEX_ASSIGNMENTS_FILE}")
+            # Les lignes ajoutées après la dernière sauvegarde des listes sont assignées maintenant
+            if self.assignments.shape[0] != self.nb_rows:
+                self.assignments = self.assign(self.vectors[:self.nb_rows])
+            self.nb_trained_rows = self.nb_rows
+
+    #
+    def save(self) -> None:
+        """
+        Sauvegarde l'index dans son dossier, s'il a changé depuis la dernière sauvegarde.
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            #
+            if not self.dirty or self.vectors is None:
+                return
+            #
+            if not os.path.exists(self.dir_path):
+                os.makedirs(self.dir_path)
+
+            # On écrit les vecteurs avant les clés, une clé n'est jamais sauvegardée sans son vecteur
+            np.save(f"{self.dir_path}{INDEX_VECTORS_FILE}", self.vectors[:self.nb_rows])
+            #
+            if self.centroids is not None:
+                np.save(f"{self.dir_path}{INDEX_CENTROIDS_FILE}", self.centroids)
+                np.save(f"{self.dir_path}{INDEX_ASSIGNMENTS_FILE}", self.assignments)
+            #
+            tmp_path: str = f"{self.dir_path}{INDEX_KEYS_FILE}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.keys, f)
+            os.replace(tmp_path, f"{self.dir_path}{INDEX_KEYS_FILE}")
+            #
+            self.dirty = False
+        finally:
+            self.mutex.release()
+
+    #
+    def has(self, key: str) -> bool:
+        """
+        Indique si la clé est déjà dans l'index.
+
+        Args:
+            key (str): Clé à tester
+
+        Returns:
+            bool: Si la clé est dans l'index
+        """
+
+        #
+        return key in self.keys_rows
+
+    #
+    def mark_pending(self, key: str) -> None:
+        """
+        Indique qu'un nouveau message a été ajouté à l'instance Rainbow, et devra être ajouté à l'index à la prochaine mise à jour.
+
+        Args:
+            key (str): Clé (contenu) du nouveau message
+        """
+
+        #
+        if not key in self.keys_rows:
+            self.pending_keys.add(key)
+
+    #
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Renvoie la liste (= le centroïde le plus proche) de chaque vecteur.
+
+        Args:
+            vectors (np.ndarray): Vecteurs (n, d)
+
+        Returns:
+            np.ndarray: Indice de la liste de chaque vecteur (n,)
+        """
+
+        #
+        if self.centroids is None:
+            return np.zeros((vectors.shape[0],), dtype=np.int32)
+        #
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    #
+    def train(self) -> None:
+        """
+        (Ré-)entraîne les centroïdes avec un k-means sphérique sur les vecteurs de l'index (environ sqrt(n) listes), et ré-assigne toutes les lignes.
+        """
+
+        #
+        if self.vectors is None or self.nb_rows < MIN_ROWS_FOR_CLUSTERING:
+            return
+
+        # Profiling 1 - start
+        # profiling_task_start(f"ivf_training_|_{self.nb_rows}")
+
+        #
+        vectors: np.ndarray = self.vectors[:self.nb_rows]
+        nlist: int = max(1, int(np.sqrt(self.nb_rows)))
+        rng: np.random.Generator = np.random.default_rng(0)
+
+        # Échantillon d'entraînement
+        training: np.ndarray = vectors
+        if self.nb_rows > KMEANS_MAX_TRAINING_ROWS:
+            training = vectors[rng.choice(self.nb_rows, KMEANS_MAX_TRAINING_ROWS, replace=False)]
+
+        #
+        centroids: np.ndarray = training[rng.choice(training.shape[0], nlist, replace=False)].copy()
+        #
+        for _ in range(KMEANS_NB_ITERATIONS):
+            #
+            labels: np.ndarray = np.argmax(training @ centroids.T, axis=1)
+            #
+            sums: np.ndarray = np.zeros_like(centroids)
+            np.add.at(sums, labels, training)
+            #
+            norms: np.ndarray = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Les listes vides gardent leur ancien centroïde
+            non_empty: np.ndarray = norms[:, 0] > 0
+            centroids[non_empty] = sums[non_empty] / norms[non_empty]
+
+        #
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = self.assign(vectors)
+        self.nb_trained_rows = self.nb_rows
+        self.lists_rows = None
+        self.dirty = True
+
+        # Profiling 1 - end
+        # profiling_last_task_ends()
+
+    #
+    def add(self, keys: list[str], vectors: np.ndarray) -> None:
+        """
+        Ajoute des vecteurs à l'index (les clés déjà présentes sont ignorées).
+
+        Args:
+            keys (list[str]): Clés des vecteurs
+            vectors (np.ndarray): Vecteurs normalisés (n, d)
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            #
+            new_rows: list[int] = [i for i, key in enumerate(keys) if not key in self.keys_rows]
+            if len(new_rows) == 0:
+                return
+            #
+            new_vectors: np.ndarray = np.ascontiguousarray(vectors[new_rows], dtype=np.float32)
+
+            # On agrandit la matrice si besoin
+            if self.vectors is None:
+                self.vectors = np.zeros((max(1024, len(new_rows)), new_vectors.shape[1]), dtype=np.float32)
+            elif self.nb_rows + len(new_rows) > self.vectors.shape[0]:
+                new_capacity: int = max(2 * self.vectors.shape[0], self.nb_rows + len(new_rows))
+                resized: np.ndarray = np.zeros((new_capacity, self.vectors.shape[1]), dtype=np.float32)
+                resized[:self.nb_rows] = self.vectors[:self.nb_rows]
+                self.vectors = resized
+
+            #
+            self.vectors[self.nb_rows:self.nb_rows+len(new_rows)] = new_vectors
+            for i in new_rows:
+                self.keys_rows[keys[i]] = len(self.keys)
+                self.keys.append(keys[i])
+                self.pending_keys.discard(keys[i])
+            self.nb_rows += len(new_rows)
+            self.dirty = True
+
+            # Les nouvelles lignes vont dans la liste de leur centroïde le plus proche, ou on ré-entraîne si l'index a trop grossi
+            if self.centroids is None or self.nb_rows >= RETRAIN_GROWTH_FACTOR * self.nb_trained_rows:
+                self.train()
+            else:
+                self.assignments = np.concatenate([self.assignments, self.assign(new_vectors)])
+                self.lists_rows = None
+        finally:
+            self.mutex.release()
+
+    #
+    def search(self, query: np.ndarray, k: int, nprobe: int, allowed_keys: Optional[set[str]] = None) -> list[tuple[float, str]]:
+        """
+        Recherche les k clés dont les vecteurs sont les plus similaires au vecteur de la recherche.
+        On parcourt au moins `nprobe` listes, et on continue tant qu'il n'y a pas au moins k candidats autorisés.
+
+        Args:
+            query (np.ndarray): Vecteur normalisé de la recherche (d,)
+            k (int): Nombre de résultats voulus
+            nprobe (int): Nombre minimum de listes à parcourir
+            allowed_keys (Optional[set[str]], optional): Si précisé, seules ces clés peuvent être renvoyées (filtres de la recherche). Defaults to None.
+
+        Returns:
+            list[tuple[float, str]]: Liste de (distance = -similarité, clé), triée par distance croissante
+        """
+
+        #
+        self.mutex.acquire()
+        try:
+            #
+            if self.vectors is None or self.nb_rows == 0 or k <= 0:
+                return []
+
+            # Profiling 1 - start
+            # profiling_task_start(f"ivf_search_|_{self.nb_rows}_|_{k}_|_{nprobe}")
+
+            # Lignes autorisées par les filtres
+            allowed_mask: Optional[np.ndarray] = None
+            if allowed_keys is not None:
+                allowed_mask = np.zeros((self.nb_rows,), dtype=bool)
+                allowed_mask[[self.keys_rows[key] for key in allowed_keys if key in self.keys_rows]] = True
+
+            # Lignes candidates
+            candidates: np.ndarray
+            if self.centroids is None:
+                candidates = np.arange(self.nb_rows)
+            else:
+                #
+                if self.lists_rows is None:
+                    order: np.ndarray = np.argsort(self.assignments, kind="stable")
+                    bounds: np.ndarray = np.searchsorted(self.assignments[order], np.arange(self.centroids.shape[0] + 1))
+                    self.lists_rows = [order[bounds[i]:bounds[i+1]] for i in range(self.centroids.shape[0])]
+                # Listes de la plus proche à la plus éloignée de la recherche
+                lists_order: np.ndarray = np.argsort(-(self.centroids @ query))
+                #
+                probed: list[np.ndarray] = []
+                nb_candidates: int = 0
+                for i, list_id in enumerate(lists_order):
+                    #
+                    if i >= nprobe and nb_candidates >= k:
+                        break
+                    #
+                    rows: np.ndarray = self.lists_rows[list_id]
+                    if allowed_mask is not None:
+                        rows = rows[allowed_mask[rows]]
+                    probed.append(rows)
+                    nb_candidates += len(rows)
+                #
+                candidates = np.concatenate(probed) if len(probed) > 0 else np.zeros((0,), dtype=np.int64)
+
+            #
+            if allowed_mask is not None and self.centroids is None:
+                candidates = candidates[allowed_mask]
+            #
+            if len(candidates) == 0:
+                return []
+
+            # Distances exactes sur les candidats, et k meilleurs sans trier toute la liste
+            distances: np.ndarray = -(self.vectors[candidates] @ query)
+            if len(candidates) > k:
+                best: np.ndarray = np.argpartition(distances, k - 1)[:k]
+            else:
+                best = np.arange(len(candidates))
+            best = best[np.argsort(distances[best], kind="stable")]
+
+            # Profiling 1 - end
+            # profiling_last_task_ends()
+
+            #
+            return [(float(distances[i]), self.keys[candidates[i]]) for i in best]
+        finally:
+            self.mutex.release()
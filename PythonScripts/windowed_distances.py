@@ -0,0 +1,185 @@
+"""
+Matrice creuse des distances entre messages, limitée à une fenêtre autour de chaque message (en nombre de messages et/ou en temps).
+Les messages d'une bulle sont rangés par date, la fenêtre de chaque message est donc un intervalle de colonnes contigu,
+et la matrice est stockée au format CSR (une ligne = les distances du message aux messages de sa fenêtre).
+Deux messages éloignés de plusieurs jours ne sont jamais dans la même conversation, il est inutile de calculer (et de garder en mémoire) leur distance.
+
+Auteur: Nathan Cerisara
+"""
+
+from typing import Optional
+
+from datetime import datetime, timezone
+
+import numpy as np
+from parse import parse
+
+from message import Message
+
+
+#
+def message_timestamp(txt_date: str) -> Optional[float]:
+    """
+    Convertit une date au format des messages ("YYYY/MM/DD - HHhMM") en timestamp (secondes), avec le vrai calendrier.
+
+    Args:
+        txt_date (str): La date
+
+    Returns:
+        Optional[float]: Le timestamp, ou None si la date n'a pas pu être lue
+    """
+
+    #
+    parsed = parse("{years:d}/{months:d}/{days:d} - {hours:d}h{minutes:d}", txt_date)
+    if parsed is None:
+        return None
+    #
+    try:
+        return datetime(parsed["years"], parsed["months"], parsed["days"], parsed["hours"], parsed["minutes"], tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+
+#
+class WindowedDistancesMatrix:
+    """
+    Matrice (n, n) des distances entre messages, dont seules les colonnes `starts[i]` à `ends[i] - 1` de chaque ligne `i` sont connues (format CSR).
+    Chaque fenêtre contient toujours le message lui-même.
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray) -> None:
+        """
+        Crée une matrice de distances nulles avec les fenêtres données.
+
+        Args:
+            starts (np.ndarray): Première colonne de la fenêtre de chaque ligne. De dimension (n,).
+            ends (np.ndarray): Colonne qui suit la dernière colonne de la fenêtre de chaque ligne. De dimension (n,).
+        """
+
+        #
+        self.n: int = len(starts)
+        self.starts: np.ndarray = starts.astype(np.int64)
+        self.ends: np.ndarray = ends.astype(np.int64)
+
+        # Format CSR : les valeurs de la ligne i sont data[indptr[i]:indptr[i+1]], et leurs colonnes indices[indptr[i]:indptr[i+1]]
+        self.indptr: np.ndarray = np.concatenate(([0], np.cumsum(self.ends - self.starts))).astype(np.int64)
+        self.indices: np.ndarray = np.concatenate([np.arange(start, end) for start, end in zip(self.starts, self.ends)]) if self.n > 0 else np.zeros(0, dtype=np.int64)
+        self.data: np.ndarray = np.zeros(int(self.indptr[-1]), dtype=np.float32)
+
+    #
+    def nnz(self) -> int:
+        """
+        Renvoie le nombre de distances gardées.
+
+        Returns:
+            int: Nombre de coefficients de la matrice creuse
+        """
+
+        #
+        return len(self.data)
+
+    #
+    def max_width(self) -> int:
+        """
+        Renvoie la taille de la plus grande fenêtre.
+
+        Returns:
+            int: Nombre maximal de colonnes d'une ligne
+        """
+
+        #
+        if self.n == 0:
+            return 0
+        #
+        return int(np.max(self.ends - self.starts))
+
+    #
+    def row(self, i: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Renvoie les distances connues d'un message.
+
+        Args:
+            i (int): Indice du message
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Colonnes de la fenêtre du message, et distances correspondantes
+        """
+
+        #
+        return (self.indices[self.indptr[i]:self.indptr[i+1]], self.data[self.indptr[i]:self.indptr[i+1]])
+
+    #
+    def to_dense(self, fill_value: float = np.inf) -> np.ndarray:
+        """
+        Renvoie la matrice complète (à n'utiliser que pour de petites bulles).
+
+        Args:
+            fill_value (float, optional): Valeur des distances qui ne sont pas dans les fenêtres. Defaults to np.inf.
+
+        Returns:
+            np.ndarray: La matrice des distances. De dimensions (n, n).
+        """
+
+        #
+        dense: np.ndarray = np.full((self.n, self.n), fill_value, dtype=np.float32)
+        for i in range(self.n):
+            dense[i, self.starts[i]:self.ends[i]] = self.data[self.indptr[i]:self.indptr[i+1]]
+        #
+        return dense
+
+    #
+    def tolist(self) -> list[list[Optional[float]]]:
+        """
+        Renvoie la matrice complète sous forme de listes, les distances qui ne sont pas dans les fenêtres valent None (pour l'export json).
+
+        Returns:
+            list[list[Optional[float]]]: La matrice des distances
+        """
+
+        #
+        return [[float(d) if np.isfinite(d) else None for d in row] for row in self.to_dense()]
+
+
+#
+def get_messages_windows(msgs_lst: list[Message], window_size: int = 0, window_seconds: float = 0) -> WindowedDistancesMatrix:
+    """
+    Calcule la fenêtre de chaque message : les messages à au plus `window_size` messages de distance, et à au plus `window_seconds` secondes.
+    Les messages doivent être rangés par date pour la fenêtre en temps.
+
+    Args:
+        msgs_lst (list[Message]): Les messages, rangés par date
+        window_size (int, optional): Nombre de messages avant et après chaque message dans sa fenêtre, 0 pour ne pas limiter. Defaults to 0.
+        window_seconds (float, optional): Écart de temps maximal entre un message et ceux de sa fenêtre, 0 pour ne pas limiter. Defaults to 0.
+
+    Returns:
+        WindowedDistancesMatrix: Matrice creuse (de distances nulles) avec les fenêtres de chaque message
+    """
+
+    #
+    n: int = len(msgs_lst)
+    idxs: np.ndarray = np.arange(n, dtype=np.int64)
+
+    # Fenêtre en nombre de messages
+    starts: np.ndarray = np.zeros(n, dtype=np.int64)
+    ends: np.ndarray = np.full(n, n, dtype=np.int64)
+    if window_size > 0:
+        starts = np.maximum(idxs - window_size, 0)
+        ends = np.minimum(idxs + window_size + 1, n)
+
+    # Fenêtre en temps
+    if window_seconds > 0 and n > 0:
+        #
+        times: np.ndarray = np.zeros(n, dtype=np.float64)
+        for i, msg in enumerate(msgs_lst):
+            # Un message dont la date n'a pas pu être lue prend la date du message précédent
+            timestamp: Optional[float] = message_timestamp(msg.date)
+            times[i] = timestamp if timestamp is not None else (times[i-1] if i > 0 else 0)
+        #
+        if np.any(np.diff(times) < 0):
+            raise ValueError("The messages must be sorted by date to use a time window !")
+        #
+        starts = np.maximum(starts, np.searchsorted(times, times - window_seconds, side="left"))
+        ends = np.minimum(ends, np.searchsorted(times, times + window_seconds, side="right"))
+
+    #
+    return WindowedDistancesMatrix(starts, ends)